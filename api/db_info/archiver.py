@@ -0,0 +1,131 @@
+import asyncio
+import os
+import socket
+import uuid
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import async_crud, database, models, uploads
+
+# Periodic archiving of 'retrieved' items, run in-process by every API worker. A lease row in the database makes
+# sure only one worker sweeps at a time: the holder renews it on every sweep, and another worker takes over once
+# it expires (e.g. the holder was stopped). The sweep also fails the image uploads lost with their worker.
+
+ARCHIVER_ENABLED = os.getenv("ARCHIVER_ENABLED", "true").lower() == "true"
+ARCHIVER_INTERVAL = float(os.getenv("ARCHIVER_INTERVAL", 300))
+ARCHIVER_LEASE_TTL = float(os.getenv("ARCHIVER_LEASE_TTL", 2 * ARCHIVER_INTERVAL))
+ARCHIVER_LEASE_NAME = "archiver"
+
+worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+archiver_task: Optional[asyncio.Task] = None
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo = None)
+
+async def acquire_lease(db: AsyncSession, name: str, owner: str, ttl: float) -> bool:
+    """
+    Take or renew a lease. It succeeds if the lease is free, expired or already held by the owner.
+
+    :param db: The async database session object.
+    :param name: The name of the lease.
+    :param owner: The worker asking for the lease.
+    :param ttl: How long the lease lasts, in seconds, unless renewed.
+    :return: True if the owner holds the lease, False if another worker does.
+    """
+    now = utcnow()
+    expires_at = now + timedelta(seconds = ttl)
+    result = await db.execute(update(models.Lease)
+                              .where(models.Lease.name == name,
+                                     or_(models.Lease.owner == owner, models.Lease.expires_at < now))
+                              .values(owner = owner, expires_at = expires_at))
+    if result.rowcount == 0:
+        # Either nobody ever took the lease, or another worker holds it and the insert fails
+        db.add(models.Lease(name = name, owner = owner, expires_at = expires_at))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return False
+        return True
+    await db.commit()
+    return True
+
+async def release_lease(db: AsyncSession, name: str, owner: str):
+    """
+    Give up a lease held by the owner, so another worker can take it over without waiting for it to expire.
+
+    :param db: The async database session object.
+    :param name: The name of the lease.
+    :param owner: The worker holding the lease.
+    :return: None
+    """
+    await db.execute(delete(models.Lease).where(models.Lease.name == name, models.Lease.owner == owner))
+    await db.commit()
+
+async def sweep(session_factory: Optional[async_sessionmaker] = None, owner: str = worker_id) -> Optional[int]:
+    """
+    Run one archiving sweep if this worker holds the archiver lease.
+
+    :param session_factory: The async session factory of the primary database. Defaults to database.AsyncSessionLocal.
+    :param owner: The worker running the sweep.
+    :return: The number of archived items, or None if another worker holds the lease.
+    """
+    session_factory = session_factory or database.AsyncSessionLocal
+    async with session_factory() as db:
+        if not await acquire_lease(db, ARCHIVER_LEASE_NAME, owner, ARCHIVER_LEASE_TTL):
+            return None
+        failed = await uploads.fail_stale_uploads(db)
+        if failed:
+            print(f"ERROR:\tMarked {failed} image uploads lost with their worker as failed")
+        return await async_crud.archive_retrieved_items(db)
+
+async def run_archiver(interval: float = ARCHIVER_INTERVAL):
+    """
+    Sweep every `interval` seconds until cancelled. Errors are logged and the next sweep runs as scheduled.
+
+    :param interval: The time between sweeps, in seconds.
+    :return: None
+    """
+    while True:
+        try:
+            archived = await sweep()
+            if archived:
+                print(f"INFO:\tArchived {archived} retrieved items")
+        except Exception as e:
+            print(f"ERROR:\tArchiving sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+def start_archiver():
+    """
+    Start the archiver in the background. Called on application startup.
+
+    :return: None
+    """
+    global archiver_task
+    if ARCHIVER_ENABLED and archiver_task is None:
+        archiver_task = asyncio.create_task(run_archiver())
+
+async def stop_archiver():
+    """
+    Stop the archiver and release its lease. Called on application shutdown.
+
+    :return: None
+    """
+    global archiver_task
+    if archiver_task is None:
+        return
+    archiver_task.cancel()
+    try:
+        await archiver_task
+    except asyncio.CancelledError:
+        pass
+    archiver_task = None
+    try:
+        async with database.AsyncSessionLocal() as db:
+            await release_lease(db, ARCHIVER_LEASE_NAME, worker_id)
+    except Exception as e:
+        print(f"ERROR:\tCould not release the archiver lease: {e}")
@@ -0,0 +1,192 @@
+import os
+
+from typing import Optional, Tuple
+from datetime import datetime
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from . import matching, models, schemas, contact, crud, uploads
+
+# Asyncio counterparts of the functions in crud.py, used by the API endpoints. Queries are shared with crud.py
+# through its *_statement builders. Blocking S3 calls are pushed to the threadpool so they never stall the event
+# loop, and emails are queued in the outbox with the item change (see contact.py and mailer.py).
+
+async def archive_retrieved_items(db: AsyncSession, cutoff: Optional[datetime] = None) -> int:
+    """
+    Archive the 'retrieved' items retrieved more than ARCHIVE_AFTER_DAYS ago with a single UPDATE.
+
+    :param db: The async database session object.
+    :param cutoff: Items retrieved before this date are archived. Defaults to ARCHIVE_AFTER_DAYS days ago.
+    :return: The number of archived items.
+    """
+    if cutoff == None:
+        cutoff = datetime.now() - crud.ARCHIVE_AFTER
+    result = await db.execute(crud.archive_statement(cutoff))
+    await db.commit()
+    return result.rowcount
+
+async def get_items(db: AsyncSession) -> Select:
+    """
+    :param db: The async database session object.
+    :return: The SELECT statement of all items, newest first, to be paginated by the caller.
+    """
+    return crud.items_statement()
+
+async def get_item_by_id(db: AsyncSession, id: int) -> Optional[models.Item]:
+    """
+    :param db: The async database session object.
+    :param id: The ID of the item to retrieve.
+    :return: The item with the specified ID if found, otherwise None.
+    """
+    return await db.scalar(select(models.Item).where(models.Item.id == id))
+
+async def get_stored_items(db: AsyncSession, filter: dict) -> Select:
+    """
+    :param db: The async database session object.
+    :param filter: A dictionary containing the optional "tag" and "dropoff_point_id" filter criteria.
+    :return: The SELECT statement of the stored items that match the filter criteria, newest first.
+    """
+    return crud.stored_items_statement(filter)
+
+async def get_dropoff_point_items(db: AsyncSession, dropoff_point_id: int, filter: dict) -> Select:
+    """
+    :param db: The async database session object.
+    :param dropoff_point_id: The ID of the dropoff point.
+    :param filter: A dictionary specifying filters for the items. Supported filters are "tag" and "state".
+    :return: The SELECT statement of the items matching the specified criteria, newest first.
+    """
+    return crud.dropoff_point_items_statement(dropoff_point_id, filter)
+
+async def search_items(db: AsyncSession, query: str, filter: dict) -> Select:
+    """
+    :param db: The async database session object.
+    :param query: The search query typed by the user.
+    :param filter: A dictionary specifying filters for the items. Supported filters are "state" and "dropoff_point_id".
+    :return: The SELECT statement of the items matching every word of the query, most relevant first.
+    """
+    return crud.search_items_statement(query, filter, db.get_bind().dialect.name)
+
+async def spool_image(db: AsyncSession, image) -> Tuple[str, str, Optional[str]]:
+    """
+    Spool an uploaded image and look up the items with the same picture, see crud.spool_image.
+
+    :param db: The async database session.
+    :param image: The uploaded image, a fastapi UploadFile.
+    :return: The content-addressed key of the image, the image status of a new item referring to it, and the path of
+             the spool file to upload, or None if the image does not need to be uploaded.
+    """
+    path, key = await run_in_threadpool(uploads.spool, image)
+    image_status, upload = crud.shared_image_status((await db.scalars(crud.image_statuses_statement(key))).all())
+    if not upload:
+        os.unlink(path)
+        path = None
+    return key, image_status, path
+
+async def create_item(db: AsyncSession, new_item: schemas.ItemCreate) -> models.Item:
+    """
+    Create an item in the database. Its image is uploaded in the background once the item is committed, unless the
+    same picture is already stored, see uploads.py.
+
+    :param db: The async database session to use.
+    :param new_item: The item to create, defined by the schemas.ItemCreate model.
+    :return: The created item, defined by the models.Item model.
+    """
+    image_status = spooled_image = None
+    if new_item.image != None:
+        new_item.image, image_status, spooled_image = await spool_image(db, new_item.image)
+
+    db_item = models.Item(description = new_item.description,
+                          tag = new_item.tag,
+                          image = new_item.image,
+                          image_status = image_status,
+                          state = "stored",
+                          dropoff_point_id = new_item.dropoff_point_id,
+                          report_email = None,
+                          retrieved_email = None,
+                          retrieved_date = None)
+
+    reports = await db.run_sync(matching.similar_reports, new_item.description, new_item.tag)
+    contact.send_reported_emails(db, reports, new_item)
+
+    db.add(db_item)
+    await db.commit()
+    await db.refresh(db_item)
+    if spooled_image != None:
+        await run_in_threadpool(uploads.submit, db_item.id, db_item.image, spooled_image)
+    return db_item
+
+async def report_item(db: AsyncSession, new_item: schemas.ItemReport) -> models.Item:
+    """
+    Report a new lost item and store it in the database.
+
+    :param db: The async database session object.
+    :param new_item: The item to be reported.
+    :return: The newly created item.
+    """
+    image_status = spooled_image = None
+    if new_item.image != None:
+        new_item.image, image_status, spooled_image = await spool_image(db, new_item.image)
+
+    db_item = models.Item(description = new_item.description,
+                          tag = new_item.tag,
+                          image = new_item.image,
+                          image_status = image_status,
+                          state = "reported",
+                          dropoff_point_id = None,
+                          report_email = new_item.report_email,
+                          retrieved_email = None,
+                          retrieved_date = None)
+
+    db.add(db_item)
+    matches = await db.run_sync(matching.similar_stored_items, db_item.description, db_item.tag)
+    contact.contact_new_report(db, db_item, matches)
+    await db.commit()
+    await db.refresh(db_item)
+    if spooled_image != None:
+        await run_in_threadpool(uploads.submit, db_item.id, db_item.image, spooled_image)
+
+    return db_item
+
+async def retrieve_item(db: AsyncSession, id: int, retrieved_email: str) -> Optional[models.Item]:
+    """
+    Mark a 'stored' item as 'retrieved' by the given email and notify them.
+
+    :param db: The async database session object.
+    :param id: The ID of the item to retrieve.
+    :param retrieved_email: The email of the person retrieving the item.
+    :return: The retrieved item if it exists, otherwise None.
+    """
+    db_item = await get_item_by_id(db, id)
+    if db_item == None:
+        return None
+    if db_item.state == "stored":
+        db_item.state = "retrieved"
+        db_item.retrieved_email = retrieved_email
+        db_item.retrieved_date = datetime.now()
+        contact.contact_netrieved_email(db, db_item)
+        await db.commit()
+        matching.discard(db_item.id)
+
+    return db_item
+
+async def delete_item(db: AsyncSession, id: int) -> Optional[str]:
+    """
+    Deletes an item from the database by its ID.
+
+    :param db: The async database session.
+    :param id: The ID of the item to be deleted.
+    :return: Returns "OK" if the item is deleted successfully, otherwise returns None.
+    """
+    db_item = await get_item_by_id(db, id)
+    if db_item == None:
+        return None
+    await db.delete(db_item)
+    await db.flush()
+    # Items with the same picture share the image, it is deleted with the last of them
+    if db_item.image != None and await db.scalar(crud.image_refcount_statement(db_item.image)) == 0:
+        s3_image_file_name = db_item.image.split('/')[-1]
+        crud.queue_file_deletion(db, s3_image_file_name)
+    await db.commit()
+    matching.discard(id)
+    return "OK"
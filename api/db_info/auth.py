@@ -1,12 +1,250 @@
+import asyncio
+import hashlib
 import os
-import requests
+import threading
+import time
+import httpx
 
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from jose import jwt, JWTError
 from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
 
-def verify_access(request: Request):
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", 3600))
+JWKS_REFRESH_MARGIN = float(os.getenv("JWKS_REFRESH_MARGIN", 300))
+JWKS_MIN_REFETCH_INTERVAL = float(os.getenv("JWKS_MIN_REFETCH_INTERVAL", 30))
+JWKS_FETCH_TIMEOUT = float(os.getenv("JWKS_FETCH_TIMEOUT", 5))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+
+http_client: Optional[httpx.AsyncClient] = None
+
+async def open_http_client():
+    """
+    Open the shared pooled HTTP client used to talk to the token issuer. Called on application startup.
+
+    :return: None
+    """
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(timeout = JWKS_FETCH_TIMEOUT,
+                                        limits = httpx.Limits(max_connections = HTTP_MAX_CONNECTIONS,
+                                                              max_keepalive_connections = HTTP_MAX_CONNECTIONS,
+                                                              keepalive_expiry = HTTP_KEEPALIVE_EXPIRY))
+
+async def close_http_client():
+    """
+    Close the shared HTTP client and its keep-alive connections. Called on application shutdown.
+
+    :return: None
+    """
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+async def fetch(url: str) -> httpx.Response:
+    """
+    GET a URL through the shared HTTP client, or through a short-lived one outside the application lifespan.
+
+    :param url: The URL to fetch.
+    :return: The HTTP response.
+    """
+    if http_client is not None:
+        return await http_client.get(url)
+    async with httpx.AsyncClient(timeout = JWKS_FETCH_TIMEOUT) as client:
+        return await client.get(url)
+
+
+class JWKSKeyStore:
+    """
+    Process-wide cache of an issuer's JSON Web Key Set, indexed by `kid`.
+
+    Keys are kept for `ttl` seconds. Once a lookup happens within `refresh_margin` seconds of the expiry, a
+    background task refetches the set while the current keys keep being served. A token signed with an
+    unknown `kid` forces one refetch (at most once every `min_refetch_interval` seconds while the cached set
+    is still fresh). Concurrent fetches are collapsed into a single HTTP request, including failed ones: callers
+    that waited on a fetch which failed get its error instead of trying again one after the other.
+    """
+    def __init__(self, jwks_url: str, ttl: float = JWKS_CACHE_TTL, refresh_margin: float = JWKS_REFRESH_MARGIN,
+                 min_refetch_interval: float = JWKS_MIN_REFETCH_INTERVAL):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_refetch_interval = min_refetch_interval
+        self.fetch_count = 0
+        self._keys: Dict[str, dict] = {}
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._generation = 0
+        self._fetch_error: Optional[Exception] = None
+        self._fetch_lock = asyncio.Lock()
+        self._refresh_task = None
+
+    async def get_key(self, kid: Optional[str]) -> Optional[dict]:
+        """
+        Get the JWK with the given `kid`, fetching the key set if needed.
+
+        :param kid: The key ID taken from the token header.
+        :return: The JWK as a dictionary, or None if the issuer does not publish that key.
+        :raises httpx.HTTPError: If the key set has never been fetched and the issuer is unreachable.
+        """
+        now = time.monotonic()
+        generation = self._generation
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            if now >= self._expires_at - self.refresh_margin:
+                self.refresh_in_background()
+            return key
+        if key is None and now < self._expires_at and self._fetched_at is not None and \
+        now - self._fetched_at < self.min_refetch_interval:
+            return None
+        try:
+            await self._refetch(generation)
+        except Exception:
+            if not self._keys:
+                raise
+            print(f"ERROR:\tCould not refresh JWKS from {self.jwks_url}, serving cached keys")
+        return self._keys.get(kid)
+
+    def refresh_in_background(self):
+        """
+        Schedule a background refetch of the key set unless one is already running.
+
+        :return: None
+        """
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._background_refresh(self._generation))
+
+    async def _background_refresh(self, generation: int):
+        try:
+            await self._refetch(generation)
+        except Exception as e:
+            print(f"ERROR:\tBackground JWKS refresh failed: {e}")
+
+    async def _refetch(self, generation: int):
+        async with self._fetch_lock:
+            if self._generation != generation:
+                # Another caller tried to fetch the key set while we were waiting on the lock.
+                if self._fetch_error is not None:
+                    raise self._fetch_error
+                return
+            self._fetched_at = time.monotonic()
+            self.fetch_count += 1
+            try:
+                response = await fetch(self.jwks_url)
+                response.raise_for_status()
+                self._keys = {key["kid"]: key for key in response.json()["keys"]}
+                self._expires_at = time.monotonic() + self.ttl
+                self._fetch_error = None
+            except Exception as e:
+                self._fetch_error = e
+                raise
+            finally:
+                # Every attempt ends a generation, failed ones included, so waiters do not repeat it
+                self._generation += 1
+
+_key_stores: Dict[str, JWKSKeyStore] = {}
+
+def get_key_store(issuer: str) -> JWKSKeyStore:
+    """
+    Get the process-wide JWKS key store of an issuer, creating it on first use.
+
+    :param issuer: The token issuer URL.
+    :return: The issuer's JWKSKeyStore.
+    """
+    if issuer not in _key_stores:
+        _key_stores[issuer] = JWKSKeyStore(f"{issuer}/.well-known/jwks.json")
+    return _key_stores[issuer]
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of the claims of already verified tokens.
+
+    Entries are keyed by the SHA-256 digest of the token, so raw bearer tokens are never kept in memory, and
+    each entry expires at the token's `exp` claim. Hits and misses are counted for monitoring.
+    """
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """
+        Get the cached claims of a token.
+
+        :param token: The raw bearer token.
+        :return: The decoded claims, or None if the token is not cached or has expired.
+        """
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, claims: dict):
+        """
+        Cache the claims of a verified token until its `exp` claim. Tokens without `exp` are not cached.
+
+        :param token: The raw bearer token.
+        :param claims: The claims returned by jwt.decode.
+        :return: None
+        """
+        if self.maxsize <= 0 or "exp" not in claims:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (float(claims["exp"]), claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        """
+        Remove every entry and reset the counters.
+
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        :return: A dictionary with the cache size, hits, misses and hit ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries),
+                    "maxsize": self.maxsize,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+token_cache = VerifiedTokenCache()
+
+async def verify_access(request: Request):
     """
-    Verify access by checking the authorization token in the request header.
+    Verify access by checking the authorization token in the request header. Used as a FastAPI dependency
+    by the authenticated endpoints.
 
     :param request: The request object containing the headers.
     :return: The decoded access token if it is valid and authorized.
@@ -17,14 +255,21 @@ def verify_access(request: Request):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail = "ERROR: Authorization header missing")
     try:
         token = authorization.split(" ")[1]
+        cached_token = token_cache.get(token)
+        if cached_token is not None:
+            return cached_token
         issuer = os.getenv('COGNITO_ISSUER')
         audience = os.getenv('COGNITO_AUDIENCE')
-        response = requests.get(f"{issuer}/.well-known/jwks.json")
-        jwks = response.json()["keys"]
-        decoded_token = jwt.decode(token, jwks, algorithms=["RS256"],
-                                   audience = audience, issuer = issuer)
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = await get_key_store(issuer).get_key(kid)
+        if key is None:
+            raise JWTError("Unknown signing key")
+        # RS256 verification is CPU bound, keep it off the event loop
+        decoded_token = await run_in_threadpool(jwt.decode, token, key, algorithms=["RS256"],
+                                                audience = audience, issuer = issuer)
+        token_cache.put(token, decoded_token)
         return decoded_token
     except JWTError:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = "ERROR: Invalid Access token")
     except Exception:
-        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "ERROR: Error authenticating")
\ No newline at end of file
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "ERROR: Error authenticating")
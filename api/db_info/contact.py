@@ -1,48 +1,81 @@
-import smtplib
-import os
-
+from typing import List, Optional
+from sqlalchemy import Row
 from sqlalchemy.orm import Session
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from . import models, schemas
+from . import matching, models, schemas
+
+# The emails are not sent here: they are added to the email_outbox table in the caller's session, so they are
+# committed or rolled back with the item change they notify about, and delivered by the mailer (see mailer.py).
 
 def contact_reported_email(db: Session, new_item: schemas.ItemCreate):
     """
-    Sends an email to users who have reported similar items.
+    Sends an email to users who have reported items similar to the new one, ranked by matching.similar_reports.
 
     :param db: The database session.
-    :param new_item: The new item being reported.
+    :param new_item: The new item being stored.
+    :return: None
+    """
+    send_reported_emails(db, matching.similar_reports(db, new_item.description, new_item.tag), new_item)
+
+def send_reported_emails(db: Session, stored_reports: List[Row], new_item: schemas.ItemCreate):
+    """
+    Sends the "item found" email about a new item to the authors of the given reports, once per address.
+
+    The emails are queued under the ITEMS_FOUND_DIGEST key: the mailer holds them for MAILER_DIGEST_WINDOW seconds
+    and merges the ones queued for the same address meanwhile, so someone whose report matches a whole batch of
+    items logged at a drop-off point gets a single email listing them all.
+
+    :param db: The database session the emails are queued in (a Session or an AsyncSession).
+    :param stored_reports: The reported items similar to the new item, most similar first.
+    :param new_item: The new item being stored.
     :return: None
     """
-    stored_reports = [
-        item for item in db.query(models.Item).filter(models.Item.tag == new_item.tag).all()
-        if item.report_email != None
-    ]
-    for report in stored_reports:
-        notified_mails = []
-        if report.report_email not in notified_mails:
-            
-            subject = "O teu item foi UAchado!"
-            message = f"""Um item parecido ao que reportaste acabou de ser UAchado num dos nossos pontos.\n
+    found_item = f"Item: {new_item.tag}\nDescrição: {new_item.description}\n"
+    for email in dict.fromkeys(report.report_email for report in stored_reports):
+        send_email(db, email, ITEMS_FOUND_SUBJECT, found_item, digest_key = ITEMS_FOUND_DIGEST)
+
+def items_found_message(found_items: List[str]) -> str:
+    """
+    Writes the body of the "item found" digest.
+
+    :param found_items: The description of each found item, as queued by send_reported_emails.
+    :return: The body of the email.
+    """
+    if len(found_items) == 1:
+        intro = "Um item parecido ao que reportaste acabou de ser UAchado num dos nossos pontos."
+    else:
+        intro = f"{len(found_items)} itens parecidos ao que reportaste acabaram de ser UAchados nos nossos pontos."
+    found_items = "\n".join(found_items)
+    return f"""{intro}\n
 Dá uma olhada, pode ser que seja teu em https://uachado.pt/findItems !\n\n
 
-Item: {report.tag}\n
-Descrição: {report.description}\n\n
+{found_items}\n
 
 na UA, nada se perde, tudo se UAcha\n\n
 
 Cumprimentos,\n
 Equipa do UAchado"""
-            send_email(report.report_email, subject, message)
 
-            notified_mails.append(report.report_email)
+ITEMS_FOUND_SUBJECT = "O teu item foi UAchado!"
+ITEMS_FOUND_DIGEST = "items_found"
+
+# The digests the mailer merges emails into: the bodies queued under a key are passed to its function, oldest first
+DIGESTS = {ITEMS_FOUND_DIGEST: items_found_message}
 
-def contact_new_report(report: schemas.ItemReport):
+def contact_new_report(db: Session, report: schemas.ItemReport, matches: Optional[List[Row]] = None):
     """
+    :param db: The database session the email is queued in (a Session or an AsyncSession).
+    :type db: Session
     :param report: The item report to be processed and sent in an email.
     :type report: schemas.ItemReport
+    :param matches: The stored items similar to the reported one, most similar first, listed in the email.
+    :type matches: Optional[List[Row]]
     :return: None
     """
+    similar_items = ""
+    if matches:
+        similar_items = "Estes itens já UAchados são parecidos ao teu:\n" + \
+            "".join(f"- {item.tag}: {item.description}\n" for item in matches) + "\n\n"
+
     subject = "O teu report foi adicionado!"
     message = f"""O teu relatório de perda acabou de chegar ao UAchado.\n\n
 
@@ -50,7 +83,7 @@ Item: {report.tag}\n
 Descrição: {report.description}\n
 Email: {report.report_email}\n\n
 
-Assim que encontrarmos um item que possa ser o teu entraremos em contacto.\n
+{similar_items}Assim que encontrarmos um item que possa ser o teu entraremos em contacto.\n
 Vai vendo a nossa aplicação em https://uachado.pt/findItems para veres se algum item é parecido ao teu.\n
 Tem atenção à tua caixa de correio. O nosso mail pode ser reencaminhado para o teu spam.\n\n
 
@@ -59,12 +92,13 @@ na UA, nada se perde, tudo se UAcha\n\n
 Cumprimentos,\n
 Equipa do UAchado"""
 
-    send_email(report.report_email, subject, message)
+    send_email(db, report.report_email, subject, message)
 
-def contact_netrieved_email(item: schemas.Item):
+def contact_netrieved_email(db: Session, item: schemas.Item):
     """
     Sends an email to the retrieved email address of the item.
 
+    :param db: The database session the email is queued in (a Session or an AsyncSession).
     :param item: Item object with retrieved email address, tag, description, and retrieved date.
     :return: None
     """
@@ -74,7 +108,7 @@ def contact_netrieved_email(item: schemas.Item):
 Item: {item.tag}\n
 Descrição: {item.description}\n
 Email: {item.retrieved_email}\n
-Data: {item.retrieved_date[0:10]}\n\n
+Data: {item.retrieved_date:%Y-%m-%d}\n\n
 
 Qualquer dúvida entra em contacto com a equipa do UAchado em uachadomachado@gmail.com!\n\n
 
@@ -84,36 +118,24 @@ na UA, nada se perde, tudo se UAcha\n\n
 Cumprimentos,\n
 Equipa do UAchado"""
 
-    send_email(item.retrieved_email, subject, message)
+    send_email(db, item.retrieved_email, subject, message)
 
-def send_email(email: str, subject: str, message: str):
+def send_email(db: Session, email: str, subject: str, message: str, digest_key: Optional[str] = None):
     """
-    Sends an email to the specified email address with the given subject and message.
+    Queues an email to the specified email address with the given subject and message. It is delivered once the
+    session is committed.
 
+    :param db: The database session the email is queued in (a Session or an AsyncSession).
+    :type db: Session
     :param email: The email address to send the email to.
     :type email: str
     :param subject: The subject of the email.
     :type subject: str
-    :param message: The body of the email.
+    :param message: The body of the email, or its part in the digest.
     :type message: str
+    :param digest_key: The key in DIGESTS of the digest the email is merged into, if any.
+    :type digest_key: Optional[str]
     :return: None
     """
-    try:
-        username = os.environ.get("EMAIL_USERNAME")
-        password = os.environ.get("EMAIL_PASSWORD")
-        
-        msg = MIMEMultipart()
-        msg["From"] = username
-        msg["To"] = email
-        msg["Subject"] = subject
-        msg.attach(MIMEText(message, "plain"))
-            
-        with smtplib.SMTP(os.environ.get("SMTP_SERVER"), int(os.environ.get("SMTP_PORT", int()))) as server:
-            server.starttls()
-            server.login(username, password)
-            server.send_message(msg)
-            print(f"INFO:\tEMAIL SENT TO: {email}")
-    except smtplib.SMTPServerDisconnected:
-        print("ERROR:\tServer disconnected unexpectedly.")
-    except Exception as e:
-        print(f"ERROR:\t{e}")
\ No newline at end of file
+    db.add(models.EmailOutbox(recipient = email, subject = subject, body = message, digest_key = digest_key,
+                              status = "pending", attempts = 0))
@@ -1,187 +1,394 @@
-import boto3
 import os
-import uuid
-
-from typing import List, Optional
-from fastapi.responses import StreamingResponse
+import re
+import shutil
+
+from typing import Optional, Tuple, Union
+from email.utils import format_datetime
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import Select, Update, column, false, func, literal_column, or_, select, table, update
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError, NoCredentialsError
+from . import image_cache, images, matching, models, schemas, contact, storage, uploads
 
-from botocore.exceptions import NoCredentialsError
-from . import models, schemas, contact
+ARCHIVE_AFTER = timedelta(days = float(os.getenv("ARCHIVE_AFTER_DAYS", 7)))
 
-def get_s3():
+def get_s3() -> storage.InstrumentedS3Client:
     """
-    Returns a boto3 S3 client with the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
-    environment variables.
+    Returns the S3 client shared by the process, see storage.py.
 
     :return: The S3 client
     """
-    return boto3.client(
-        's3',
-        aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-    )
+    return storage.get_client()
 
-def upload_file_to_s3(file, s3_file_name):
+def delete_file_from_s3(s3_file_name):
     """
-    Uploads a file to an S3 bucket.
-
-    :param file: The file object to be uploaded.
-    :param s3_file_name: The desired file name to be used in the S3 bucket.
-    :return: Returns the file name if successfully uploaded, otherwise returns None.
+    Delete an image and its thumbnails from AWS S3.
 
-    :raises FileNotFoundError: If the file is not found.
-    :raises NoCredentialsError: If the AWS credentials are not found.
-    :raises Exception: If any other error occurs during file upload.
+    :param s3_file_name: The name of the file to be deleted from S3.
+    :return: True if the files were successfully deleted, False otherwise.
     """
     s3 = get_s3()
+    keys = images.variant_keys(s3_file_name)
+    for key in keys:
+        storage.presigned_urls.discard(key)
+        image_cache.discard(key)
     try:
-        bucket_name = os.getenv('AWS_BUCKET_NAME')
-        s3.upload_fileobj(file.file, bucket_name, s3_file_name)
-        return s3_file_name
-    except FileNotFoundError:
-        print("ERROR:\tFileNotFoundError")
-        return None
-    except NoCredentialsError:
-        print("ERROR:\tNoCredentialsError")
-        return None
+        response = s3.delete_objects(Bucket=os.getenv('AWS_BUCKET_NAME'),
+                                     Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+        return not response.get('Errors')
     except Exception:
-        return None
+        print("ERROR:\tException")
+        return False
 
-def delete_file_from_s3(s3_file_name):
+def queue_file_deletion(db: Union[Session, AsyncSession], s3_file_name):
     """
-    Delete a file from AWS S3.
+    Queue an image and its thumbnails for deletion from AWS S3 in the transaction of the session. Once it is
+    committed, the deleter deletes them in the background, in batches (see deleter.py). The cached copies and
+    presigned URLs are dropped right away.
 
+    :param db: The database session, sync or async.
     :param s3_file_name: The name of the file to be deleted from S3.
-    :return: True if the file was successfully deleted, False otherwise.
+    :return: None
     """
-    s3 = get_s3()
-    try:
-        s3.delete_object(Bucket=os.getenv('AWS_BUCKET_NAME'), Key=s3_file_name)
-        return True
-    except Exception:
-        print("ERROR:\tException")
+    for key in images.variant_keys(s3_file_name):
+        storage.presigned_urls.discard(key)
+        image_cache.discard(key)
+        db.add(models.PendingDelete(key = key))
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """
+    Check an If-None-Match header against the ETag of an image, with the weak comparison of RFC 9110.
+
+    :param if_none_match: The If-None-Match header of the request.
+    :param etag: The ETag of the image, without quotes.
+    :return: True if the client already has the image.
+    """
+    if not if_none_match or not etag:
         return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/").strip('"') == etag for tag in if_none_match.split(","))
+
+def byte_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse the Range header of a request for a single byte range.
+
+    :param range_header: The Range header of the request.
+    :param size: The size of the image.
+    :return: The first and last byte of the range, or None to serve the whole image, e.g. for several ranges.
+    :raises ValueError: If the range does not overlap the image.
+    """
+    found = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if found == None or found.group(1) == found.group(2) == "":
+        return None
+    if found.group(1) == "":
+        start, end = max(size - int(found.group(2)), 0), size - 1
+    else:
+        start = int(found.group(1))
+        end = min(int(found.group(2)), size - 1) if found.group(2) else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {size} bytes")
+    return start, end
+
+def image_headers(etag: Optional[str], last_modified: Optional[datetime]) -> dict:
+    """
+    :param etag: The ETag of an image, without quotes.
+    :param last_modified: The time the image was uploaded, timezone aware.
+    :return: The validators and caching headers of the responses serving the image.
+    """
+    headers = {'Cache-Control': storage.IMAGE_CACHE_CONTROL, 'Accept-Ranges': 'bytes'}
+    if etag:
+        headers['ETag'] = f'"{etag}"'
+    if last_modified != None:
+        headers['Last-Modified'] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def read_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+    """
+    Read a range of a file in chunks.
+
+    :param path: The path of the file.
+    :param start: The first byte of the range.
+    :param end: The last byte of the range.
+    :param chunk_size: The maximum size of the chunks.
+    :return: A generator of the chunks of the range.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def cached_image_response(image: image_cache.CachedImage,
+                          if_none_match: Optional[str] = None,
+                          range_header: Optional[str] = None) -> Response:
+    """
+    Serve an image from the local image cache.
+
+    :param image: The cached image.
+    :param if_none_match: The If-None-Match header of the request.
+    :param range_header: The Range header of the request.
+    :return: A 304 response if the client has the image, a 206 response with the requested range, or a
+             FileResponse object serving the whole image.
+    """
+    headers = image_headers(image.etag, datetime.fromtimestamp(image.modified, timezone.utc))
+    if etag_matches(if_none_match, image.etag):
+        return Response(status_code=304, headers=headers)
+    try:
+        span = byte_range(range_header, image.size)
+    except ValueError:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{image.size}'})
+    if span != None:
+        start, end = span
+        headers.update({'Content-Range': f'bytes {start}-{end}/{image.size}', 'Content-Length': str(end - start + 1)})
+        return StreamingResponse(read_file_range(image.path, start, end), status_code=206,
+                                 media_type=image.content_type, headers=headers)
+    return FileResponse(image.path, media_type=image.content_type, headers=headers)
+
+def s3_image_response(uuid: str, if_none_match: Optional[str] = None, range_header: Optional[str] = None) -> Response:
+    """
+    Stream an image from Amazon S3, forwarding the If-None-Match header and a single byte range to S3.
+
+    :param uuid: The unique identifier of the image.
+    :param if_none_match: The If-None-Match header of the request.
+    :param range_header: The Range header of the request.
+    :return: A 304 response if the client has the image, otherwise a StreamingResponse object containing the
+             image data, or the requested range of it.
+    """
+    request = {'Bucket': os.getenv('AWS_BUCKET_NAME'), 'Key': uuid}
+    if if_none_match:
+        request['IfNoneMatch'] = if_none_match
+    if range_header and re.fullmatch(r"bytes=(\d+-\d*|-\d+)", range_header.strip()):
+        request['Range'] = range_header.strip()
+
+    try:
+        response = get_s3().get_object(**request)
+    except ClientError as error:
+        metadata = error.response.get('ResponseMetadata', {})
+        if metadata.get('HTTPStatusCode') == 304:
+            # S3 sends the ETag back, otherwise the client sent the one it has
+            etag = metadata.get('HTTPHeaders', {}).get('etag', if_none_match)
+            return Response(status_code=304, headers=image_headers(etag.strip('"') if ',' not in etag else None, None))
+        if metadata.get('HTTPStatusCode') == 416:
+            return Response(status_code=416)
+        raise
+
+    headers = image_headers(response['ETag'].strip('"'), response.get('LastModified'))
+    headers['Content-Length'] = str(response['ContentLength'])
+    if 'ContentRange' in response:
+        headers['Content-Range'] = response['ContentRange']
+    return StreamingResponse(response['Body'], status_code=206 if 'ContentRange' in response else 200,
+                             media_type=response['ContentType'], headers=headers)
+
+def get_image_from_s3(uuid: str, if_none_match: Optional[str] = None, range_header: Optional[str] = None) -> Response:
+    """
+    Get an image from Amazon S3, through the local image cache when it is enabled (see image_cache.py).
 
-def get_image_from_s3(uuid: str) -> StreamingResponse:
+    Images are immutable, so they are served with their S3 ETag and a long-lived Cache-Control. A request with a
+    matching If-None-Match header gets a 304, and a request for a single byte range gets a 206. Conditional and
+    range requests for an image that is not cached are forwarded to S3 rather than downloading the image.
+
+    :param uuid: The unique identifier of the image.
+    :type uuid: str
+    :param if_none_match: The If-None-Match header of the request.
+    :type if_none_match: Optional[str]
+    :param range_header: The Range header of the request.
+    :type range_header: Optional[str]
+    :return: A FileResponse or StreamingResponse object containing the image data, or an empty 304 response.
+    :rtype: Response
+    """
+    cache = image_cache.get_cache()
+    if cache is not None and cache.accepts(uuid):
+        image = cache.lookup(uuid)
+        if image == None and not if_none_match and not range_header:
+            def fetch(file) -> Tuple[str, Optional[str], Optional[datetime]]:
+                response = get_s3().get_object(Bucket=os.getenv('AWS_BUCKET_NAME'), Key=uuid)
+                shutil.copyfileobj(response['Body'], file)
+                return response['ContentType'], response['ETag'].strip('"'), response.get('LastModified')
+
+            image = cache.get(uuid, fetch)
+        if image != None:
+            return cached_image_response(image, if_none_match, range_header)
+    return s3_image_response(uuid, if_none_match, range_header)
+
+def get_image_url(uuid: str) -> Tuple[str, float]:
     """
-    Get an image from Amazon S3.
+    Get a short-lived presigned URL of an image in Amazon S3, reused across calls until shortly before it expires.
 
     :param uuid: The unique identifier of the image.
     :type uuid: str
-    :return: A StreamingResponse object containing the image data.
-    :rtype: StreamingResponse
+    :return: The presigned URL, and for how many seconds it can still be handed out.
+    :rtype: Tuple[str, float]
     """
-    s3_client = get_s3()
-    bucket_name = os.getenv('AWS_BUCKET_NAME')
+    return storage.presigned_url(os.getenv('AWS_BUCKET_NAME'), uuid)
 
-    response = s3_client.get_object(Bucket=bucket_name, Key=uuid)
-    return StreamingResponse(response['Body'], media_type=response['ContentType'])
+def archive_statement(cutoff: datetime) -> Update:
+    """
+    Build the set-based UPDATE archiving the 'retrieved' items retrieved before the cutoff.
+
+    :param cutoff: Items retrieved before this date are archived.
+    :return: An UPDATE statement usable with both Session and AsyncSession.
+    """
+    return update(models.Item) \
+        .where(models.Item.state == "retrieved", models.Item.retrieved_date < cutoff) \
+        .values(state = "archived") \
+        .execution_options(synchronize_session = False)
 
-def update_retrieved_to_archived_items(db: Session, items: List[models.Item]):
+def archive_retrieved_items(db: Session, cutoff: Optional[datetime] = None) -> int:
     """
+    Archive the 'retrieved' items retrieved more than ARCHIVE_AFTER_DAYS ago with a single UPDATE. Run
+    periodically by the archiver (see archiver.py) instead of on the read paths.
+
     :param db: The database session object.
-    :param items: A list of Item objects to be updated.
-    :return: A boolean indicating whether any items were updated.
+    :param cutoff: Items retrieved before this date are archived. Defaults to ARCHIVE_AFTER_DAYS days ago.
+    :return: The number of archived items.
+    """
+    if cutoff == None:
+        cutoff = datetime.now() - ARCHIVE_AFTER
+    result = db.execute(archive_statement(cutoff))
+    db.commit()
+    return result.rowcount
 
-    This method takes in a database session object and a list of Item objects. It iterates through each item in the list and checks if the retrieved_date is not None and if it is older than
-    * one week from the current datetime. If both conditions are met, the item's state is set to "archived", removed from the original items list, and added to the update_items list. A flag
-    * is set to True if any items were updated.
+def items_statement() -> Select:
+    """
+    Build the query of all items, newest first. Ties on insertion date are broken by id, so the order is total
+    and can be used for keyset pagination (see pagination.py).
 
-    If the flag is True, the update_items list is flushed to the database and committed. Finally, the method returns the flag indicating whether any items were updated.
+    :return: A SELECT statement usable with both Session and AsyncSession.
     """
-    flag = False
-    update_items = []
-    for item in items:
-        if item.retrieved_date != None and \
-        datetime.strptime(item.retrieved_date, '%Y-%m-%d %H:%M:%S.%f') + timedelta(weeks=1) < datetime.now():
-            item.state = "archived"
-            items.remove(item)
-            update_items.append(item)
-            flag = True
-    if flag:
-        db.flush(update_items)
-        db.commit()
-    return flag
+    return select(models.Item).order_by(models.Item.insertion_date.desc(), models.Item.id.desc())
 
-def get_items(db: Session, update_items: bool = True) -> List[models.Item]:
+def stored_items_statement(filter: dict) -> Select:
     """
-    :param db: The database session used for querying items.
-    :param update_items: A boolean value indicating whether to update retrieved items to archived items.
-    :return: A list of Item objects.
+    Build the query of the 'stored' items matching the optional "tag" and "dropoff_point_id" filters, newest first.
 
-    This method queries the database for all items, ordered by insertion date in descending order. If the update_items parameter is True and there are retrieved items, those items will be
-    * updated to archived items using the update_retrieved_to_archived_items() method. After the update, the method queries the database again to retrieve all items.
+    :param filter: A dictionary containing filter criteria for the query.
+    :return: A SELECT statement usable with both Session and AsyncSession.
+    """
+    statement = select(models.Item).where(models.Item.state == "stored")
+    if ("tag" in filter):
+        statement = statement.where(models.Item.tag == filter["tag"])
+    if ("dropoff_point_id" in filter):
+        statement = statement.where(models.Item.dropoff_point_id == filter["dropoff_point_id"])
+    return statement.order_by(models.Item.insertion_date.desc(), models.Item.id.desc())
+
+def dropoff_point_items_statement(dropoff_point_id: int, filter: dict) -> Select:
+    """
+    Build the query of the items of a drop-off point matching the optional "tag" and "state" filters, newest first.
+
+    :param dropoff_point_id: The ID of the dropoff point.
+    :param filter: A dictionary specifying filters for the items. Supported filters are "tag" and "state".
+    :return: A SELECT statement usable with both Session and AsyncSession.
+    """
+    statement = select(models.Item).where(models.Item.dropoff_point_id == dropoff_point_id)
+    if ("tag" in filter):
+        statement = statement.where(models.Item.tag == filter["tag"])
+    if ("state" in filter):
+        statement = statement.where(models.Item.state == filter["state"])
+    return statement.order_by(models.Item.insertion_date.desc(), models.Item.id.desc())
+
+def search_terms(query: str) -> list:
+    """
+    Split a search query into its words, dropping the operators and punctuation of the full-text query syntaxes.
+
+    :param query: The search query typed by the user.
+    :return: The words of the query.
+    """
+    return re.findall(r"\w+", query)
+
+def search_items_statement(query: str, filter: dict, dialect: str) -> Select:
+    """
+    Build the full-text search of the items whose description or tag contain every word of the query, the last
+    one as a prefix, most relevant first. The index is MySQL's FULLTEXT index or SQLite's items_fts table (see
+    models.py). On other dialects the words are matched with LIKE and the items sorted newest first.
+
+    :param query: The search query typed by the user.
+    :param filter: A dictionary specifying filters for the items. Supported filters are "state" and "dropoff_point_id".
+    :param dialect: The name of the dialect of the database the statement runs on.
+    :return: A SELECT statement usable with both Session and AsyncSession.
+    """
+    terms = search_terms(query)
+    statement = select(models.Item)
+    if (not terms):
+        statement = statement.where(false())
+    elif (dialect == "sqlite"):
+        fts = table("items_fts", column("rowid"), column("rank"))
+        fts_query = " ".join(f'"{term}"' for term in terms) + "*"
+        statement = statement.join(fts, fts.c.rowid == models.Item.id) \
+            .where(literal_column("items_fts").op("MATCH")(fts_query)) \
+            .order_by(fts.c.rank)
+    elif (dialect == "mysql"):
+        relevance = match(models.Item.description, models.Item.tag,
+                          against = " ".join(f"+{term}" for term in terms) + "*").in_boolean_mode()
+        statement = statement.where(relevance > 0).order_by(relevance.desc())
+    else:
+        for term in terms:
+            statement = statement.where(or_(models.Item.description.ilike(f"%{term}%"), models.Item.tag.ilike(f"%{term}%")))
+    if ("state" in filter):
+        statement = statement.where(models.Item.state == filter["state"])
+    if ("dropoff_point_id" in filter):
+        statement = statement.where(models.Item.dropoff_point_id == filter["dropoff_point_id"])
+    return statement.order_by(models.Item.insertion_date.desc(), models.Item.id.desc())
+
+def get_items(db: Session) -> Select:
+    """
+    :param db: The database session object.
+    :return: The SELECT statement of all items, ordered by insertion date in descending order.
+
+    The statement is paginated and executed by the caller, so only the requested page is loaded.
 
     Example usage:
         db = get_db_session()
-        items = get_items(db, update_items=True)
+        items = db.scalars(get_items(db)).all()
     """
-    items = db.query(models.Item).order_by(models.Item.insertion_date.desc()).all()
-    if update_items and any([item.state == "retrieved" for item in items]):
-        updating_items = [item for item in items if item.state == "retrieved"]
-        if update_retrieved_to_archived_items(db, updating_items):
-            items = db.query(models.Item).all()
-    return items
+    return items_statement()
 
-def get_item_by_id(db: Session, id: int, update_items: bool = True) -> Optional[models.Item]:
+def get_item_by_id(db: Session, id: int) -> Optional[models.Item]:
     """
     :param db: The database session object.
     :param id: The ID of the item to retrieve.
-    :param update_items: Determines whether to update the retrieved items or not. Defaults to True.
     :return: The item with the specified ID if found, otherwise None.
 
-    This method retrieves an item from the database based on its ID. If the `update_items` parameter is set to True, it checks if the retrieved item's state is "retrieved" and updates it
-    * to "archived" using the `update_retrieved_to_archived_items` method. The method then returns the retrieved item.
+    This method retrieves an item from the database based on its ID.
     """
-    item = db.query(models.Item).filter(models.Item.id == id).first()
-    if update_items and item != None and item.state == "retrieved":
-        if update_retrieved_to_archived_items(db, [item]):
-            item.state = "archived"
-    return item
+    return db.query(models.Item).filter(models.Item.id == id).first()
 
-def get_stored_items(db: Session, filter: dict):
+def get_stored_items(db: Session, filter: dict) -> Select:
     """
-    :param db: The database session object
+    :param db: The database session object.
     :param filter: A dictionary containing filter criteria for the query
-    :return: A list of stored items that match the filter criteria
-
-    This method retrieves stored items from the database based on the provided filter criteria. The method takes a database session object and a filter dictionary as parameters, and returns
-    * a list of stored items.
+    :return: The SELECT statement of the stored items that match the filter criteria
 
     The filter dictionary can contain the following keys:
     - "tag": Specifies a particular tag value that the items must have
     - "dropoff_point_id": Specifies a particular dropoff point ID that the items must belong to
 
-    If the filter dictionary contains the key "tag", the method filters the items by matching the tag value. If the filter dictionary contains the key "dropoff_point_id", the method filters
-    * the items by matching the dropoff point ID. If no filter criteria are provided, all stored items are returned.
-
-    The items are retrieved from the database using a query with the following conditions:
+    The statement has the following conditions:
     - The item state must be "stored"
     - If the key "tag" is present in the filter dictionary, the item tag must match the specified tag value
     - If the key "dropoff_point_id" is present in the filter dictionary, the item dropoff point ID must match the specified ID
 
-    The items are sorted in descending order based on the insertion date and returned as a list.
+    The items are sorted in descending order based on the insertion date. The statement is paginated and executed by the caller.
     """
-    query = db.query(models.Item).filter(models.Item.state == "stored")
-    if ("tag" in filter):
-        query = query.filter(models.Item.tag == filter["tag"])
-    if ("dropoff_point_id" in filter):
-        query = query.filter(models.Item.dropoff_point_id == filter["dropoff_point_id"])
-    items = query.order_by(models.Item.insertion_date.desc()).all()
-    return items
+    return stored_items_statement(filter)
 
-def get_dropoff_point_items(db: Session, dropoff_point_id: int, filter: dict, update_items: bool = True):
+def get_dropoff_point_items(db: Session, dropoff_point_id: int, filter: dict) -> Select:
     """
 
-    This method retrieves items associated with a specific dropoff point.
+    This method builds the query of the items associated with a specific dropoff point.
 
     :param db: The database session object.
     :param dropoff_point_id: The ID of the dropoff point.
     :param filter: A dictionary specifying filters for the items. Supported filters are "tag" and "state".
-    :param update_items: A boolean value indicating whether to update retrieved items to archived state. Defaults to True.
-    :return: A list of items matching the specified criteria.
+    :return: The SELECT statement of the items matching the specified criteria, newest first.
 
     Example usage:
 
@@ -192,40 +399,84 @@ def get_dropoff_point_items(db: Session, dropoff_point_id: int, filter: dict, up
         "tag": "example",
         "state": "retrieved"
     }
-    items = get_dropoff_point_items(db, dropoff_point_id, filter, update_items=True)
+    items = db.scalars(get_dropoff_point_items(db, dropoff_point_id, filter)).all()
     for item in items:
-        print(item.name)
+        print(item.description)
     ```
 
     """
-    query = db.query(models.Item).filter(models.Item.dropoff_point_id == dropoff_point_id)
-    if ("tag" in filter):
-       query = query.filter(models.Item.tag == filter["tag"])
-    if ("state" in filter):
-        query = query.filter(models.Item.state == filter["state"])
-    items = query.all()
-    
-    if update_items and any([item.state in ["retrieved", "archived"] for item in items]):
-        updating_items = [item for item in items if item.state == "retrieved"]
-        update_retrieved_to_archived_items(db, updating_items) 
-        items = query.order_by(models.Item.insertion_date.desc()).all()
-    
-    return items
+    return dropoff_point_items_statement(dropoff_point_id, filter)
+
+def search_items(db: Session, query: str, filter: dict) -> Select:
+    """
+    :param db: The database session object.
+    :param query: The search query typed by the user.
+    :param filter: A dictionary specifying filters for the items. Supported filters are "state" and "dropoff_point_id".
+    :return: The SELECT statement of the items matching every word of the query, most relevant first.
+
+    The statement is paginated and executed by the caller.
+    """
+    return search_items_statement(query, filter, db.get_bind().dialect.name)
+
+def image_statuses_statement(key: str) -> Select:
+    """
+    :param key: The key of an image.
+    :return: The statement selecting the distinct image statuses of the items referring to the image.
+    """
+    return select(models.Item.image_status).where(models.Item.image == key).distinct()
+
+def image_refcount_statement(key: str) -> Select:
+    """
+    :param key: The key of an image.
+    :return: The statement counting the items referring to the image.
+    """
+    return select(func.count()).select_from(models.Item).where(models.Item.image == key)
+
+def shared_image_status(statuses: list) -> Tuple[str, bool]:
+    """
+    :param statuses: The image statuses of the items already referring to an image.
+    :return: The image status of a new item referring to it, and whether its upload must be submitted: not when the
+             image is already stored or being uploaded for another item.
+    """
+    if "ready" in statuses:
+        return "ready", False
+    if "pending" in statuses:
+        return "pending", False
+    return "pending", True
+
+def spool_image(db: Session, image) -> Tuple[str, str, Optional[str]]:
+    """
+    Spool an uploaded image and look up the items with the same picture, see uploads.spool.
+
+    :param db: The database session.
+    :param image: The uploaded image, a fastapi UploadFile.
+    :return: The content-addressed key of the image, the image status of a new item referring to it, and the path of
+             the spool file to upload, or None if the image does not need to be uploaded.
+    """
+    path, key = uploads.spool(image)
+    image_status, upload = shared_image_status(db.scalars(image_statuses_statement(key)).all())
+    if not upload:
+        os.unlink(path)
+        path = None
+    return key, image_status, path
 
 def create_item(db: Session, new_item: schemas.ItemCreate) -> models.Item:
     """
-    Create an item in the database.
+    Create an item in the database. Its image is uploaded in the background once the item is committed, unless the
+    same picture is already stored, see uploads.py.
 
     :param db: The database session to use.
     :param new_item: The item to create, defined by the schemas.ItemCreate model.
     :return: The created item, defined by the models.Item model.
     """
+    image_status = spooled_image = None
     if new_item.image != None:
-        new_item.image = upload_file_to_s3(new_item.image, str(uuid.uuid4()))
+        new_item.image, image_status, spooled_image = spool_image(db, new_item.image)
     
     db_item = models.Item(description = new_item.description,
                           tag = new_item.tag,
                           image = new_item.image,
+                          image_status = image_status,
                           state = "stored",
                           dropoff_point_id = new_item.dropoff_point_id,
                           report_email = None,
@@ -236,6 +487,8 @@ def create_item(db: Session, new_item: schemas.ItemCreate) -> models.Item:
         
     db.add(db_item)
     db.commit()
+    if spooled_image != None:
+        uploads.submit(db_item.id, db_item.image, spooled_image)
     return db_item
 
 def report_item(db: Session, new_item: schemas.ItemReport) -> models.Item:
@@ -249,12 +502,14 @@ def report_item(db: Session, new_item: schemas.ItemReport) -> models.Item:
     :return: The newly created item.
     :rtype: Item
     """
+    image_status = spooled_image = None
     if new_item.image != None:
-        new_item.image = upload_file_to_s3(new_item.image, str(uuid.uuid4()))
+        new_item.image, image_status, spooled_image = spool_image(db, new_item.image)
     
     db_item = models.Item(description = new_item.description,
                           tag = new_item.tag,
                           image = new_item.image,
+                          image_status = image_status,
                           state = "reported",
                           dropoff_point_id = None,
                           report_email = new_item.report_email,
@@ -262,9 +517,10 @@ def report_item(db: Session, new_item: schemas.ItemReport) -> models.Item:
                           retrieved_date = None)
             
     db.add(db_item)
+    contact.contact_new_report(db, db_item, matching.similar_stored_items(db, db_item.description, db_item.tag))
     db.commit()
-    
-    contact.contact_new_report(db_item)
+    if spooled_image != None:
+        uploads.submit(db_item.id, db_item.image, spooled_image)
     
     return db_item
 
@@ -278,7 +534,7 @@ def retrieve_item(db: Session, id: int, retrieved_email: str) -> Optional[models
     This method retrieves an item from the database using the provided ID. If the item is found and its state is "stored", the state is changed to "retrieved" and the retrieved email and
     * date are updated. The changes are then flushed and committed to the database.
 
-    After retrieving the item, the contact.contact_netrieved_email method is called to perform additional actions related to the retrieval.
+    The retrieval email is queued by contact.contact_netrieved_email in the same transaction.
 
     Finally, the retrieved item is returned.
     """
@@ -288,11 +544,11 @@ def retrieve_item(db: Session, id: int, retrieved_email: str) -> Optional[models
     if db_item.state == "stored":
         db_item.state = "retrieved"
         db_item.retrieved_email = retrieved_email
-        db_item.retrieved_date = str(datetime.now())
+        db_item.retrieved_date = datetime.now()
+        contact.contact_netrieved_email(db, db_item)
         db.flush([db_item])
         db.commit()
-        
-    contact.contact_netrieved_email(db_item)
+        matching.discard(db_item.id)
     
     return db_item
 
@@ -307,9 +563,12 @@ def delete_item(db: Session, id: int) -> Optional[str]:
     db_item = get_item_by_id(db, id)
     if db_item == None:
         return None
-    if db_item.image != None:
-        s3_image_file_name = db_item.image.split('/')[-1]
-        delete_file_from_s3(s3_image_file_name)
     db.delete(db_item)
+    db.flush()
+    # Items with the same picture share the image, it is deleted with the last of them
+    if db_item.image != None and db.scalar(image_refcount_statement(db_item.image)) == 0:
+        s3_image_file_name = db_item.image.split('/')[-1]
+        queue_file_deletion(db, s3_image_file_name)
     db.commit()
+    matching.discard(id)
     return "OK"
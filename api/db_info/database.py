@@ -1,13 +1,201 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "mysql+mysqlconnector": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+def to_async_url(url: str) -> str:
+    """
+    Translate a synchronous database URL into the equivalent URL for an asyncio driver.
+
+    :param url: The synchronous database URL (e.g. mysql+mysqlconnector://...).
+    :return: The URL using aiosqlite for SQLite and aiomysql for MySQL, or the same URL if its driver is unknown.
+    """
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///:memory:")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# Optional read replica. Without it, the read engines and session factories are the primary ones.
+SQLALCHEMY_READ_DATABASE_URL = os.getenv("DATABASE_READ_URL")
+ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_DATABASE_READ_URL",
+                                    to_async_url(SQLALCHEMY_READ_DATABASE_URL) if SQLALCHEMY_READ_DATABASE_URL else None)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ["1", "true", "yes"]
+
+class PoolMetrics:
+    """
+    Thread-safe counters of the connection checkouts of a pool.
+
+    Attributes:
+        - `checkouts` (int): The number of connections handed out by the pool.
+        - `timeouts` (int): The number of checkouts that gave up after `pool_timeout`.
+        - `total_wait` (float): The accumulated time, in seconds, spent waiting for a connection.
+        - `max_wait` (float): The longest time, in seconds, a checkout waited for a connection.
+        - `peak_checked_out` (int): The highest number of connections checked out at the same time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.peak_checked_out = 0
+
+    def record_checkout(self, wait: float, checked_out: int):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def record_timeout(self, wait: float):
+        with self._lock:
+            self.timeouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"checkouts": self.checkouts,
+                    "timeouts": self.timeouts,
+                    "mean_wait_ms": 1000 * self.total_wait / self.checkouts if self.checkouts else 0.0,
+                    "max_wait_ms": 1000 * self.max_wait,
+                    "peak_checked_out": self.peak_checked_out}
+
+class TimedPoolMixin:
+    """Pool mixin that records how long each checkout waits for a connection into the pool's `metrics`."""
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_timeout(time.perf_counter() - start)
+            raise
+        if self.metrics is not None:
+            self.metrics.record_checkout(time.perf_counter() - start, self.checkedout())
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    """QueuePool of the synchronous engine, with checkout metrics."""
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-)
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool of the asyncio engine, with checkout metrics."""
+
+def pool_options(**kwargs) -> dict:
+    """
+    Get the connection pool options configured through the DB_POOL_* environment variables.
+
+    :param kwargs: Options overriding the environment configuration.
+    :return: The keyword arguments to pass to create_engine or create_async_engine.
+    """
+    options = {"pool_size": DB_POOL_SIZE,
+               "max_overflow": DB_MAX_OVERFLOW,
+               "pool_timeout": DB_POOL_TIMEOUT,
+               "pool_recycle": DB_POOL_RECYCLE,
+               "pool_pre_ping": DB_POOL_PRE_PING}
+    options.update(kwargs)
+    return options
+
+def create_pool_engine(url: str, metrics: PoolMetrics = None, **kwargs) -> Engine:
+    """
+    Create an engine whose connection pool is configured from the DB_POOL_* environment variables.
+
+    SQLite keeps SQLAlchemy's default pool, since it has no server-side connections to size or recycle.
+
+    :param url: The database URL.
+    :param metrics: Optional PoolMetrics instance that will record the pool's checkouts.
+    :param kwargs: Pool options overriding the environment configuration.
+    :return: The created engine.
+    """
+    if url.startswith("sqlite"):
+        return create_engine(url)
+    new_engine = create_engine(url, **pool_options(poolclass = TimedQueuePool, **kwargs))
+    new_engine.pool.metrics = metrics
+    return new_engine
+
+def create_async_pool_engine(url: str, metrics: PoolMetrics = None, **kwargs) -> AsyncEngine:
+    """
+    Create an asyncio engine whose connection pool is configured from the DB_POOL_* environment variables.
+
+    :param url: The database URL, using an asyncio driver (aiosqlite, aiomysql).
+    :param metrics: Optional PoolMetrics instance that will record the pool's checkouts.
+    :param kwargs: Pool options overriding the environment configuration.
+    :return: The created AsyncEngine.
+    """
+    if url.startswith("sqlite"):
+        return create_async_engine(url)
+    new_engine = create_async_engine(url, **pool_options(poolclass = TimedAsyncQueuePool, **kwargs))
+    new_engine.pool.metrics = metrics
+    return new_engine
+
+def pool_status(target: Engine, metrics: PoolMetrics = None) -> dict:
+    """
+    Get the current state of an engine's connection pool.
+
+    :param target: The engine (sync or async) whose pool is inspected.
+    :param metrics: Optional PoolMetrics recorded for that pool.
+    :return: A dictionary with the pool class, size, checked out connections, overflow and checkout wait statistics.
+    """
+    pool = target.pool
+    status = {"pool_class": type(pool).__name__}
+    for name, method in [("size", "size"), ("checked_in", "checkedin"), ("checked_out", "checkedout"), ("overflow", "overflow")]:
+        if callable(getattr(pool, method, None)):
+            status[name] = getattr(pool, method)()
+    if metrics is not None:
+        status.update(metrics.as_dict())
+    return status
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+# The API serves every request from async_engine. The sync engines (engine, read_engine) remain for the sync
+# CRUD in crud.py, the tests and the benchmarks only; they are not reported by /metrics/pool, so the pool is
+# never sized from an idle engine. With the default sqlite:///:memory: they are separate databases.
+engine = create_pool_engine(SQLALCHEMY_DATABASE_URL, metrics = pool_metrics)
 SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
 
-Base = declarative_base()
+async_engine = create_async_pool_engine(ASYNC_DATABASE_URL, metrics = async_pool_metrics)
+AsyncSessionLocal = async_sessionmaker(autoflush = False, expire_on_commit = False, bind = async_engine)
 
+read_pool_metrics = PoolMetrics()
+async_read_pool_metrics = PoolMetrics()
+
+if SQLALCHEMY_READ_DATABASE_URL:
+    read_engine = create_pool_engine(SQLALCHEMY_READ_DATABASE_URL, metrics = read_pool_metrics)
+    async_read_engine = create_async_pool_engine(ASYNC_READ_DATABASE_URL, metrics = async_read_pool_metrics)
+else:
+    read_engine = engine
+    async_read_engine = async_engine
+ReadSessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = read_engine)
+AsyncReadSessionLocal = async_sessionmaker(autoflush = False, expire_on_commit = False, bind = async_read_engine)
+
+Base = declarative_base()
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import time
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy import delete, or_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from . import archiver, database, image_cache, images, models, storage
+
+# Background deletion of the S3 objects queued in the pending_deletes table (see crud.queue_file_deletion), run
+# in-process by every API worker. Like the mailer, a lease makes sure only one worker deletes at a time. Deleting an
+# item only queues its image and thumbnails, so it does not wait for S3: the holder deletes the due objects with one
+# DeleteObjects call per batch of up to DELETER_BATCH_SIZE keys (1000 at most, the S3 limit). An object that could
+# not be deleted is retried with exponential backoff. Deletions are idempotent, so they are never given up. As
+# images are shared by the items with the same picture, the objects an item refers to again are kept.
+#
+# Every DELETER_RECONCILE_INTERVAL seconds, the holder also lists the bucket and queues the objects no item refers
+# to anymore, e.g. the image of an item deleted while it was uploading. Objects younger than DELETER_ORPHAN_GRACE
+# seconds are left alone, as their item may not be visible yet.
+
+DELETER_ENABLED = os.getenv("DELETER_ENABLED", "true").lower() == "true"
+DELETER_INTERVAL = float(os.getenv("DELETER_INTERVAL", 10))
+DELETER_BATCH_SIZE = min(int(os.getenv("DELETER_BATCH_SIZE", 1000)), 1000)
+DELETER_BACKOFF = float(os.getenv("DELETER_BACKOFF", 30))
+DELETER_BACKOFF_MAX = float(os.getenv("DELETER_BACKOFF_MAX", 3600))
+DELETER_RECONCILE_INTERVAL = float(os.getenv("DELETER_RECONCILE_INTERVAL", 24 * 3600))
+DELETER_ORPHAN_GRACE = float(os.getenv("DELETER_ORPHAN_GRACE", 24 * 3600))
+DELETER_LEASE_TTL = float(os.getenv("DELETER_LEASE_TTL", 60))
+DELETER_LEASE_NAME = "deleter"
+
+deleter_task: Optional[asyncio.Task] = None
+
+def backoff(attempts: int) -> timedelta:
+    """
+    :param attempts: The number of failed deletion attempts.
+    :return: The time to wait before the next attempt: DELETER_BACKOFF doubled after each attempt, up to DELETER_BACKOFF_MAX.
+    """
+    return timedelta(seconds = min(DELETER_BACKOFF * 2 ** (attempts - 1), DELETER_BACKOFF_MAX))
+
+def delete_objects(keys: List[str]) -> Dict[str, str]:
+    """
+    Delete objects from S3 with a single DeleteObjects call. Run in the threadpool by flush.
+
+    :param keys: The keys of the objects, 1000 at most.
+    :return: The error of each object that could not be deleted, by key.
+    """
+    try:
+        response = storage.get_client().delete_objects(Bucket = os.getenv("AWS_BUCKET_NAME"),
+                                                       Delete = {"Objects": [{"Key": key} for key in keys], "Quiet": True})
+    except Exception as e:
+        return {key: str(e) for key in keys}
+    errors = {error["Key"]: f"{error.get('Code')}: {error.get('Message')}" for error in response.get("Errors", [])}
+    for key in keys:
+        if key not in errors:
+            storage.presigned_urls.discard(key)
+            image_cache.discard(key)
+    return errors
+
+async def flush(session_factory: Optional[async_sessionmaker] = None, owner: str = archiver.worker_id) -> Optional[int]:
+    """
+    Delete a batch of due objects if this worker holds the deleter lease.
+
+    :param session_factory: The async session factory of the primary database. Defaults to database.AsyncSessionLocal.
+    :param owner: The worker deleting the objects.
+    :return: The number of queued deletions attempted, or None if another worker holds the lease.
+    """
+    session_factory = session_factory or database.AsyncSessionLocal
+    async with session_factory() as db:
+        if not await archiver.acquire_lease(db, DELETER_LEASE_NAME, owner, DELETER_LEASE_TTL):
+            return None
+        now = archiver.utcnow()
+        deletes = (await db.scalars(select(models.PendingDelete)
+                                    .where(or_(models.PendingDelete.next_attempt_at == None,
+                                               models.PendingDelete.next_attempt_at <= now))
+                                    .order_by(models.PendingDelete.id)
+                                    .limit(DELETER_BATCH_SIZE))).all()
+        if not deletes:
+            return 0
+
+        # An image deleted with its last item may have been uploaded again for a new one since
+        images_keys = {images.image_key(pending.key) for pending in deletes}
+        referenced = set()
+        for image in await db.scalars(select(models.Item.image).where(models.Item.image.in_(images_keys)).distinct()):
+            referenced.update(images.variant_keys(image))
+        # The same object may be queued twice, e.g. by the reconciliation
+        keys = list(dict.fromkeys(pending.key for pending in deletes if pending.key not in referenced))
+        errors = await run_in_threadpool(delete_objects, keys) if keys else {}
+        now = archiver.utcnow()
+        deleted = []
+        for pending in deletes:
+            error = errors.get(pending.key)
+            if error == None:
+                deleted.append(pending.id)
+                continue
+            pending.attempts += 1
+            pending.last_error = error[:500]
+            pending.next_attempt_at = now + backoff(pending.attempts)
+            print(f"ERROR:\tDeletion {pending.attempts} of object {pending.key} failed: {error}")
+        if deleted:
+            await db.execute(delete(models.PendingDelete)
+                             .where(models.PendingDelete.id.in_(deleted))
+                             .execution_options(synchronize_session = False))
+        await db.commit()
+        return len(deletes)
+
+def list_orphans(referenced: set, older_than: datetime) -> Iterator[str]:
+    """
+    List the objects of the bucket no item refers to. Run in the threadpool by reconcile.
+
+    :param referenced: The keys of the objects the items refer to, or already queued for deletion.
+    :param older_than: Only the objects last modified before then are listed, in UTC.
+    :return: The keys of the orphaned objects.
+    """
+    paginator = storage.get_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket = os.getenv("AWS_BUCKET_NAME")):
+        for object in page.get("Contents", []):
+            if object["Key"] not in referenced and object["LastModified"] < older_than:
+                yield object["Key"]
+
+async def reconcile(session_factory: Optional[async_sessionmaker] = None,
+                    owner: str = archiver.worker_id,
+                    grace: float = DELETER_ORPHAN_GRACE) -> Optional[int]:
+    """
+    Queue the deletion of the objects of the bucket no item refers to, if this worker holds the deleter lease.
+
+    :param session_factory: The async session factory of the primary database. Defaults to database.AsyncSessionLocal.
+    :param owner: The worker reconciling the bucket.
+    :param grace: The age, in seconds, an orphaned object must reach to be deleted.
+    :return: The number of orphaned objects queued, or None if another worker holds the lease.
+    """
+    session_factory = session_factory or database.AsyncSessionLocal
+    async with session_factory() as db:
+        if not await archiver.acquire_lease(db, DELETER_LEASE_NAME, owner, DELETER_LEASE_TTL):
+            return None
+        referenced = set(await db.scalars(select(models.PendingDelete.key)))
+        for image in await db.scalars(select(models.Item.image).where(models.Item.image != None)):
+            referenced.update(images.variant_keys(image.split('/')[-1]))
+        older_than = datetime.now(timezone.utc) - timedelta(seconds = grace)
+        orphans = await run_in_threadpool(lambda: list(list_orphans(referenced, older_than)))
+        db.add_all(models.PendingDelete(key = key) for key in orphans)
+        await db.commit()
+        if orphans:
+            print(f"INFO:\tQueued the deletion of {len(orphans)} orphaned objects")
+        return len(orphans)
+
+async def run_deleter(interval: float = DELETER_INTERVAL):
+    """
+    Delete the due objects until cancelled, right away while full batches come, otherwise every `interval` seconds,
+    and reconcile the bucket every DELETER_RECONCILE_INTERVAL seconds. Errors are logged and the next run goes on
+    as scheduled.
+
+    :param interval: The time between flushes when the queue is drained, in seconds.
+    :return: None
+    """
+    reconciled_at = None
+    while True:
+        try:
+            if DELETER_RECONCILE_INTERVAL > 0 and (reconciled_at == None or
+                                                   time.monotonic() - reconciled_at >= DELETER_RECONCILE_INTERVAL):
+                reconciled_at = time.monotonic()
+                if await reconcile() == None:
+                    # Another worker holds the lease, try again once this one takes it over
+                    reconciled_at = None
+            if await flush() == DELETER_BATCH_SIZE:
+                continue
+        except Exception as e:
+            print(f"ERROR:\tObject deletion failed: {e}")
+        await asyncio.sleep(interval)
+
+def start_deleter():
+    """
+    Start the deleter in the background. Called on application startup.
+
+    :return: None
+    """
+    global deleter_task
+    if DELETER_ENABLED and deleter_task is None:
+        deleter_task = asyncio.create_task(run_deleter())
+
+async def stop_deleter():
+    """
+    Stop the deleter and release its lease. Called on application shutdown.
+
+    :return: None
+    """
+    global deleter_task
+    if deleter_task is None:
+        return
+    deleter_task.cancel()
+    try:
+        await deleter_task
+    except asyncio.CancelledError:
+        pass
+    deleter_task = None
+    try:
+        async with database.AsyncSessionLocal() as db:
+            await archiver.release_lease(db, DELETER_LEASE_NAME, archiver.worker_id)
+    except Exception as e:
+        print(f"ERROR:\tCould not release the deleter lease: {e}")
@@ -0,0 +1,261 @@
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import BinaryIO, Callable, Dict, NamedTuple, Optional, Tuple
+
+# Local disk cache of the item images served in the "proxy" IMAGE_DELIVERY mode (see storage.py).
+#
+# Images never change once uploaded, as each one is stored under the SHA-256 of its content, so a cached copy
+# stays valid until the image is deleted. The cache holds up to IMAGE_CACHE_MAX_BYTES in IMAGE_CACHE_DIR and evicts
+# the least recently served images beyond that. Each image is a file named after its key and S3 ETag, with the
+# extension of its content type and the S3 modification time as its own, so the cache is reloaded from the
+# directory after a restart, least recently uploaded images first. Concurrent misses of the same image wait for a
+# single download instead of fetching it from S3 each.
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "uachado-image-cache"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Downloads in progress, removed on startup
+PARTIAL_SUFFIX = ".part"
+
+class CachedImage(NamedTuple):
+    """An image in the cache."""
+    path: str
+    size: int
+    content_type: str
+    # The S3 ETag of the image, without quotes, if known
+    etag: Optional[str]
+    # The S3 modification time of the image, as a timestamp
+    modified: float
+
+def file_name(key: str, content_type: str, etag: Optional[str]) -> str:
+    """
+    :param key: The key of an image.
+    :param content_type: The content type of the image.
+    :param etag: The S3 ETag of the image, without quotes.
+    :return: The name of the file of the image in the cache.
+    """
+    etag = "." + etag if etag and re.fullmatch(r"[0-9a-f-]{1,100}", etag) else ""
+    return key + etag + (mimetypes.guess_extension(content_type) or "")
+
+def parse_file_name(name: str) -> Tuple[str, Optional[str], str]:
+    """
+    :param name: The name of the file of an image in the cache, see file_name.
+    :return: The key, S3 ETag and content type of the image.
+    """
+    stem, _ = os.path.splitext(name)
+    content_type = mimetypes.guess_type(name)[0]
+    if content_type is None:
+        # No extension, what follows the key is the ETag
+        stem = name
+    key, _, etag = stem.partition(".")
+    return key, etag or None, content_type or "application/octet-stream"
+
+class DiskImageCache:
+    """
+    Thread-safe LRU of images on disk, bounded in bytes.
+
+    Attributes:
+        - `hits` (int): The number of images served from the cache.
+        - `misses` (int): The number of images downloaded into the cache.
+        - `coalesced` (int): The number of misses that waited for the download of another one.
+        - `evictions` (int): The number of images evicted to stay within the budget.
+        - `bytes_saved` (int): The number of bytes served without downloading them, on hits and coalesced misses.
+    """
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        """
+        :param directory: The directory of the cached images, created if needed.
+        :param max_bytes: The maximum total size of the cached images.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._entries: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._downloads: Dict[str, Future] = {}
+        self._discarded = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+        self.load()
+
+    @staticmethod
+    def accepts(key: str) -> bool:
+        """
+        :param key: The key of an image.
+        :return: True if the image can be cached under that key, i.e. the key is a plain file name.
+        """
+        return re.fullmatch(r"[A-Za-z0-9_-]{1,200}", key) != None
+
+    def load(self):
+        """Index the images already in the directory, least recently modified first."""
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(PARTIAL_SUFFIX):
+                os.unlink(path)
+            elif os.path.isfile(path) and self.accepts(parse_file_name(name)[0]):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, path, stat.st_size))
+        with self._lock:
+            for modified, name, path, size in sorted(files):
+                key, etag, content_type = parse_file_name(name)
+                self._add(key, CachedImage(path, size, content_type, etag, modified))
+
+    def lookup(self, key: str) -> Optional[CachedImage]:
+        """
+        Get a cached image, without downloading it on a miss.
+
+        :param key: The key of the image.
+        :return: The image, or None if it is not cached.
+        """
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += image.size
+            return image
+
+    def get(self, key: str, fetch: Callable[[BinaryIO], Tuple[str, Optional[str], Optional[datetime]]]) -> CachedImage:
+        """
+        Get a cached image, downloading it first on a miss.
+
+        :param key: The key of the image, see accepts.
+        :param fetch: Called on a miss with the file to write the image into, returns its content type, S3 ETag
+                      without quotes and S3 modification time.
+        :return: The image.
+        :raises FileNotFoundError: If the image was discarded while it was being downloaded.
+        """
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += image.size
+                return image
+            download = self._downloads.get(key)
+            downloading = download is None
+            if downloading:
+                download = self._downloads[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not downloading:
+            image = download.result()
+            with self._lock:
+                self.bytes_saved += image.size
+            return image
+
+        try:
+            image = self._download(key, fetch)
+            download.set_result(image)
+            return image
+        except BaseException as error:
+            download.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._downloads[key]
+
+    def _download(self, key: str, fetch: Callable[[BinaryIO], Tuple[str, Optional[str], Optional[datetime]]]) -> CachedImage:
+        descriptor, partial = tempfile.mkstemp(dir = self.directory, suffix = PARTIAL_SUFFIX)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                content_type, etag, modified = fetch(file)
+            content_type = content_type or "application/octet-stream"
+            if modified != None:
+                os.utime(partial, (modified.timestamp(), modified.timestamp()))
+            path = os.path.join(self.directory, file_name(key, content_type, etag))
+            os.replace(partial, path)
+        except BaseException:
+            os.unlink(partial)
+            raise
+        stat = os.stat(path)
+        image = CachedImage(path, stat.st_size, content_type, parse_file_name(os.path.basename(path))[1], stat.st_mtime)
+        with self._lock:
+            if key in self._discarded:
+                self._discarded.remove(key)
+                os.unlink(path)
+                raise FileNotFoundError(f"Image {key} was deleted")
+            self._add(key, image)
+        return image
+
+    def _add(self, key: str, image: CachedImage):
+        # Called with the lock held
+        self._entries[key] = image
+        self.size += image.size
+        # The newest image is kept even if it exceeds the budget on its own
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last = False)
+            self._remove(evicted)
+            self.evictions += 1
+
+    def _remove(self, image: CachedImage):
+        # Called with the lock held
+        self.size -= image.size
+        try:
+            os.unlink(image.path)
+        except FileNotFoundError:
+            pass
+
+    def discard(self, key: str):
+        """
+        Remove an image from the cache, once it is deleted from S3. A download in progress is not cached.
+
+        :param key: The key of the image.
+        :return: None
+        """
+        with self._lock:
+            image = self._entries.pop(key, None)
+            if image is not None:
+                self._remove(image)
+            if key in self._downloads:
+                self._discarded.add(key)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses + self.coalesced
+            return {"entries": len(self._entries),
+                    "bytes": self.size,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "coalesced": self.coalesced,
+                    "evictions": self.evictions,
+                    "hit_ratio": self.hits / requests if requests else 0.0,
+                    "bytes_saved": self.bytes_saved}
+
+image_cache: Optional[DiskImageCache] = None
+image_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[DiskImageCache]:
+    """
+    :return: The shared image cache, created on first use, or None if IMAGE_CACHE_ENABLED is false.
+    """
+    global image_cache
+    if IMAGE_CACHE_ENABLED and image_cache is None:
+        with image_cache_lock:
+            if image_cache is None:
+                image_cache = DiskImageCache()
+    return image_cache
+
+def discard(key: str):
+    """
+    Remove an image from the shared cache, if the cache is in use.
+
+    :param key: The key of the image.
+    :return: None
+    """
+    if image_cache is not None:
+        image_cache.discard(key)
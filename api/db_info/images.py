@@ -0,0 +1,113 @@
+import io
+import multiprocessing
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from PIL import Image, ImageOps
+
+# Normalization of the uploaded item images, run in a pool of processes so the CPU-bound decoding and encoding
+# neither blocks the request threads nor holds the GIL.
+#
+# The original photo is re-encoded in IMAGE_FORMAT, upright and downscaled to fit IMAGE_MAX_DIMENSION, and a square
+# thumbnail is cropped for each of IMAGE_THUMBNAIL_SIZES. Every variant is stored in S3 under a key derived from the
+# image key (see variant_key), and the image endpoint serves them through its `size` parameter.
+
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 1600))
+IMAGE_THUMBNAIL_SIZES = [int(size) for size in os.getenv("IMAGE_THUMBNAIL_SIZES", "160,480").split(",") if size.strip()]
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+IMAGE_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png", "AVIF": "image/avif"}
+IMAGE_CONTENT_TYPE = IMAGE_CONTENT_TYPES.get(IMAGE_FORMAT, "application/octet-stream")
+
+def variant_key(key: str, size: Optional[int] = None) -> str:
+    """
+    :param key: The key of an image.
+    :param size: The size of a thumbnail of the image, or None for the image itself.
+    :return: The key the variant is stored under.
+    """
+    return key if size == None else f"{key}_{size}"
+
+def image_key(key: str) -> str:
+    """
+    :param key: The key of a variant of an image.
+    :return: The key of the image, see variant_key.
+    """
+    image, _, size = key.rpartition("_")
+    return image if image and size.isdigit() else key
+
+def variant_keys(key: str) -> List[str]:
+    """
+    :param key: The key of an image.
+    :return: The keys of the image and of all its thumbnails.
+    """
+    return [variant_key(key)] + [variant_key(key, size) for size in IMAGE_THUMBNAIL_SIZES]
+
+def encode(image: Image.Image) -> bytes:
+    """
+    :param image: An image.
+    :return: The image encoded in IMAGE_FORMAT.
+    """
+    output = io.BytesIO()
+    image.save(output, IMAGE_FORMAT, quality = IMAGE_QUALITY)
+    return output.getvalue()
+
+def process_image(data: bytes) -> Dict[Optional[int], bytes]:
+    """
+    Normalize an uploaded image and crop its thumbnails. Run in the process pool.
+
+    :param data: The uploaded image file.
+    :return: The encoded normalized image under None and each thumbnail under its size.
+    :raises PIL.UnidentifiedImageError: If the file is not an image.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        # Phone cameras store the orientation in the EXIF data rather than rotating the pixels
+        image = ImageOps.exif_transpose(original)
+        mode = "RGBA" if "A" in image.getbands() and IMAGE_FORMAT != "JPEG" else "RGB"
+        image = image.convert(mode)
+    image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+    variants = {None: encode(image)}
+    for size in IMAGE_THUMBNAIL_SIZES:
+        variants[size] = encode(ImageOps.fit(image, (size, size), Image.LANCZOS))
+    return variants
+
+image_pool: Optional[ProcessPoolExecutor] = None
+image_pool_lock = threading.Lock()
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    :return: The shared process pool, started on first use.
+    """
+    global image_pool
+    if image_pool is None:
+        with image_pool_lock:
+            if image_pool is None:
+                # Forking a process running threads can copy locks held by other threads, spawn starts afresh
+                image_pool = ProcessPoolExecutor(max_workers = IMAGE_WORKERS,
+                                                 mp_context = multiprocessing.get_context("spawn"))
+    return image_pool
+
+def process(data: bytes) -> Dict[Optional[int], bytes]:
+    """
+    Normalize an uploaded image and crop its thumbnails in the process pool, waiting for the result. Called from
+    the threadpool.
+
+    :param data: The uploaded image file.
+    :return: The encoded normalized image under None and each thumbnail under its size.
+    """
+    return get_pool().submit(process_image, data).result()
+
+def shutdown_pool():
+    """
+    Stop the processes of the pool. Called on application shutdown.
+
+    :return: None
+    """
+    global image_pool
+    with image_pool_lock:
+        if image_pool is not None:
+            image_pool.shutdown(cancel_futures = True)
+            image_pool = None
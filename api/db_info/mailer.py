@@ -0,0 +1,263 @@
+import asyncio
+import os
+import smtplib
+
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Optional, Tuple
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from . import archiver, contact, database, models
+
+# Background delivery of the emails queued in the email_outbox table (see contact.py), run in-process by every API
+# worker. Like the archiver, a lease makes sure only one worker delivers at a time. The holder sends the due emails
+# in batches over a single SMTP connection, kept open and authenticated between batches. A failed email is retried
+# with exponential backoff, and marked "dead" once MAILER_MAX_ATTEMPTS attempts failed or the server rejected it
+# permanently (5xx reply).
+#
+# Emails queued under a digest key (see contact.DIGESTS) are held until the oldest one queued to their recipient is
+# MAILER_DIGEST_WINDOW seconds old, then all the pending ones of that recipient and key are merged into a single
+# email. The number of emails sent then follows the number of recipients per window rather than the number of events.
+
+MAILER_ENABLED = os.getenv("MAILER_ENABLED", "true").lower() == "true"
+MAILER_INTERVAL = float(os.getenv("MAILER_INTERVAL", 5))
+MAILER_BATCH_SIZE = int(os.getenv("MAILER_BATCH_SIZE", 50))
+MAILER_MAX_ATTEMPTS = int(os.getenv("MAILER_MAX_ATTEMPTS", 8))
+MAILER_BACKOFF = float(os.getenv("MAILER_BACKOFF", 30))
+MAILER_BACKOFF_MAX = float(os.getenv("MAILER_BACKOFF_MAX", 3600))
+MAILER_DIGEST_WINDOW = float(os.getenv("MAILER_DIGEST_WINDOW", 300))
+MAILER_LEASE_TTL = float(os.getenv("MAILER_LEASE_TTL", 60))
+MAILER_LEASE_NAME = "mailer"
+
+mailer_task: Optional[asyncio.Task] = None
+
+class SMTPConnection:
+    """
+    An SMTP connection opened, secured with STARTTLS and authenticated on first use, then reused for every email
+    until it fails. The settings default to the SMTP_SERVER, SMTP_PORT, SMTP_STARTTLS, EMAIL_USERNAME and
+    EMAIL_PASSWORD environment variables, and emails are sent from the username unless a sender is given.
+    """
+
+    def __init__(self,
+                 host: Optional[str] = None,
+                 port: Optional[int] = None,
+                 username: Optional[str] = None,
+                 password: Optional[str] = None,
+                 starttls: Optional[bool] = None,
+                 sender: Optional[str] = None,
+                 timeout: float = 30):
+        self.host = host or os.getenv("SMTP_SERVER")
+        self.port = port or int(os.getenv("SMTP_PORT", 0))
+        self.username = username or os.getenv("EMAIL_USERNAME")
+        self.password = password or os.getenv("EMAIL_PASSWORD")
+        self.starttls = starttls if starttls != None else os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+        self.sender = sender or self.username
+        self.timeout = timeout
+        self.server: Optional[smtplib.SMTP] = None
+        self.connections = 0
+
+    def connect(self):
+        """Open and authenticate the connection."""
+        server = smtplib.SMTP(self.host, self.port, timeout = self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.connections += 1
+
+    def close(self):
+        """Close the connection, if open."""
+        if self.server != None:
+            try:
+                self.server.quit()
+            except Exception:
+                self.server.close()
+            self.server = None
+
+    def send(self, recipient: str, subject: str, body: str):
+        """
+        Send an email, opening the connection if needed. A connection the server closed, e.g. after it stayed idle,
+        is reopened once.
+
+        :param recipient: The email address to send the email to.
+        :param subject: The subject of the email.
+        :param body: The plain text body of the email.
+        :raises smtplib.SMTPException: If the email could not be sent.
+        :raises OSError: If the server could not be reached.
+        """
+        message = MIMEMultipart()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.attach(MIMEText(body, "plain"))
+        if self.server == None:
+            self.connect()
+        try:
+            self.server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self.connect()
+            self.server.send_message(message)
+
+    def send_batch(self, emails: List[Tuple[str, str, str]]) -> List[Optional[Exception]]:
+        """
+        Send emails one after the other over the connection. Run in the threadpool by deliver.
+
+        :param emails: The recipient, subject and body of each email.
+        :return: For each email, None if it was sent, otherwise the error.
+        """
+        errors = []
+        for recipient, subject, body in emails:
+            try:
+                self.send(recipient, subject, body)
+                errors.append(None)
+            except (smtplib.SMTPException, OSError) as error:
+                if not isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)):
+                    # The connection is in an unknown state, start over on the next email
+                    self.close()
+                errors.append(error)
+        return errors
+
+smtp_connection = SMTPConnection()
+
+def is_permanent(error: Exception) -> bool:
+    """
+    :param error: The error of a delivery attempt.
+    :return: True if retrying cannot succeed, i.e. the server rejected the email with a 5xx reply.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+def backoff(attempts: int) -> timedelta:
+    """
+    :param attempts: The number of failed delivery attempts.
+    :return: The time to wait before the next attempt: MAILER_BACKOFF doubled after each attempt, up to MAILER_BACKOFF_MAX.
+    """
+    return timedelta(seconds = min(MAILER_BACKOFF * 2 ** (attempts - 1), MAILER_BACKOFF_MAX))
+
+async def deliver(session_factory: Optional[async_sessionmaker] = None,
+                  connection: Optional[SMTPConnection] = None,
+                  owner: str = archiver.worker_id) -> Optional[int]:
+    """
+    Deliver a batch of due emails if this worker holds the mailer lease. The due emails under a digest key are sent
+    merged with the pending ones of the same recipient and key.
+
+    :param session_factory: The async session factory of the primary database. Defaults to database.AsyncSessionLocal.
+    :param connection: The SMTP connection the emails are sent over. Defaults to the shared smtp_connection.
+    :param owner: The worker delivering the emails.
+    :return: The number of emails attempted, a digest counting once, or None if another worker holds the lease.
+    """
+    session_factory = session_factory or database.AsyncSessionLocal
+    connection = connection or smtp_connection
+    async with session_factory() as db:
+        if not await archiver.acquire_lease(db, MAILER_LEASE_NAME, owner, MAILER_LEASE_TTL):
+            return None
+        now = archiver.utcnow()
+        # created_at is in local time, like the other timestamps set by the application
+        digest_due = datetime.now() - timedelta(seconds = MAILER_DIGEST_WINDOW)
+        emails = (await db.scalars(select(models.EmailOutbox)
+                                   .where(models.EmailOutbox.status == "pending",
+                                          or_(models.EmailOutbox.next_attempt_at == None,
+                                              models.EmailOutbox.next_attempt_at <= now),
+                                          or_(models.EmailOutbox.digest_key == None,
+                                              models.EmailOutbox.created_at <= digest_due))
+                                   .order_by(models.EmailOutbox.id)
+                                   .limit(MAILER_BATCH_SIZE))).all()
+        if not emails:
+            return 0
+
+        # The emails merged into each email sent, and what is sent
+        groups, messages, merged = [], [], set()
+        for email in emails:
+            if email.id in merged:
+                continue
+            if email.digest_key == None:
+                groups.append([email])
+                messages.append((email.recipient, email.subject, email.body))
+                continue
+            group = (await db.scalars(select(models.EmailOutbox)
+                                      .where(models.EmailOutbox.recipient == email.recipient,
+                                             models.EmailOutbox.digest_key == email.digest_key,
+                                             models.EmailOutbox.status == "pending")
+                                      .order_by(models.EmailOutbox.id))).all()
+            merged.update(pending.id for pending in group)
+            groups.append(group)
+            messages.append((email.recipient, email.subject,
+                             contact.DIGESTS[email.digest_key]([pending.body for pending in group])))
+
+        errors = await run_in_threadpool(connection.send_batch, messages)
+        now = archiver.utcnow()
+        for group, error in zip(groups, errors):
+            for email in group:
+                if error == None:
+                    email.status = "sent"
+                    email.sent_at = now
+                    continue
+                email.attempts += 1
+                email.last_error = str(error)[:500]
+                if is_permanent(error) or email.attempts >= MAILER_MAX_ATTEMPTS:
+                    email.status = "dead"
+                    print(f"ERROR:\tGave up sending email {email.id} to {email.recipient}: {error}")
+                else:
+                    email.next_attempt_at = now + backoff(email.attempts)
+        await db.commit()
+        return len(messages)
+
+async def run_mailer(interval: float = MAILER_INTERVAL):
+    """
+    Deliver the due emails until cancelled, right away while full batches come, otherwise every `interval` seconds.
+    Errors are logged and the next delivery runs as scheduled.
+
+    :param interval: The time between deliveries when the outbox is drained, in seconds.
+    :return: None
+    """
+    while True:
+        try:
+            if await deliver() == MAILER_BATCH_SIZE:
+                continue
+        except Exception as e:
+            print(f"ERROR:\tEmail delivery failed: {e}")
+        await asyncio.sleep(interval)
+
+def start_mailer():
+    """
+    Start the mailer in the background. Called on application startup.
+
+    :return: None
+    """
+    global mailer_task
+    if MAILER_ENABLED and mailer_task is None:
+        mailer_task = asyncio.create_task(run_mailer())
+
+async def stop_mailer():
+    """
+    Stop the mailer, close its SMTP connection and release its lease. Called on application shutdown.
+
+    :return: None
+    """
+    global mailer_task
+    if mailer_task is None:
+        return
+    mailer_task.cancel()
+    try:
+        await mailer_task
+    except asyncio.CancelledError:
+        pass
+    mailer_task = None
+    await run_in_threadpool(smtp_connection.close)
+    try:
+        async with database.AsyncSessionLocal() as db:
+            await archiver.release_lease(db, MAILER_LEASE_NAME, archiver.worker_id)
+    except Exception as e:
+        print(f"ERROR:\tCould not release the mailer lease: {e}")
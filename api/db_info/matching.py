@@ -0,0 +1,279 @@
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Row, Select, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Ranked matching of found items against lost-item reports, and of reports against the stored items.
+#
+# Each item is turned into TF-IDF features: its words and the character trigrams of its words, accents and case
+# folded, so "telemóvel" and "telemoveis" still share most of their features. Items are indexed with log-scaled,
+# L2-normalized term frequencies and queries weighted by IDF on top (the SMART lnc.ltc scheme), which keeps the
+# stored vectors valid while the collection and its IDFs grow, and keeps the cosine score between 0 and 1.
+#
+# The index keeps every item's vector in compact arrays, plus an inverted index from each feature to the items
+# having it. A lookup walks the postings of the query's rarest features first, at most MATCH_MAX_POSTINGS of them,
+# to compute partial scores, then computes the exact score of the best candidates from their vectors. Its cost is
+# bounded whatever the number of items: the rarest features are the most telling, and a frequent one only adds the
+# latest items having it.
+#
+# Every worker keeps its own index in memory, caught up from the database before each lookup by reading the rows
+# inserted since the previous one. Items a worker retrieves or deletes are dropped from its index right away.
+# Candidates are checked against the database, so the changes of the other workers are caught when their items
+# come up, and the index is rebuilt every MATCH_REBUILD_INTERVAL seconds to compact it.
+
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", 0.4))
+MATCH_TOP_K = int(os.getenv("MATCH_TOP_K", 10))
+MATCH_MAX_POSTINGS = int(os.getenv("MATCH_MAX_POSTINGS", 2000))
+MATCH_REBUILD_INTERVAL = float(os.getenv("MATCH_REBUILD_INTERVAL", 600))
+
+# The columns loaded for the matches, enough to write the emails without loading whole items
+MATCH_COLUMNS = (models.Item.id, models.Item.description, models.Item.tag, models.Item.state, models.Item.report_email)
+
+# How many candidates, by partial score, get their exact score computed
+RESCORED_CANDIDATES = 100
+RESCORED_CANDIDATES_PER_MATCH = 10
+
+STOPWORDS = {"a", "ao", "as", "com", "da", "das", "de", "do", "dos", "e", "em", "na", "nas", "no", "nos", "o",
+             "os", "ou", "para", "por", "que", "se", "sem", "um", "uma", "meu", "minha", "perdi", "encontrado",
+             "encontrada", "the", "an", "and", "of", "with", "my", "i", "lost", "found"}
+
+def fold(text: str) -> str:
+    """
+    :param text: A text.
+    :return: The text in lower case and without accents.
+    """
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+
+def features(description: Optional[str], tag: Optional[str]) -> Counter:
+    """
+    Extract the features of an item: the words of its description and their character trigrams, accents and case
+    folded, plus its tag as a single feature, so that sharing a tag alone is not enough to match.
+
+    :param description: The description of the item.
+    :param tag: The tag of the item.
+    :return: The number of occurrences of each feature.
+    """
+    counts = Counter()
+    for word in re.findall(r"[a-z0-9]+", fold(description or "")):
+        if word in STOPWORDS:
+            continue
+        counts["w:" + word] += 1
+        padded = f" {word} "
+        for start in range(len(padded) - 2):
+            counts[padded[start:start + 3]] += 1
+    if tag:
+        counts["t:" + fold(tag)] += 1
+    return counts
+
+class SimilarityIndex:
+    """
+    An incremental index of the TF-IDF vectors of the items in a given state.
+
+    Features are interned as integers. Each item maps to two parallel arrays holding its features and their
+    weights, and each feature to two parallel arrays holding the items having it, oldest first, and its weight in
+    them. Removing an item only marks it, the postings are compacted when the index is rebuilt.
+    """
+
+    def __init__(self, state: str):
+        """
+        :param state: The state of the items the index holds.
+        """
+        self.state = state
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Empty the index."""
+        self.feature_ids: Dict[str, int] = {}
+        self.postings: List[Tuple[array, array]] = []
+        self.vectors: Dict[int, Tuple[array, array]] = {}
+        self.removed = set()
+        self.last_id = 0
+        self.built_at = None
+
+    @property
+    def size(self) -> int:
+        """The number of items in the index."""
+        return len(self.vectors) - len(self.removed)
+
+    def add(self, id: int, description: Optional[str], tag: Optional[str]):
+        """
+        Index an item.
+
+        :param id: The ID of the item.
+        :param description: The description of the item.
+        :param tag: The tag of the item.
+        """
+        weights = {feature: 1 + math.log(count) for feature, count in features(description, tag).items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1
+        vector = (array("i"), array("f"))
+        for feature, weight in weights.items():
+            feature_id = self.feature_ids.setdefault(feature, len(self.feature_ids))
+            if feature_id == len(self.postings):
+                self.postings.append((array("i"), array("f")))
+            self.postings[feature_id][0].append(id)
+            self.postings[feature_id][1].append(weight / norm)
+            vector[0].append(feature_id)
+            vector[1].append(weight / norm)
+        self.vectors[id] = vector
+        self.last_id = max(self.last_id, id)
+
+    def discard(self, id: int):
+        """
+        Remove an item from the results of the index.
+
+        :param id: The ID of the item.
+        """
+        if id in self.vectors:
+            self.removed.add(id)
+
+    def query(self, description: Optional[str], tag: Optional[str], k: int, threshold: float) -> List[Tuple[int, float]]:
+        """
+        Find the indexed items most similar to a description and tag.
+
+        :param description: The description to match.
+        :param tag: The tag to match.
+        :param k: The maximum number of items returned.
+        :param threshold: The minimum cosine similarity of the items returned.
+        :return: The ids of the matching items and their similarity, most similar first.
+        """
+        documents = len(self.vectors)
+        weights = {}
+        for feature, count in features(description, tag).items():
+            feature_id = self.feature_ids.get(feature)
+            if feature_id != None:
+                weights[feature_id] = (1 + math.log(count)) * math.log((documents + 1) / len(self.postings[feature_id][0]))
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        if norm == 0:
+            return []
+
+        # Partial scores over the rarest features, then exact scores of the best candidates
+        partial_scores = {}
+        budget = MATCH_MAX_POSTINGS
+        for feature_id in sorted(weights, key = lambda feature_id: len(self.postings[feature_id][0])):
+            if budget <= 0:
+                break
+            ids, values = self.postings[feature_id]
+            weight = weights[feature_id]
+            for id, value in zip(ids[-budget:], values[-budget:]):
+                partial_scores[id] = partial_scores.get(id, 0.0) + weight * value
+            budget -= len(ids)
+        candidates = heapq.nlargest(max(RESCORED_CANDIDATES_PER_MATCH * k, RESCORED_CANDIDATES),
+                                    (id for id in partial_scores if id not in self.removed),
+                                    key = partial_scores.__getitem__)
+
+        scores = []
+        for id in candidates:
+            feature_ids, values = self.vectors[id]
+            score = sum(weights.get(feature_id, 0.0) * value for feature_id, value in zip(feature_ids, values)) / norm
+            if score >= threshold:
+                scores.append((id, score))
+        return heapq.nlargest(k, scores, key = lambda entry: entry[1])
+
+reports_index = SimilarityIndex("reported")
+stored_index = SimilarityIndex("stored")
+
+def indexed_items_statement(index: SimilarityIndex) -> Select:
+    """
+    Build the query of the items an index holds that were inserted after the last one it indexed.
+
+    :param index: The index.
+    :return: A SELECT statement of the id, description and tag of the items, by id.
+    """
+    statement = select(models.Item.id, models.Item.description, models.Item.tag) \
+        .where(models.Item.state == index.state, models.Item.id > index.last_id)
+    if index.state == "reported":
+        statement = statement.where(models.Item.report_email != None)
+    return statement.order_by(models.Item.id)
+
+def refresh(db: Session, index: SimilarityIndex):
+    """
+    Catch an index up with the items inserted since the last refresh, or rebuild it when it is older than
+    MATCH_REBUILD_INTERVAL seconds. Called with the index lock held.
+
+    :param db: The database session.
+    :param index: The index to refresh.
+    """
+    if index.built_at == None or time.monotonic() - index.built_at > MATCH_REBUILD_INTERVAL:
+        index.clear()
+        index.built_at = time.monotonic()
+    for id, description, tag in db.execute(indexed_items_statement(index)):
+        index.add(id, description, tag)
+
+def find_similar(db: Session,
+                 index: SimilarityIndex,
+                 description: str,
+                 tag: str,
+                 k: Optional[int] = None,
+                 threshold: Optional[float] = None) -> List[Row]:
+    """
+    Find the items of an index most similar to a description and tag.
+
+    :param db: The database session.
+    :param index: The index to search.
+    :param description: The description to match.
+    :param tag: The tag to match.
+    :param k: The maximum number of items returned. Defaults to MATCH_TOP_K.
+    :param threshold: The minimum similarity of the items returned. Defaults to MATCH_THRESHOLD.
+    :return: The MATCH_COLUMNS of the matching items still in the state of the index, most similar first.
+    """
+    k = MATCH_TOP_K if k == None else k
+    threshold = MATCH_THRESHOLD if threshold == None else threshold
+    with index.lock:
+        refresh(db, index)
+        candidates = index.query(description, tag, k, threshold)
+        if not candidates:
+            return []
+        rows = {row.id: row for row in db.execute(select(*MATCH_COLUMNS).where(models.Item.id.in_([id for id, _ in candidates])))}
+        matches = []
+        for id, _ in candidates:
+            row = rows.get(id)
+            if row == None or row.state != index.state:
+                index.discard(id)
+            else:
+                matches.append(row)
+        return matches
+
+def discard(id: int):
+    """
+    Drop an item from the indexes right away, once this worker retrieved or deleted it. Changes made by other
+    workers are caught when their items come up in a lookup.
+
+    :param id: The ID of the item.
+    """
+    for index in [reports_index, stored_index]:
+        with index.lock:
+            index.discard(id)
+
+def similar_reports(db: Session, description: str, tag: str) -> List[Row]:
+    """
+    Find the reported lost items most similar to a found item.
+
+    :param db: The database session. With an AsyncSession, call it through AsyncSession.run_sync.
+    :param description: The description of the found item.
+    :param tag: The tag of the found item.
+    :return: Up to MATCH_TOP_K 'reported' items, most similar first, as rows of MATCH_COLUMNS.
+    """
+    return find_similar(db, reports_index, description, tag)
+
+def similar_stored_items(db: Session, description: str, tag: str) -> List[Row]:
+    """
+    Find the stored items most similar to a lost-item report.
+
+    :param db: The database session. With an AsyncSession, call it through AsyncSession.run_sync.
+    :param description: The description of the reported item.
+    :param tag: The tag of the reported item.
+    :return: Up to MATCH_TOP_K 'stored' items, most similar first, as rows of MATCH_COLUMNS.
+    """
+    return find_similar(db, stored_index, description, tag)
@@ -0,0 +1,48 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+BASELINE_REVISION = "0001"
+
+def get_config(connection: Connection) -> Config:
+    """
+    Build the Alembic configuration that runs the migrations in api/migrations on the given connection.
+
+    :param connection: The database connection the migrations run on.
+    :return: The Alembic Config object.
+    """
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_PATH)
+    config.attributes["connection"] = connection
+    return config
+
+def upgrade(connection: Connection, revision: str = "head"):
+    """
+    Apply the pending migrations. A database created by Base.metadata.create_all before migrations existed
+    (items table present, no alembic_version table) is first stamped with the baseline revision.
+
+    Called on startup through AsyncConnection.run_sync.
+
+    :param connection: The database connection the migrations run on.
+    :param revision: The target revision. Defaults to "head".
+    :return: None
+    """
+    tables = inspect(connection).get_table_names()
+    config = get_config(connection)
+    if "items" in tables and "alembic_version" not in tables:
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, revision)
+
+def current_revision(connection: Connection) -> str:
+    """
+    Get the revision the database is at.
+
+    :param connection: The database connection.
+    :return: The current revision, or None if no migration was applied.
+    """
+    return MigrationContext.configure(connection).get_current_revision()
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, DateTime, Integer, String
-from sqlalchemy.sql import func
+from datetime import datetime
+from sqlalchemy import DDL, Column, DateTime, Index, Integer, String, Text, event
 
 from . import database
 
@@ -14,24 +14,155 @@ class Item(database.Base):
         - `id` (int): The unique identifier of the item.
         - `description` (str): The description of the item.
         - `tag` (str): The tag associated with the item.
-        - `image` (str): The string uuid to the image of the item identifying it in the AWS S3 Bucket (nullable).
+        - `image` (str): The key of the image of the item in the AWS S3 Bucket (nullable), the SHA-256 of its content,
+          shared by the items with the same picture. Older images have a uuid key.
+        - `image_status` (str): "pending" while the image uploads, then "ready" or "failed" (see uploads.py). Null without image.
         - `state` (str): The current state of the item.
         - `dropoff_point_id` (int): The ID of the drop-off point where the item was dropped off (nullable).
-        - `insertion_date` (datetime): The insertion date of the item.
+        - `insertion_date` (datetime): The insertion date of the item. Never null.
         - `report_email` (str): The email address of the person who reported the item (nullable).
         - `retrieved_email` (str): The email address of the person who retrieved the item (nullable).
-        - `retrieved_date` (str): The date when the item was retrieved (nullable).
+        - `retrieved_date` (datetime): The date when the item was retrieved (nullable).
 
     """
     __tablename__ = "items"
+    # Kept in sync with the migrations in api/migrations/versions
+    __table_args__ = (
+        Index("ix_items_insertion_date", "insertion_date"),
+        Index("ix_items_state_insertion_date", "state", "insertion_date"),
+        Index("ix_items_state_tag_insertion_date", "state", "tag", "insertion_date"),
+        Index("ix_items_dropoff_point_state_insertion_date", "dropoff_point_id", "state", "insertion_date"),
+        Index("ix_items_tag_state", "tag", "state"),
+        Index("ix_items_state_retrieved_date", "state", "retrieved_date"),
+        Index("ix_items_image", "image"),
+    )
 
     id = Column(Integer, primary_key = True, index = True)
     description = Column(String(500))
     tag = Column(String(50))
     image = Column(String(500), nullable = True)
+    image_status = Column(String(20), nullable = True)
     state = Column(String(50))
     dropoff_point_id = Column(Integer, nullable = True)
-    insertion_date = Column(DateTime(timezone=True), default=func.now())
+    # Set in Python rather than with func.now(): SQLite would store CURRENT_TIMESTAMP without the microseconds
+    # SQLAlchemy writes for bound values, and the text comparisons of keyset pagination would not match.
+    insertion_date = Column(DateTime(timezone=True), default=datetime.now, nullable = False)
     report_email = Column(String(100), nullable = True)
     retrieved_email = Column(String(100), nullable = True)
-    retrieved_date = Column(String(100), nullable = True)
\ No newline at end of file
+    retrieved_date = Column(DateTime(timezone=True), nullable = True)
+
+# Full-text index on description and tag, used by crud.search_items_statement. MySQL keeps its FULLTEXT index in
+# sync by itself. SQLite has no such index: an external-content FTS5 table is kept in sync by triggers, which
+# SQLite drops along with the items table, so a migration recreating the table (batch_alter_table) has to
+# recreate them. Kept in sync with migration 0006.
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(description, tag, content='items', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts(rowid, description, tag) VALUES (new.id, new.description, new.tag); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, description, tag) VALUES ('delete', old.id, old.description, old.tag); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF description, tag ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, description, tag) VALUES ('delete', old.id, old.description, old.tag); "
+    "INSERT INTO items_fts(rowid, description, tag) VALUES (new.id, new.description, new.tag); END",
+]
+MYSQL_FULLTEXT_DDL = "CREATE FULLTEXT INDEX ix_items_fulltext ON items (description, tag)"
+
+for statement in SQLITE_FTS_DDL:
+    event.listen(Item.__table__, "after_create", DDL(statement).execute_if(dialect = "sqlite"))
+event.listen(Item.__table__, "after_create", DDL(MYSQL_FULLTEXT_DDL).execute_if(dialect = "mysql"))
+event.listen(Item.__table__, "before_drop", DDL("DROP TABLE IF EXISTS items_fts").execute_if(dialect = "sqlite"))
+
+class Lease(database.Base):
+    """
+
+    :class:`Lease`
+
+    A named lease held by one API worker at a time, used to run periodic jobs (see archiver.py) once across
+    workers. A lease whose `expires_at` has passed can be taken over by another worker.
+
+    Attributes:
+        - `name` (str): The name of the job the lease guards.
+        - `owner` (str): The worker holding the lease.
+        - `expires_at` (datetime): When the lease expires unless renewed, in UTC.
+
+    """
+    __tablename__ = "leases"
+
+    name = Column(String(50), primary_key = True)
+    owner = Column(String(100), nullable = False)
+    expires_at = Column(DateTime, nullable = False)
+
+class EmailOutbox(database.Base):
+    """
+
+    :class:`EmailOutbox`
+
+    An email waiting to be delivered. Emails are added in the same transaction as the item change they notify
+    about and delivered in the background by the mailer (see mailer.py).
+
+    Attributes:
+        - `id` (int): The unique identifier of the email.
+        - `recipient` (str): The email address the email is sent to.
+        - `subject` (str): The subject of the email.
+        - `body` (str): The plain text body of the email, or its part in the digest.
+        - `digest_key` (str): The digest the email is merged into with the other emails to the same recipient,
+          see contact.DIGESTS (nullable).
+        - `status` (str): "pending" until delivered, then "sent", or "dead" once delivery is given up.
+        - `attempts` (int): The number of failed delivery attempts.
+        - `next_attempt_at` (datetime): When the next delivery attempt is due, in UTC. Null means right away.
+        - `last_error` (str): The error of the last failed delivery attempt (nullable).
+        - `created_at` (datetime): When the email was queued.
+        - `sent_at` (datetime): When the email was delivered, in UTC (nullable).
+
+    """
+    __tablename__ = "email_outbox"
+    # Kept in sync with the migrations in api/migrations/versions
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_email_outbox_recipient_digest_key_status", "recipient", "digest_key", "status"),
+    )
+
+    id = Column(Integer, primary_key = True)
+    recipient = Column(String(100), nullable = False)
+    subject = Column(String(200), nullable = False)
+    body = Column(Text, nullable = False)
+    digest_key = Column(String(50), nullable = True)
+    status = Column(String(20), default = "pending", nullable = False)
+    attempts = Column(Integer, default = 0, nullable = False)
+    next_attempt_at = Column(DateTime, nullable = True)
+    last_error = Column(String(500), nullable = True)
+    created_at = Column(DateTime, default = datetime.now, nullable = False)
+    sent_at = Column(DateTime, nullable = True)
+
+class PendingDelete(database.Base):
+    """
+
+    :class:`PendingDelete`
+
+    An S3 object waiting to be deleted. Objects are queued in the same transaction as the item deletion that
+    orphans them and deleted in batches in the background by the deleter (see deleter.py). The row is removed once
+    the object is deleted.
+
+    Attributes:
+        - `id` (int): The unique identifier of the deletion.
+        - `key` (str): The key of the object in the AWS S3 Bucket.
+        - `attempts` (int): The number of failed deletion attempts.
+        - `next_attempt_at` (datetime): When the next deletion attempt is due, in UTC. Null means right away.
+        - `last_error` (str): The error of the last failed deletion attempt (nullable).
+        - `created_at` (datetime): When the deletion was queued.
+
+    """
+    __tablename__ = "pending_deletes"
+    # Kept in sync with the migrations in api/migrations/versions
+    __table_args__ = (
+        Index("ix_pending_deletes_next_attempt_at", "next_attempt_at"),
+        Index("ix_pending_deletes_key", "key"),
+    )
+
+    id = Column(Integer, primary_key = True)
+    key = Column(String(500), nullable = False)
+    attempts = Column(Integer, default = 0, nullable = False)
+    next_attempt_at = Column(DateTime, nullable = True)
+    last_error = Column(String(500), nullable = True)
+    created_at = Column(DateTime, default = datetime.now, nullable = False)
@@ -0,0 +1,120 @@
+import base64
+import json
+
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+from fastapi import Query
+from fastapi_pagination.cursor import CursorParams
+from pydantic import TypeAdapter
+from sqlalchemy import Select, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+
+# Keyset (cursor) pagination of item listings. The listings built in crud.py are ordered by
+# (insertion_date DESC, id DESC), so the next page starts right after the last item of the current one and the
+# database seeks to it through the index instead of walking every skipped row as OFFSET does.
+
+# The OFFSET listings take a lean path (lean_statement, validate_rows): plain column tuples, which the session
+# does not track in its identity map, validated in one batch by a prebuilt TypeAdapter.
+
+ITEM_COLUMNS = tuple(models.Item.__table__.columns)
+item_list_adapter = TypeAdapter(List[schemas.Item])
+
+class InvalidCursorError(ValueError):
+    """Raised when a cursor was not produced by encode_cursor."""
+
+class ItemCursorParams(CursorParams):
+    """
+    Query parameters of the cursor mode: fastapi_pagination's cursor and size, bounded like Params, plus the
+    opt-in total count.
+    """
+    size: int = Query(50, ge = 1, le = 100, description = "Page size")
+    include_total: bool = Query(False, description = "Count the items of the whole listing")
+
+def encode_cursor(item: models.Item) -> str:
+    """
+    Encode the position of an item in a listing as an opaque cursor.
+
+    :param item: The last item of a page.
+    :return: A URL-safe string identifying the position right after the item.
+    """
+    position = {"insertion_date": item.insertion_date.isoformat(), "id": item.id}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    :param cursor: The opaque cursor.
+    :return: The insertion date and the id of the item the cursor points after.
+
+    :raises InvalidCursorError: If the cursor is malformed.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position["insertion_date"]), int(position["id"])
+    except (ValueError, TypeError, KeyError) as error:
+        raise InvalidCursorError(cursor) from error
+
+def cursor_statement(statement: Select, cursor: Optional[str], size: int) -> Select:
+    """
+    Restrict a listing to the page that follows the cursor.
+
+    One extra row is fetched to know whether there is a next page.
+
+    :param statement: The SELECT statement of the listing, ordered by (insertion_date DESC, id DESC).
+    :param cursor: The cursor of the page, or None for the first page.
+    :param size: The maximum number of items in the page.
+    :return: The SELECT statement of the page.
+
+    :raises InvalidCursorError: If the cursor is malformed.
+    """
+    if cursor != None:
+        insertion_date, id = decode_cursor(cursor)
+        # A row-value comparison, which MySQL and SQLite turn into an index range, unlike the equivalent OR
+        statement = statement.where(tuple_(models.Item.insertion_date, models.Item.id) < tuple_(insertion_date, id))
+    return statement.limit(size + 1)
+
+async def cursor_paginate(db: AsyncSession,
+                          statement: Select,
+                          params: ItemCursorParams) -> schemas.ItemCursorPage:
+    """
+    Fetch a page of a listing with keyset pagination.
+
+    :param db: The async database session the statement runs on.
+    :param statement: The SELECT statement of the listing, ordered by (insertion_date DESC, id DESC).
+    :param params: The cursor returned with the previous page (None for the first page), the page size and whether
+        to count the items of the whole listing. The COUNT(*) is skipped unless include_total is set.
+    :return: The page of items with the cursor of the next one.
+
+    :raises InvalidCursorError: If the cursor is malformed.
+    """
+    items = (await db.scalars(cursor_statement(statement, params.cursor, params.size))).all()
+    next_cursor = encode_cursor(items[params.size - 1]) if len(items) > params.size else None
+    total = None
+    if params.include_total:
+        total = await db.scalar(select(func.count()).select_from(statement.order_by(None).subquery()))
+    return schemas.ItemCursorPage.model_validate({"items": items[:params.size],
+                                                  "size": params.size,
+                                                  "next_cursor": next_cursor,
+                                                  "total": total},
+                                                 from_attributes = True)
+
+def lean_statement(statement: Select) -> Select:
+    """
+    Select the plain columns of the items instead of ORM entities, keeping the filters and the order.
+
+    :param statement: The SELECT statement of a listing built in crud.py.
+    :return: The SELECT statement of the same rows as column tuples.
+    """
+    return statement.with_only_columns(*ITEM_COLUMNS)
+
+def validate_rows(rows: Sequence) -> List[schemas.Item]:
+    """
+    Validate the rows of a lean statement into items in one batch. Used as the fastapi_pagination items transformer.
+
+    :param rows: The rows returned by a lean statement.
+    :return: The validated items.
+    """
+    return item_list_adapter.validate_python(rows, from_attributes = True)
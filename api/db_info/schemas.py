@@ -1,7 +1,7 @@
 from datetime import datetime
 from fastapi import UploadFile
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, field_serializer
+from typing import List, Optional
 
 description_created = "Someone found a amazing pink console wih a sticker"
 description_reported = "I lost an amazing pink console wih a sticker"
@@ -15,23 +15,30 @@ class ItemBase(BaseModel):
         description (str): The description of the item.
         tag (str): The tag associated with the item.
         image (Optional[str]): The string uuid to the image of the item identifying it in the AWS S3 Bucket. Defaults to None.
+        image_status (Optional[str]): "pending" while the image uploads, then "ready" or "failed". Defaults to None.
         state (str): The state of the item.
         dropoff_point_id (Optional[int]): The ID of the drop-off point. Defaults to None.
         insertion_date (Optional[datetime]): The insertion date of the item. Defaults to None.
         report_email (Optional[str]): The email to report the item. Defaults to None.
         retrieved_email (Optional[str]): The email to retrieve the item. Defaults to None.
-        retrieved_date (Optional[str]): The date the item was retrieved. Defaults to None.
+        retrieved_date (Optional[datetime]): The date the item was retrieved. Defaults to None.
 
     """
     description: str
     tag: str
     image: Optional[str]
+    image_status: Optional[str] = None
     state: str
     dropoff_point_id: Optional[int]
     insertion_date: Optional[datetime]
     report_email: Optional[str]
     retrieved_email: Optional[str]
-    retrieved_date: Optional[str]
+    retrieved_date: Optional[datetime]
+
+    @field_serializer("retrieved_date")
+    def serialize_retrieved_date(self, retrieved_date: Optional[datetime]) -> Optional[str]:
+        """Serialize the retrieved date as str(datetime), the format clients got while the column was a string."""
+        return str(retrieved_date) if retrieved_date != None else None
 
 class Item(ItemBase):
     """
@@ -80,7 +87,7 @@ class Item(ItemBase):
                 "insertion_date": date_example,
                 "report_email": None,
                 "retrieved_email": "michelle.diaz@ua.pt",
-                "retrieved_date": "today"
+                "retrieved_date": "2023-01-02 10:00:00"
             },
             "archived_example": {
                 "id" : 1,
@@ -92,10 +99,26 @@ class Item(ItemBase):
                 "insertion_date": date_example,
                 "report_email": None,
                 "retrieved_email": "michelle.diaz@ua.pt",
-                "retrieved_date": "very long time ago"
+                "retrieved_date": "2023-01-02 10:00:00"
             }
         }
 
+class ItemCursorPage(BaseModel):
+    """
+    A page of items fetched with keyset (cursor) pagination.
+
+    Attributes:
+        items (List[Item]): The items of the page.
+        size (int): The maximum number of items in the page.
+        next_cursor (Optional[str]): The opaque cursor of the next page. None if this is the last page.
+        total (Optional[int]): The total number of items. Only counted when the client asks for it.
+
+    """
+    items: List[Item]
+    size: int
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
 class ItemCreate(BaseModel):
     """
     Represents an item to be created.
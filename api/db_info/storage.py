@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+import boto3
+from botocore.config import Config
+
+# The S3 client shared by every request and worker thread of the process. Creating a client re-reads the botocore
+# data files, builds an endpoint resolver and opens a new connection pool, so it is created once, on application
+# startup, and reused: boto3 clients are thread-safe once created. Creating it is not, hence the lock.
+#
+# Every S3 operation the client runs, including the ones a managed transfer like upload_fileobj makes, is timed
+# through the botocore event hooks into `s3_metrics`, reported by /metrics/s3.
+#
+# Images are served in one of two IMAGE_DELIVERY modes: "redirect" answers with a 307 to a presigned URL, so the
+# browser downloads the image from S3 directly, and "proxy" streams it through the API. Presigned URLs are cached
+# until PRESIGNED_URL_MARGIN seconds before they expire, so repeat views are not signed again. Either way, images
+# are served as immutable, since each one is stored under the SHA-256 of its content (older ones under a uuid4) and
+# never changed.
+
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+# The attempts of each call, the first one included
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 3))
+S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "standard")
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", 5))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", 30))
+
+IMAGE_DELIVERY = os.getenv("IMAGE_DELIVERY", "redirect").lower()
+IMAGE_MAX_AGE = int(os.getenv("IMAGE_MAX_AGE", 365 * 24 * 3600))
+IMAGE_CACHE_CONTROL = f"public, max-age={IMAGE_MAX_AGE}, immutable"
+PRESIGNED_URL_EXPIRES = int(os.getenv("PRESIGNED_URL_EXPIRES", 900))
+PRESIGNED_URL_MARGIN = float(os.getenv("PRESIGNED_URL_MARGIN", 60))
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv("PRESIGNED_URL_CACHE_SIZE", 4096))
+
+class S3Metrics:
+    """
+    Thread-safe latency statistics of the S3 operations, by operation name (PutObject, GetObject...).
+
+    For each operation:
+        - `calls` (int): The number of calls.
+        - `errors` (int): The number of calls that failed.
+        - `total_latency` (float): The accumulated time, in seconds, the calls took, retries included.
+        - `max_latency` (float): The longest time, in seconds, a call took.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+
+    def record(self, operation: str, latency: float, error: bool = False):
+        with self._lock:
+            stats = self.operations.setdefault(operation, {"calls": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0})
+            stats["calls"] += 1
+            stats["errors"] += error
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {operation: {"calls": stats["calls"],
+                                "errors": stats["errors"],
+                                "mean_latency_ms": 1000 * stats["total_latency"] / stats["calls"],
+                                "max_latency_ms": 1000 * stats["max_latency"]}
+                    for operation, stats in self.operations.items()}
+
+class InstrumentedS3Client:
+    """
+    A boto3 S3 client recording the latency of each of its operations. The client methods are available on the
+    wrapper, e.g. `client.get_object(...)`.
+    """
+
+    def __init__(self, client, metrics: S3Metrics):
+        """
+        :param client: The boto3 S3 client.
+        :param metrics: The S3Metrics the operations are recorded into.
+        """
+        self.client = client
+        self.metrics = metrics
+        events = client.meta.events
+        events.register("before-call.s3", self.before_call)
+        events.register("after-call.s3", self.after_call)
+        events.register("after-call-error.s3", self.after_call_error)
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    def before_call(self, context: dict, **kwargs):
+        context["s3_call_start"] = time.perf_counter()
+
+    def after_call(self, model, context: dict, http_response = None, **kwargs):
+        error = http_response is not None and http_response.status_code >= 400
+        self.record(model.name, context, error)
+
+    def after_call_error(self, model, context: dict, **kwargs):
+        self.record(model.name, context, True)
+
+    def record(self, operation: str, context: dict, error: bool):
+        start = context.pop("s3_call_start", None)
+        if start is not None:
+            self.metrics.record(operation, time.perf_counter() - start, error)
+
+class PresignedURLCache:
+    """
+    Bounded LRU of presigned URLs, by object key. Each entry is reused until shortly before the URL expires. Hits
+    and misses are counted for monitoring.
+    """
+    def __init__(self, maxsize: int = PRESIGNED_URL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """
+        Get the cached presigned URL of an object.
+
+        :param key: The key of the object.
+        :return: The URL and the timestamp until which it can be reused, or None if none is cached or it is too old.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, url: str, reuse_until: float):
+        """
+        Cache the presigned URL of an object.
+
+        :param key: The key of the object.
+        :param url: The presigned URL.
+        :param reuse_until: The timestamp until which the URL can be handed out.
+        :return: None
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (reuse_until, url)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+
+    def discard(self, key: str):
+        """
+        Drop the cached presigned URL of an object, once the object is deleted.
+
+        :param key: The key of the object.
+        :return: None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+def client_config() -> Config:
+    """
+    :return: The botocore configuration of the S3 client, from the S3_* environment variables.
+    """
+    return Config(max_pool_connections = S3_MAX_POOL_CONNECTIONS,
+                  retries = {"total_max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+                  connect_timeout = S3_CONNECT_TIMEOUT,
+                  read_timeout = S3_READ_TIMEOUT)
+
+def create_client(metrics: Optional[S3Metrics] = None) -> InstrumentedS3Client:
+    """
+    Create an S3 client with the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables. Each call
+    creates a new client: use get_client to share one.
+
+    :param metrics: The S3Metrics the operations are recorded into. Defaults to the shared metrics.
+    :return: The instrumented client.
+    """
+    # A session of its own, as the default boto3 session is not thread-safe
+    session = boto3.session.Session(aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID"),
+                                    aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY"))
+    return InstrumentedS3Client(session.client("s3", config = client_config()), metrics or s3_metrics)
+
+s3_metrics = S3Metrics()
+presigned_urls = PresignedURLCache()
+s3_client: Optional[InstrumentedS3Client] = None
+s3_client_lock = threading.Lock()
+
+def get_client() -> InstrumentedS3Client:
+    """
+    :return: The shared S3 client, created on first use if open_client was not called.
+    """
+    global s3_client
+    if s3_client is None:
+        with s3_client_lock:
+            if s3_client is None:
+                s3_client = create_client()
+    return s3_client
+
+def open_client():
+    """
+    Create the shared S3 client. Called on application startup, so the first requests do not pay for it.
+
+    :return: None
+    """
+    get_client()
+
+def close_client():
+    """
+    Close the connection pool of the shared S3 client. Called on application shutdown.
+
+    :return: None
+    """
+    global s3_client
+    with s3_client_lock:
+        if s3_client is not None:
+            s3_client.close()
+            s3_client = None
+
+def presigned_url(bucket: str, key: str) -> Tuple[str, float]:
+    """
+    Get a presigned GET URL of an object, from the cache or freshly signed for PRESIGNED_URL_EXPIRES seconds.
+
+    :param bucket: The bucket of the object.
+    :param key: The key of the object.
+    :return: The URL and the number of seconds it can still be handed out.
+    """
+    entry = presigned_urls.get(key)
+    if entry is None:
+        url = get_client().generate_presigned_url("get_object",
+                                                  Params = {"Bucket": bucket, "Key": key,
+                                                            "ResponseCacheControl": IMAGE_CACHE_CONTROL},
+                                                  ExpiresIn = PRESIGNED_URL_EXPIRES)
+        entry = (url, time.time() + PRESIGNED_URL_EXPIRES - PRESIGNED_URL_MARGIN)
+        presigned_urls.put(key, *entry)
+    url, reuse_until = entry
+    return url, max(reuse_until - time.time(), 0)
@@ -0,0 +1,205 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from boto3.s3.transfer import TransferConfig
+from PIL import UnidentifiedImageError
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from . import database, images, models, storage
+
+# Background upload of the item images, so creating or reporting an item does not wait for S3.
+#
+# The request only copies the uploaded file to a local spool file, hashing it on the way, then inserts the item with
+# its image key and image_status "pending". Images are content-addressed: the key is the SHA-256 of the uploaded
+# file, so the items with the same picture share one stored image, and an image already stored or being uploaded
+# for another item is not uploaded again (see crud.spool_image).
+#
+# A bounded pool of threads normalizes the image (see images.py) and uploads every variant with S3 managed
+# transfers, in concurrent multipart uploads above UPLOAD_PART_SIZE. The status of the items waiting for the image
+# becomes "ready" once every variant is stored. Failed uploads are retried with exponential backoff, and the status
+# becomes "failed" once UPLOAD_MAX_ATTEMPTS attempts failed or the file is not an image.
+#
+# Uploads lost with their worker (e.g. it was killed) stay "pending": the archiver marks them "failed" once they
+# are older than UPLOAD_STALE_AFTER seconds.
+
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 4))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", 64))
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", 8 * 1024 * 1024))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 3))
+UPLOAD_BACKOFF = float(os.getenv("UPLOAD_BACKOFF", 2))
+UPLOAD_STALE_AFTER = float(os.getenv("UPLOAD_STALE_AFTER", 3600))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR")
+
+upload_executor: Optional[ThreadPoolExecutor] = None
+# Taken for each queued or running upload, so at most UPLOAD_WORKERS + UPLOAD_QUEUE_SIZE spool files wait
+upload_slots = threading.BoundedSemaphore(UPLOAD_WORKERS + UPLOAD_QUEUE_SIZE)
+upload_executor_lock = threading.Lock()
+
+def transfer_config() -> TransferConfig:
+    """
+    :return: The configuration of the S3 managed transfers, from the UPLOAD_* environment variables.
+    """
+    return TransferConfig(multipart_threshold = UPLOAD_PART_SIZE,
+                          multipart_chunksize = UPLOAD_PART_SIZE,
+                          max_concurrency = UPLOAD_CONCURRENCY,
+                          use_threads = UPLOAD_CONCURRENCY > 1)
+
+def spool(file) -> Tuple[str, str]:
+    """
+    Copy an uploaded file to a spool file the background upload reads, as the request closes its own, and hash it
+    on the way.
+
+    :param file: The uploaded file, a fastapi UploadFile.
+    :return: The path of the spool file and the key of the image, the hex SHA-256 of the file.
+    """
+    digest = hashlib.sha256()
+    descriptor, path = tempfile.mkstemp(dir = UPLOAD_SPOOL_DIR, suffix = ".upload")
+    try:
+        with os.fdopen(descriptor, "wb") as spooled:
+            while chunk := file.file.read(UPLOAD_PART_SIZE):
+                digest.update(chunk)
+                spooled.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest()
+
+def store_image(path: str, key: str):
+    """
+    Normalize an image and upload it with its thumbnails.
+
+    :param path: The path of the image file.
+    :param key: The key of the image in S3.
+    :raises PIL.UnidentifiedImageError: If the file is not an image.
+    :raises Exception: If an upload failed.
+    """
+    with open(path, "rb") as file:
+        variants = images.process(file.read())
+    s3 = storage.get_client()
+    for size, data in variants.items():
+        s3.upload_fileobj(io.BytesIO(data), os.getenv("AWS_BUCKET_NAME"), images.variant_key(key, size),
+                          ExtraArgs = {"ContentType": images.IMAGE_CONTENT_TYPE, "CacheControl": storage.IMAGE_CACHE_CONTROL},
+                          Config = transfer_config())
+
+def set_image_status(session_factory: sessionmaker, key: str, status: str) -> bool:
+    """
+    Record the outcome of the upload of an image in the items waiting for it. A stored image also fixes the items
+    whose earlier upload of the same image failed.
+
+    :param session_factory: The session factory of the primary database.
+    :param key: The key of the image.
+    :param status: The new image status, "ready" or "failed".
+    :return: True if an item still refers to the image, False if they were all deleted meanwhile.
+    """
+    waiting = ["pending", "failed"] if status == "ready" else ["pending"]
+    with session_factory() as db:
+        db.execute(update(models.Item)
+                   .where(models.Item.image == key, models.Item.image_status.in_(waiting))
+                   .values(image_status = status))
+        referenced = db.scalar(select(models.Item.id).where(models.Item.image == key).limit(1)) != None
+        db.commit()
+        return referenced
+
+def upload_image(item_id: int, key: str, path: str, session_factory: Optional[sessionmaker] = None) -> str:
+    """
+    Upload the image of an item, retrying failed attempts, then record the outcome in the image_status of the items
+    referring to it. Run in the upload executor. The spool file is removed afterwards.
+
+    :param item_id: The ID of the item the upload was submitted for.
+    :param key: The key of the image in S3.
+    :param path: The path of the spool file.
+    :param session_factory: The session factory of the primary database. Defaults to database.SessionLocal.
+    :return: The final image status, "ready" or "failed".
+    """
+    session_factory = session_factory or database.SessionLocal
+    try:
+        status = "failed"
+        for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+            try:
+                store_image(path, key)
+                status = "ready"
+                break
+            except UnidentifiedImageError:
+                print(f"ERROR:\tImage {key} of item {item_id} is not an image")
+                break
+            except Exception as e:
+                print(f"ERROR:\tUpload {attempt} of image {key} of item {item_id} failed: {e}")
+                if attempt < UPLOAD_MAX_ATTEMPTS:
+                    time.sleep(UPLOAD_BACKOFF * 2 ** (attempt - 1))
+        if not set_image_status(session_factory, key, status) and status == "ready":
+            # The items were deleted while their image was uploading
+            storage.get_client().delete_objects(Bucket = os.getenv("AWS_BUCKET_NAME"),
+                                                Delete = {"Objects": [{"Key": variant} for variant in images.variant_keys(key)],
+                                                          "Quiet": True})
+        return status
+    finally:
+        os.unlink(path)
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    :return: The shared upload executor, started on first use.
+    """
+    global upload_executor
+    if upload_executor is None:
+        with upload_executor_lock:
+            if upload_executor is None:
+                upload_executor = ThreadPoolExecutor(max_workers = UPLOAD_WORKERS, thread_name_prefix = "upload")
+    return upload_executor
+
+def submit(item_id: int, key: str, path: str, session_factory: Optional[sessionmaker] = None) -> Future:
+    """
+    Queue the upload of the image of an item. Blocks while UPLOAD_QUEUE_SIZE uploads are already waiting, so call
+    it from the threadpool.
+
+    :param item_id: The ID of the item, committed with image_status "pending".
+    :param key: The key of the image in S3.
+    :param path: The path of the spool file, see spool.
+    :param session_factory: The session factory of the primary database. Defaults to database.SessionLocal.
+    :return: The future of the final image status.
+    """
+    upload_slots.acquire()
+    try:
+        future = get_executor().submit(upload_image, item_id, key, path, session_factory)
+    except BaseException:
+        upload_slots.release()
+        raise
+    future.add_done_callback(lambda _: upload_slots.release())
+    return future
+
+def shutdown_executor():
+    """
+    Finish the queued uploads and stop the executor. Called on application shutdown.
+
+    :return: None
+    """
+    global upload_executor
+    with upload_executor_lock:
+        if upload_executor is not None:
+            upload_executor.shutdown(wait = True)
+            upload_executor = None
+
+async def fail_stale_uploads(db: AsyncSession, stale_after: float = UPLOAD_STALE_AFTER) -> int:
+    """
+    Mark as "failed" the image uploads still pending long after their item was inserted, lost with their worker.
+
+    :param db: The async database session object.
+    :param stale_after: The age, in seconds, after which a pending upload is considered lost.
+    :return: The number of items marked.
+    """
+    cutoff = datetime.now() - timedelta(seconds = stale_after)
+    result = await db.execute(update(models.Item)
+                              .where(models.Item.image_status == "pending", models.Item.insertion_date < cutoff)
+                              .values(image_status = "failed")
+                              .execution_options(synchronize_session = False))
+    await db.commit()
+    return result.rowcount
@@ -1,22 +1,55 @@
+from contextlib import asynccontextmanager
 from os import getenv
 from typing import List, Optional
 
 from dotenv import load_dotenv
-from fastapi import (Depends, FastAPI, File, Form, HTTPException, Request,
-                     UploadFile, status)
+from fastapi import (Depends, FastAPI, File, Form, Header, HTTPException,
+                     Query, Request, UploadFile, status)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_pagination import Page, Params
-from fastapi_pagination.paginator import paginate as base_paginate
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from fastapi_pagination import Page, Params, set_page
+from fastapi_pagination.ext.sqlalchemy import paginate as sql_paginate
 from fastapi_pagination.utils import disable_installed_extensions_check
-from sqlalchemy.orm import Session
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from uvicorn import run
 
 ENV_FILE_PATH = getenv("ENV_FILE_PATH")
 load_dotenv(ENV_FILE_PATH)
 
-from db_info import auth, crud, database, init_db, schemas
+from db_info import (archiver, async_crud, auth, crud, database, deleter, image_cache, images,
+                     init_db, mailer, migrations, pagination, schemas, storage, uploads)
 
-database.Base.metadata.create_all(bind = database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Lifespan of the application.
+
+    On startup it opens the shared HTTP client used for authentication and the shared S3 client, applies the pending database migrations
+    and initializes the database if there are no items in it, then starts the archiving sweeper, the email
+    delivery worker and the S3 object deleter. On shutdown it stops them, finishes the queued image uploads, stops
+    the image processing pool and closes the clients.
+    """
+    await auth.open_http_client()
+    storage.open_client()
+    async with database.async_engine.begin() as connection:
+        await connection.run_sync(migrations.upgrade)
+    async with database.AsyncSessionLocal() as db:
+        items = await async_crud.get_items(db)
+        if await db.scalar(items.limit(1)) == None:
+            await db.run_sync(init_db.init)
+    archiver.start_archiver()
+    mailer.start_mailer()
+    deleter.start_deleter()
+    yield
+    await deleter.stop_deleter()
+    await mailer.stop_mailer()
+    await archiver.stop_archiver()
+    await run_in_threadpool(uploads.shutdown_executor)
+    images.shutdown_pool()
+    storage.close_client()
+    await auth.close_http_client()
 
 app = FastAPI(title = "Inventory API",
               summary = "Inventory API for UAchado App",
@@ -24,10 +57,13 @@ app = FastAPI(title = "Inventory API",
               version = "1.0.0",
               openapi_url = "/inventory/v1/openapi.json",
               docs_url="/inventory/v1/docs",
-              redoc_url="/inventory/v1/redocs")
+              redoc_url="/inventory/v1/redocs",
+              lifespan = lifespan)
 
 invalid_id_message = "INVALID ID FORMAT"
+invalid_cursor_message = "INVALID CURSOR"
 item_not_found_message = "ITEM NOT FOUND"
+invalid_image_size_message = "INVALID IMAGE SIZE"
 
 disable_installed_extensions_check()
 
@@ -41,54 +77,79 @@ app.add_middleware(
 
 ## HELPER FUNCTIONS
 
-def custom_paginate(items: List[schemas.Item],
-                    params: Optional[Params] = None) -> Page[schemas.Item]:
+async def custom_paginate(db: AsyncSession,
+                          query: Select,
+                          params: Optional[Params] = None) -> ORJSONResponse:
     """
-    Custom Paginate. Method used to paginate a list of items based on specific parameters.
+    Custom Paginate. Method used to paginate the items selected by a query based on specific parameters.
+    The page is fetched in the database with LIMIT/OFFSET and the total with a COUNT(*), so only the requested items are loaded.
+    The items are fetched as plain column tuples, validated in one batch and rendered with orjson, skipping the ORM
+    identity map and FastAPI's second validation of the response model.
 
     Args:
-        items (List[schemas.Item]): A list of items to paginate.
+        db (AsyncSession): The database session the query runs on.
+        query (Select): The query selecting the items to paginate.
         params (Optional[Params]): Optional. An instance of the Params class containing pagination parameters. If not provided, default parameters will be used.
     
     Return:
-        Page[schemas.Item]: A paginated list of items.
+        ORJSONResponse: The Page[schemas.Item] of items, rendered as JSON.
     """
     if params is None:
-        params = Params(page=1,size=len(items))
-    return base_paginate(items, params)
-
-def get_db():
+        params = Params()
+    with set_page(Page[schemas.Item]):
+        page = await sql_paginate(db, pagination.lean_statement(query), params,
+                                  transformer = pagination.validate_rows, unique = False)
+    return ORJSONResponse(page.model_dump())
+
+async def custom_cursor_paginate(db: AsyncSession,
+                                 query: Select,
+                                 params: pagination.ItemCursorParams) -> schemas.ItemCursorPage:
     """
-    Get the database session from the SessionLocal object which the API can connect to.
+    Custom Cursor Paginate. Method used to fetch the page of items that follows a cursor (keyset pagination).
+    Every page costs the same as the first one, and the total is only counted when the client asks for it.
+
+    Args:
+        db (AsyncSession): The database session the query runs on.
+        query (Select): The query selecting the items to paginate, newest first.
+        params (pagination.ItemCursorParams): The cursor, the page size and whether to include the total.
+
+    Raises:
+        HTTPException (HTTP_400_BAD_REQUEST): Error raised if the cursor is malformed.
 
     Return:
-        A database session.
+        schemas.ItemCursorPage: The page of items and the cursor of the next page.
     """
-    db = database.SessionLocal()
     try:
-        yield db
-    finally:
-        db.close()
+        return await pagination.cursor_paginate(db, query, params)
+    except pagination.InvalidCursorError:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = invalid_cursor_message)
+
+async def get_db():
+    """
+    Get an async database session from the AsyncSessionLocal object which the API can connect to.
 
-## INIT DB
+    Return:
+        An async database session.
+    """
+    async with database.AsyncSessionLocal() as db:
+        yield db
 
-@app.on_event("startup")
-async def startup_event():
+async def get_read_db(read_from_primary: bool = Header(False, alias = "X-Read-From-Primary")):
     """
-    Startup Event
+    Get an async database session for read-only endpoints. It connects to the read replica configured through
+    DATABASE_READ_URL, or to the primary database when there is no replica or the request sends the
+    "X-Read-From-Primary: true" header to get read-after-write consistency.
 
-    This method is an event handler for the "startup" event. It initializes the database if there are no items in it.
+    Args:
+        read_from_primary (bool, optional): Force the read onto the primary database. Defaults to Header(False).
 
     Return:
-        None
+        An async database session.
     """
-    db = database.SessionLocal()
-    try:
-        if crud.get_items(db) == []:
-            init_db.init(db)
-    finally:
-        db.close()    
-        
+    session_factory = database.AsyncSessionLocal if read_from_primary else database.AsyncReadSessionLocal
+    async with session_factory() as db:
+        yield db
+
 ## ENDPOINTS
 
 # BASE (UNAUTHENTICATED USER)
@@ -112,24 +173,45 @@ def base() -> dict:
 @app.get("/inventory/v1/items", 
          response_description = "Get the list of existing items.",
          response_model = Page[schemas.Item],
+         response_class = ORJSONResponse,
          tags = ["Items"],
          status_code = status.HTTP_200_OK)
-def get_all_items(request: Request,
-                  params: Params = Depends(),
-                  db: Session = Depends(get_db)) -> Page[schemas.Item]:
+async def get_all_items(params: Params = Depends(),
+                        token: dict = Depends(auth.verify_access),
+                        db: AsyncSession = Depends(get_db)) -> Page[schemas.Item]:
     """
     Get the list of existing items.
 
     Args:
-        request (Request): The request object containing information about the request.
         params (Params, optional): Optional additional parameters for pagination. Defaults to Depends().
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
 
     Returns:
         Page[schemas.Item]: The page containing the list of items.
     """    
-    auth.verify_access(request)
-    return custom_paginate(crud.get_items(db), params)
+    return await custom_paginate(db, await async_crud.get_items(db), params)
+
+@app.get("/inventory/v1/items/cursor",
+         response_description = "Get the list of existing items, one cursor page at a time.",
+         response_model = schemas.ItemCursorPage,
+         tags = ["Items"],
+         status_code = status.HTTP_200_OK)
+async def get_all_items_by_cursor(params: pagination.ItemCursorParams = Depends(),
+                                  token: dict = Depends(auth.verify_access),
+                                  db: AsyncSession = Depends(get_db)) -> schemas.ItemCursorPage:
+    """
+    Get the list of existing items with keyset pagination. Pass the next_cursor of a page to get the following one.
+
+    Args:
+        params (pagination.ItemCursorParams, optional): The cursor, the page size and whether to include the total. Defaults to Depends().
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+
+    Returns:
+        schemas.ItemCursorPage: The page containing the list of items and the cursor of the next page.
+    """
+    return await custom_cursor_paginate(db, await async_crud.get_items(db), params)
 
 # GET ITEM BY ID (UNAUTHENTICATED USER)
 
@@ -138,14 +220,14 @@ def get_all_items(request: Request,
          response_model = schemas.Item,
          tags = ["Items"],
          status_code = status.HTTP_200_OK)
-def get_item_by_id(item_id: str,
-                   db: Session = Depends(get_db)) -> schemas.Item:
+async def get_item_by_id(item_id: str,
+                         db: AsyncSession = Depends(get_read_db)) -> schemas.Item:
     """
     Get a specific item by its ID.
 
     Args:
         item_id (str): The ID attribute of a specify unique item.
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the read replica. Defaults to Depends(get_read_db).
 
     Raises:
         HTTPException (HTTP_400_BAD_REQUEST): Error raised if item_id is not numeric.
@@ -159,7 +241,7 @@ def get_item_by_id(item_id: str,
     except ValueError:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = invalid_id_message)
     
-    item = crud.get_item_by_id(db = db, id = item_id)
+    item = await async_crud.get_item_by_id(db = db, id = item_id)
     if not item:
         raise HTTPException(status_code = status.HTTP_204_NO_CONTENT, detail = item_not_found_message)
     return item
@@ -189,45 +271,116 @@ def get_all_tags() -> List[str]:
 @app.post("/inventory/v1/items/stored",
           response_description = "Get currently 'stored' items using optional filter",
           response_model = Page[schemas.Item],
+          response_class = ORJSONResponse,
           tags = ["Items"],
           status_code = status.HTTP_200_OK)
-def get_stored_items(filter: schemas.InputFilter,
-                     params: Params = Depends(),
-                     db: Session = Depends(get_db)) -> Page[schemas.Item]:
+async def get_stored_items(filter: schemas.InputFilter,
+                           params: Params = Depends(),
+                           db: AsyncSession = Depends(get_read_db)) -> Page[schemas.Item]:
     """
     Get currently 'stored' items using optional filter.
 
     Args:
         filter (schemas.InputFilter): The filter criteria used to search for items.
         params (Params, optional): Optional additional parameters for pagination. Defaults to Depends().
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the read replica. Defaults to Depends(get_read_db).
 
     Returns:
         Page[schemas.Item]: A paginated list of current items containing the 'stored' state.
     """    
-    return custom_paginate(crud.get_stored_items(db = db, filter = filter.filter), params)
+    return await custom_paginate(db, await async_crud.get_stored_items(db = db, filter = filter.filter), params)
+
+@app.post("/inventory/v1/items/stored/cursor",
+          response_description = "Get currently 'stored' items using optional filter, one cursor page at a time.",
+          response_model = schemas.ItemCursorPage,
+          tags = ["Items"],
+          status_code = status.HTTP_200_OK)
+async def get_stored_items_by_cursor(filter: schemas.InputFilter,
+                                     params: pagination.ItemCursorParams = Depends(),
+                                     db: AsyncSession = Depends(get_read_db)) -> schemas.ItemCursorPage:
+    """
+    Get currently 'stored' items using optional filter with keyset pagination. Pass the next_cursor of a page to get the following one.
+
+    Args:
+        filter (schemas.InputFilter): The filter criteria used to search for items.
+        params (pagination.ItemCursorParams, optional): The cursor, the page size and whether to include the total. Defaults to Depends().
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the read replica. Defaults to Depends(get_read_db).
+
+    Returns:
+        schemas.ItemCursorPage: The page of current items containing the 'stored' state and the cursor of the next page.
+    """
+    return await custom_cursor_paginate(db, await async_crud.get_stored_items(db = db, filter = filter.filter), params)
+
+async def verify_search_access(request: Request, state: str = Query("stored")):
+    """
+    Let anyone search the 'stored' items, the ones the public listing shows, and require authentication to search
+    items in any other state.
+
+    Args:
+        request (Request): The request, holding the authorization header.
+        state (str, optional): The state of the searched items. Defaults to Query("stored").
+
+    Return:
+        The decoded access token, or None when searching the 'stored' items.
+    """
+    if state != "stored":
+        return await auth.verify_access(request)
+    return None
+
+@app.get("/inventory/v1/items/search",
+         response_description = "Search items by the words of their description and tag.",
+         response_model = Page[schemas.Item],
+         response_class = ORJSONResponse,
+         tags = ["Items"],
+         status_code = status.HTTP_200_OK)
+async def search_items(q: str = Query(..., min_length = 1, max_length = 200, description = "The words to search for"),
+                       state: str = Query("stored", description = "The state of the items"),
+                       dropoff_point_id: Optional[int] = Query(None, description = "The ID of the drop-off point holding the items"),
+                       params: Params = Depends(),
+                       token: Optional[dict] = Depends(verify_search_access),
+                       db: AsyncSession = Depends(get_read_db)) -> Page[schemas.Item]:
+    """
+    Search items with the full-text index on their description and tag, most relevant first. Every word of the query
+    must match, the last one as a prefix so results show up while typing.
+
+    Args:
+        q (str): The words to search for.
+        state (str, optional): The state of the items. Items in a state other than 'stored' are only searchable by authenticated users. Defaults to "stored".
+        dropoff_point_id (Optional[int], optional): The ID of the drop-off point holding the items. Defaults to None.
+        params (Params, optional): Optional additional parameters for pagination. Defaults to Depends().
+        token (Optional[dict], optional): The decoded access token when searching items that are not 'stored'. Defaults to Depends(verify_search_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the read replica. Defaults to Depends(get_read_db).
+
+    Returns:
+        Page[schemas.Item]: A paginated list of the matching items.
+    """
+    filter = {"state": state}
+    if dropoff_point_id != None:
+        filter["dropoff_point_id"] = dropoff_point_id
+    return await custom_paginate(db, await async_crud.search_items(db = db, query = q, filter = filter), params)
 
 # GET ITEMS BY AUTHENTICATED USER
 
 @app.put("/inventory/v1/items/point/{dropoff_point_id}",
          response_description = "Get items on a drop-off point by filter.",
          response_model = Page[schemas.Item],
+         response_class = ORJSONResponse,
          tags = ["Items"],
          status_code = status.HTTP_200_OK)
-def get_dropoff_point_items(request: Request,
-                            dropoff_point_id: str,
-                            filter: schemas.InputFilter,
-                            params: Params = Depends(),
-                            db: Session = Depends(get_db)) -> Page[schemas.Item]:
+async def get_dropoff_point_items(dropoff_point_id: str,
+                                  filter: schemas.InputFilter,
+                                  params: Params = Depends(),
+                                  token: dict = Depends(auth.verify_access),
+                                  db: AsyncSession = Depends(get_db)) -> Page[schemas.Item]:
     """
     Get items on a drop-off point by filter.
 
     Args:
-        request (Request): The request object containing information about the request.
         dropoff_point_id (str): The ID of the drop-off point to get items from.
         filter (schemas.InputFilter): The filter criteria used to search for items.
         params (Params, optional): Additional parameters for pagination Defaults to Depends().
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
 
     Raises:
         HTTPException (HTTP_400_BAD_REQUEST): Error raised if dropoff_point_id is not numeric.
@@ -235,13 +388,12 @@ def get_dropoff_point_items(request: Request,
     Returns:
         Page[schemas.Item]: A paginated list of items from the drop-off point.
     """    
-    auth.verify_access(request)
     try:
         dropoff_point_id = int(dropoff_point_id)
     except ValueError:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = invalid_id_message)
     
-    return custom_paginate(crud.get_dropoff_point_items(db = db, dropoff_point_id = dropoff_point_id, filter = filter.filter), params)
+    return await custom_paginate(db, await async_crud.get_dropoff_point_items(db = db, dropoff_point_id = dropoff_point_id, filter = filter.filter), params)
 
 # MARK ITEM AS RETRIEVED (AUTHENTICATED USER)
 
@@ -250,18 +402,18 @@ def get_dropoff_point_items(request: Request,
          response_model = schemas.Item,
          tags = ["Items"],
          status_code = status.HTTP_200_OK)
-def retrieve_item(request: Request,
-                  item_id: str,
-                  email: schemas.Email,
-                  db: Session = Depends(get_db)) -> schemas.Item:
+async def retrieve_item(item_id: str,
+                        email: schemas.Email,
+                        token: dict = Depends(auth.verify_access),
+                        db: AsyncSession = Depends(get_db)) -> schemas.Item:
     """
     Marking a specific item as 'retrieved' by its ID.
 
     Args:
-        request (Request): The request object containing information about the request.
         item_id (str): The ID of the item to be marked as 'retrieved'.
         email (schemas.Email): The email of the user who retrieved the item.
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
 
     Raises:
         HTTPException (HTTP_400_BAD_REQUEST): Error raised if item_id is not numeric.
@@ -270,13 +422,12 @@ def retrieve_item(request: Request,
     Returns:
         schemas.Item: The item with the updated state 'retrieved'.
     """    
-    auth.verify_access(request)
     try:
         item_id = int(item_id)
     except ValueError:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = invalid_id_message)
     
-    item = crud.retrieve_item(db = db, id = item_id, retrieved_email = email.email)
+    item = await async_crud.retrieve_item(db = db, id = item_id, retrieved_email = email.email)
     if not item:
         raise HTTPException(status_code = status.HTTP_204_NO_CONTENT, detail = item_not_found_message)
     return item
@@ -288,27 +439,26 @@ def retrieve_item(request: Request,
           response_model = schemas.Item,
           tags = ["Items"], 
           status_code = status.HTTP_201_CREATED)
-def create_item(request: Request,
-                description: str = Form(...),
-                tag: str = Form(...),
-                image: Optional[UploadFile] = File(...),
-                dropoff_point_id: int = Form(...),
-                db: Session = Depends(get_db)) -> schemas.Item:
+async def create_item(description: str = Form(...),
+                      tag: str = Form(...),
+                      image: Optional[UploadFile] = File(...),
+                      dropoff_point_id: int = Form(...),
+                      token: dict = Depends(auth.verify_access),
+                      db: AsyncSession = Depends(get_db)) -> schemas.Item:
     """
     Create a new found item. Insert it in the database.
 
     Args:
-        request (Request): The request object containing information about the request.
         description (str, optional): The description of the item. Defaults to Form(...).
         tag (str, optional): The tag associated with the item. Defaults to Form(...).
         image (Optional[UploadFile], optional): The image file associated with the item (optional). The image will be stored in the associated AWS S3 Bucket. Defaults to File(...).
         dropoff_point_id (int, optional): The ID of the drop-off point associated with the item. Defaults to Form(...).
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
 
     Returns:
         schemas.Item: The created item.
     """    
-    auth.verify_access(request)
 
     if image == None or image.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
         image = None
@@ -318,7 +468,7 @@ def create_item(request: Request,
                               image=image,
                               dropoff_point_id=dropoff_point_id
                               )
-    return crud.create_item(db = db, new_item = item) 
+    return await async_crud.create_item(db = db, new_item = item) 
 
 # REPORT A NEW ITEM (UNAUTHENTICATED USER)
 
@@ -327,11 +477,11 @@ def create_item(request: Request,
           response_model = schemas.Item,
           tags = ["Items"],
           status_code = status.HTTP_201_CREATED)
-def report_item(description: str = Form(...),
-                tag: str = Form(...),
-                image: Optional[UploadFile] = File(...),
-                report_email: str = Form(...),
-                db: Session = Depends(get_db)) -> schemas.Item:
+async def report_item(description: str = Form(...),
+                      tag: str = Form(...),
+                      image: Optional[UploadFile] = File(...),
+                      report_email: str = Form(...),
+                      db: AsyncSession = Depends(get_db)) -> schemas.Item:
     """
     Report a new lost item.
 
@@ -340,7 +490,7 @@ def report_item(description: str = Form(...),
         tag (str, optional): The tag associated with the item. Defaults to Form(...).
         image (Optional[UploadFile], optional): The image file associated with the item (optional). The image will be stored in the associated AWS S3 Bucket. Defaults to File(...).
         report_email (str, optional): The email of the person reporting the item. Defaults to Form(...).
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
 
     Returns:
         schemas.Item: The reported item.
@@ -353,7 +503,7 @@ def report_item(description: str = Form(...),
                               image=image,
                               report_email=report_email
                               )
-    return crud.report_item(db = db, new_item = item)
+    return await async_crud.report_item(db = db, new_item = item)
 
 # DELETE EXISTING ITEM (AUTHENTICATED USER)
 
@@ -362,16 +512,16 @@ def report_item(description: str = Form(...),
             response_model = dict,
             tags = ["Items"],
             status_code = status.HTTP_200_OK)
-def delete_item(request: Request,
-                item_id: str,
-                db: Session = Depends(get_db)):
+async def delete_item(item_id: str,
+                      token: dict = Depends(auth.verify_access),
+                      db: AsyncSession = Depends(get_db)):
     """
     Delete a specific item by its ID.
 
     Args:
-        request (Request): The request object containing information about the request.
         item_id (str): The ID of the item to be deleted.
-        db (Session, optional): Optional database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+        db (AsyncSession, optional): Optional async database session object. If not included the system will connect to the default one. Defaults to Depends(get_db).
 
     Raises:
         HTTPException (HTTP_400_BAD_REQUEST): Error raised if item_id is not numeric.
@@ -380,33 +530,115 @@ def delete_item(request: Request,
     Returns:
         _type_: A dictionary containing a success message.
     """    
-    auth.verify_access(request)
     try:
         item_id = int(item_id)
     except ValueError:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = invalid_id_message)
     
-    if crud.delete_item(db, item_id) == None:
+    if await async_crud.delete_item(db, item_id) == None:
         raise HTTPException(status_code = status.HTTP_204_NO_CONTENT, detail = item_not_found_message)
     return {"message": "ITEM DELETED"}
 
 # GET IMAGE FROM S3 BUCKET (UNAUTHENTICATED USER)
 
 @app.get("/inventory/v1/image/{image_uuid}",
-         response_description = "A StreamingResponse object containing the image data.",
+         response_description = "A redirect to a presigned URL of the image, or a StreamingResponse object containing the image data.",
          tags = ["Items"],
-         status_code = status.HTTP_200_OK)
-def get_image_from_s3(image_uuid: str):
+         status_code = status.HTTP_200_OK,
+         responses = {status.HTTP_206_PARTIAL_CONTENT: {"description": "The requested range of the image."},
+                      status.HTTP_304_NOT_MODIFIED: {"description": "The client already has the image."},
+                      status.HTTP_307_TEMPORARY_REDIRECT: {"description": "Redirect to a presigned URL of the image."}})
+async def get_image_from_s3(image_uuid: str,
+                            size: Optional[int] = Query(None, description = "The size of the square thumbnail to get instead of the image"),
+                            if_none_match: Optional[str] = Header(None),
+                            range_header: Optional[str] = Header(None, alias = "Range")):
     """
-    Retrieve the image presigned URL from S3 Bucket B.
+    Retrieve an image from S3 Bucket B. In the "redirect" IMAGE_DELIVERY mode, the client is redirected to a
+    short-lived presigned URL of the image, which the browser may reuse while it is valid. In the "proxy" mode,
+    the image data is served by the API, from its local image cache when enabled, and the If-None-Match and
+    Range headers are honored.
 
     Args:
         image_uuid (str): A string representing the unique identifier for the image.
+        size (int, optional): The size of the thumbnail to get, one of IMAGE_THUMBNAIL_SIZES. Defaults to the normalized image.
+        if_none_match (str, optional): The ETags of the copies of the image the client has. Defaults to Header(None).
+        range_header (str, optional): The single byte range of the image requested. Defaults to Header(None, alias = "Range").
 
     Returns:
-        StreamingResponse: Object containing the image data.
-    """    
-    return crud.get_image_from_s3(image_uuid)
+        RedirectResponse | StreamingResponse: The redirect to the image, the object containing the image data or a range of it, or an empty 304 response.
+
+    Raises:
+        HTTPException (HTTP_400_BAD_REQUEST): Error raised if there is no thumbnail of that size.
+    """
+    if size != None and size not in images.IMAGE_THUMBNAIL_SIZES:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = invalid_image_size_message)
+    image_uuid = images.variant_key(image_uuid, size)
+    if storage.IMAGE_DELIVERY == "redirect":
+        url, max_age = crud.get_image_url(image_uuid)
+        return RedirectResponse(url, status_code = status.HTTP_307_TEMPORARY_REDIRECT,
+                                headers = {"Cache-Control": f"private, max-age={int(max_age)}"})
+    return await run_in_threadpool(crud.get_image_from_s3, image_uuid, if_none_match, range_header)
+
+# GET DATABASE POOL METRICS (AUTHENTICATED USER)
+
+@app.get("/inventory/v1/metrics/pool",
+         response_description = "State and checkout statistics of the database connection pool.",
+         response_model = dict,
+         tags = ["Metrics"],
+         status_code = status.HTTP_200_OK)
+def get_pool_metrics(token: dict = Depends(auth.verify_access)) -> dict:
+    """
+    Get the state and checkout statistics of the database connection pool, used to size the pool.
+
+    Args:
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+
+    Returns:
+        dict: The pool size, checked out connections, overflow and checkout wait times of the async engine serving the API, and of the read replica if configured.
+    """
+    pools = {"async": database.pool_status(database.async_engine, database.async_pool_metrics)}
+    if database.async_read_engine is not database.async_engine:
+        pools["async_read"] = database.pool_status(database.async_read_engine, database.async_read_pool_metrics)
+    return pools
+
+# GET S3 METRICS (AUTHENTICATED USER)
+
+@app.get("/inventory/v1/metrics/s3",
+         response_description = "Latency statistics of the S3 operations.",
+         response_model = dict,
+         tags = ["Metrics"],
+         status_code = status.HTTP_200_OK)
+def get_s3_metrics(token: dict = Depends(auth.verify_access)) -> dict:
+    """
+    Get the latency statistics of the S3 operations run since startup, used to tune the S3 client.
+
+    Args:
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+
+    Returns:
+        dict: For each S3 operation, the number of calls and failed calls, and their mean and maximum latencies.
+    """
+    return storage.s3_metrics.as_dict()
+
+# GET IMAGE CACHE METRICS (AUTHENTICATED USER)
+
+@app.get("/inventory/v1/metrics/image-cache",
+         response_description = "Usage statistics of the local image cache.",
+         response_model = dict,
+         tags = ["Metrics"],
+         status_code = status.HTTP_200_OK)
+def get_image_cache_metrics(token: dict = Depends(auth.verify_access)) -> dict:
+    """
+    Get the usage statistics of the local image cache of the "proxy" image delivery mode, used to size the cache.
+
+    Args:
+        token (dict, optional): The decoded access token of the authenticated user. Defaults to Depends(auth.verify_access).
+
+    Returns:
+        dict: The size of the cache, its hits, misses and evictions, its hit ratio and the bytes it saved downloading, or an empty dict if the cache was not used.
+    """
+    cache = image_cache.image_cache
+    return cache.as_dict() if cache is not None else {}
 
 if __name__  == '__main__':
     run(app, host = '0.0.0.0', port = 8000)
\ No newline at end of file
@@ -0,0 +1,24 @@
+import os
+
+from alembic import context
+from sqlalchemy import create_engine
+
+# The API passes its own connection through config.attributes (see db_info/migrations.py). When run from the
+# alembic command line, connect to DATABASE_URL instead.
+
+def run_migrations(connection):
+    context.configure(connection = connection,
+                      target_metadata = None,
+                      render_as_batch = connection.dialect.name == "sqlite")
+    with context.begin_transaction():
+        context.run_migrations()
+
+connection = context.config.attributes.get("connection")
+if connection is not None:
+    run_migrations(connection)
+else:
+    engine = create_engine(os.getenv("DATABASE_URL", "sqlite:///:memory:"))
+    with engine.connect() as connection:
+        run_migrations(connection)
+        connection.commit()
+    engine.dispose()
@@ -0,0 +1,39 @@
+"""create items table
+
+Baseline schema, as created by Base.metadata.create_all before migrations were introduced. Databases that
+already have the items table but no alembic_version are stamped with this revision.
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-12-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "items",
+        sa.Column("id", sa.Integer(), primary_key = True),
+        sa.Column("description", sa.String(500)),
+        sa.Column("tag", sa.String(50)),
+        sa.Column("image", sa.String(500), nullable = True),
+        sa.Column("state", sa.String(50)),
+        sa.Column("dropoff_point_id", sa.Integer(), nullable = True),
+        sa.Column("insertion_date", sa.DateTime(timezone = True)),
+        sa.Column("report_email", sa.String(100), nullable = True),
+        sa.Column("retrieved_email", sa.String(100), nullable = True),
+        sa.Column("retrieved_date", sa.String(100), nullable = True),
+    )
+    op.create_index("ix_items_id", "items", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_id", table_name = "items")
+    op.drop_table("items")
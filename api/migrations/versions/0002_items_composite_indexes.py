@@ -0,0 +1,30 @@
+"""composite indexes on items
+
+Covers the filters and the insertion_date sort of crud.stored_items_statement,
+crud.dropoff_point_items_statement and contact.reported_items_statement.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_items_state_insertion_date", "items", ["state", "insertion_date"])
+    op.create_index("ix_items_state_tag_insertion_date", "items", ["state", "tag", "insertion_date"])
+    op.create_index("ix_items_dropoff_point_state_insertion_date", "items", ["dropoff_point_id", "state", "insertion_date"])
+    op.create_index("ix_items_tag_state", "items", ["tag", "state"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_tag_state", table_name = "items")
+    op.drop_index("ix_items_dropoff_point_state_insertion_date", table_name = "items")
+    op.drop_index("ix_items_state_tag_insertion_date", table_name = "items")
+    op.drop_index("ix_items_state_insertion_date", table_name = "items")
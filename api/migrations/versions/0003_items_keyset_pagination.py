@@ -0,0 +1,41 @@
+"""items keyset pagination
+
+Keyset pagination (db_info/pagination.py) orders and seeks on (insertion_date, id),
+so every item needs an insertion date. Missing dates are backfilled with the
+migration time. On SQLite, dates written by the former func.now() default
+('YYYY-MM-DD HH:MM:SS') are rewritten in the format SQLAlchemy binds
+('YYYY-MM-DD HH:MM:SS.ffffff'), otherwise the text comparisons of the cursor
+predicate do not match. ix_items_insertion_date lets the unfiltered listing seek
+to the cursor instead of sorting the whole table.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE items SET insertion_date = CURRENT_TIMESTAMP WHERE insertion_date IS NULL")
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("UPDATE items SET insertion_date = insertion_date || '.000000' WHERE length(insertion_date) = 19")
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.alter_column("insertion_date",
+                              existing_type = sa.DateTime(timezone = True),
+                              nullable = False)
+    op.create_index("ix_items_insertion_date", "items", ["insertion_date"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_insertion_date", table_name = "items")
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.alter_column("insertion_date",
+                              existing_type = sa.DateTime(timezone = True),
+                              nullable = True)
@@ -0,0 +1,30 @@
+"""leases table
+
+Named leases that let one API worker at a time run the archiving sweeper
+(db_info/archiver.py).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "leases",
+        sa.Column("name", sa.String(50), primary_key = True),
+        sa.Column("owner", sa.String(100), nullable = False),
+        sa.Column("expires_at", sa.DateTime, nullable = False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("leases")
@@ -0,0 +1,65 @@
+"""items.retrieved_date as an indexed timestamp
+
+retrieved_date was a String(100) filled with str(datetime.now()). It becomes a
+DateTime(timezone=True) so the archiving cutoff and date filters run in SQL,
+with ix_items_state_retrieved_date serving them. The existing strings are
+parsed into a new column, which then replaces the old one; values that do not
+parse become NULL.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+items = sa.table("items",
+                 sa.column("id", sa.Integer),
+                 sa.column("retrieved_date", sa.String(100)),
+                 sa.column("retrieved_date_new", sa.DateTime(timezone = True)))
+
+
+def parse(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def copy_rows(source, target, convert) -> None:
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(items.c.id, items.c[source]).where(items.c[source] != None)).fetchall()
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = [{"item_id": id, "value": convert(value)} for id, value in rows[start:start + BATCH_SIZE]]
+        connection.execute(items.update().where(items.c.id == sa.bindparam("item_id")).values({target: sa.bindparam("value")}), batch)
+
+
+def upgrade() -> None:
+    op.add_column("items", sa.Column("retrieved_date_new", sa.DateTime(timezone = True), nullable = True))
+    copy_rows("retrieved_date", "retrieved_date_new", parse)
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.drop_column("retrieved_date")
+        batch_op.alter_column("retrieved_date_new", new_column_name = "retrieved_date",
+                              existing_type = sa.DateTime(timezone = True), existing_nullable = True)
+    op.create_index("ix_items_state_retrieved_date", "items", ["state", "retrieved_date"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_state_retrieved_date", table_name = "items")
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.alter_column("retrieved_date", new_column_name = "retrieved_date_new",
+                              existing_type = sa.DateTime(timezone = True), existing_nullable = True)
+    op.add_column("items", sa.Column("retrieved_date", sa.String(100), nullable = True))
+    copy_rows("retrieved_date_new", "retrieved_date", str)
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.drop_column("retrieved_date_new")
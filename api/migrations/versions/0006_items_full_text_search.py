@@ -0,0 +1,50 @@
+"""full-text index on items.description and items.tag
+
+Backs the /inventory/v1/items/search endpoint. MySQL gets a FULLTEXT index,
+which InnoDB keeps up to date. SQLite gets an external-content FTS5 table,
+filled with the existing rows and kept in sync by triggers on items. Other
+dialects are left alone and searched with LIKE.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(description, tag, content='items', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts(rowid, description, tag) VALUES (new.id, new.description, new.tag); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, description, tag) VALUES ('delete', old.id, old.description, old.tag); END",
+    "CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF description, tag ON items BEGIN "
+    "INSERT INTO items_fts(items_fts, rowid, description, tag) VALUES ('delete', old.id, old.description, old.tag); "
+    "INSERT INTO items_fts(rowid, description, tag) VALUES (new.id, new.description, new.tag); END",
+]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for statement in SQLITE_FTS_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO items_fts(items_fts) VALUES ('rebuild')")
+    elif dialect == "mysql":
+        op.execute("CREATE FULLTEXT INDEX ix_items_fulltext ON items (description, tag)")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        for trigger in ["items_fts_update", "items_fts_delete", "items_fts_insert"]:
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS items_fts")
+    elif dialect == "mysql":
+        op.drop_index("ix_items_fulltext", table_name = "items")
@@ -0,0 +1,39 @@
+"""email_outbox table
+
+Emails queued in the same transaction as the item changes they notify about,
+delivered in the background by the mailer (db_info/mailer.py).
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "email_outbox",
+        sa.Column("id", sa.Integer, primary_key = True),
+        sa.Column("recipient", sa.String(100), nullable = False),
+        sa.Column("subject", sa.String(200), nullable = False),
+        sa.Column("body", sa.Text, nullable = False),
+        sa.Column("status", sa.String(20), nullable = False),
+        sa.Column("attempts", sa.Integer, nullable = False),
+        sa.Column("next_attempt_at", sa.DateTime, nullable = True),
+        sa.Column("last_error", sa.String(500), nullable = True),
+        sa.Column("created_at", sa.DateTime, nullable = False),
+        sa.Column("sent_at", sa.DateTime, nullable = True),
+    )
+    op.create_index("ix_email_outbox_status_next_attempt_at", "email_outbox", ["status", "next_attempt_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_email_outbox_status_next_attempt_at", table_name = "email_outbox")
+    op.drop_table("email_outbox")
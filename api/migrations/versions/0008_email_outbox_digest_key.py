@@ -0,0 +1,27 @@
+"""email_outbox digest_key
+
+Emails queued under a digest key are held for a while by the mailer and merged
+with the other emails queued to the same recipient under that key.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("email_outbox", sa.Column("digest_key", sa.String(50), nullable = True))
+    op.create_index("ix_email_outbox_recipient_digest_key_status", "email_outbox", ["recipient", "digest_key", "status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_email_outbox_recipient_digest_key_status", table_name = "email_outbox")
+    op.drop_column("email_outbox", "digest_key")
@@ -0,0 +1,26 @@
+"""items image_status
+
+Images are uploaded in the background: the status of the upload of the image
+of each item. The images uploaded before are ready.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("items", sa.Column("image_status", sa.String(20), nullable = True))
+    op.execute("UPDATE items SET image_status = 'ready' WHERE image IS NOT NULL")
+
+
+def downgrade() -> None:
+    op.drop_column("items", "image_status")
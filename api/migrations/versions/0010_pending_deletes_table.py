@@ -0,0 +1,38 @@
+"""pending_deletes table
+
+S3 objects queued for deletion in the same transaction as the item deletions
+that orphan them, deleted in batches in the background by the deleter
+(db_info/deleter.py).
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "pending_deletes",
+        sa.Column("id", sa.Integer, primary_key = True),
+        sa.Column("key", sa.String(500), nullable = False),
+        sa.Column("attempts", sa.Integer, nullable = False),
+        sa.Column("next_attempt_at", sa.DateTime, nullable = True),
+        sa.Column("last_error", sa.String(500), nullable = True),
+        sa.Column("created_at", sa.DateTime, nullable = False),
+    )
+    op.create_index("ix_pending_deletes_next_attempt_at", "pending_deletes", ["next_attempt_at"])
+    op.create_index("ix_pending_deletes_key", "pending_deletes", ["key"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_pending_deletes_key", table_name = "pending_deletes")
+    op.drop_index("ix_pending_deletes_next_attempt_at", table_name = "pending_deletes")
+    op.drop_table("pending_deletes")
@@ -0,0 +1,25 @@
+"""items image index
+
+Images are content-addressed and shared by the items with the same picture:
+covers crud.image_statuses_statement and crud.image_refcount_statement, run
+on every upload and item deletion.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_items_image", "items", ["image"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_image", table_name = "items")
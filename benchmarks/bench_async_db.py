@@ -0,0 +1,83 @@
+"""
+Requests/sec of the sync (def route + Session) and async (async def route + AsyncSession) data paths under
+high concurrency.
+
+The sync path runs every request in Starlette's threadpool, so its throughput is capped by the number of
+threadpool workers; the async path is only capped by the database pool. Both apps query the same seeded
+database. Point DATABASE_URL at MySQL to measure against the production driver pair
+(mysqlconnector / aiomysql); by default a temporary SQLite file is used.
+
+Run from the repository root:
+    python benchmarks/bench_async_db.py [requests] [concurrency]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+import httpx
+
+from fastapi import Depends, FastAPI
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from api.db_info import async_crud, crud, database, models
+
+def seed(rows: int):
+    database.Base.metadata.create_all(bind = database.engine)
+    with database.SessionLocal() as db:
+        if db.query(models.Item).count() == 0:
+            db.add_all([models.Item(description = f"item {i}", tag = "Chaves", state = "stored", dropoff_point_id = i % 5)
+                        for i in range(rows)])
+            db.commit()
+
+def sync_app() -> FastAPI:
+    app = FastAPI()
+
+    def get_db():
+        with database.SessionLocal() as db:
+            yield db
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int, db: Session = Depends(get_db)):
+        return {"id": crud.get_item_by_id(db, item_id).id}
+
+    return app
+
+def async_app() -> FastAPI:
+    app = FastAPI()
+
+    async def get_db():
+        async with database.AsyncSessionLocal() as db:
+            yield db
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int, db: AsyncSession = Depends(get_db)):
+        return {"id": (await async_crud.get_item_by_id(db, item_id)).id}
+
+    return app
+
+async def run(app: FastAPI, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport = httpx.ASGITransport(app = app), base_url = "http://bench") as client:
+        async def call(i: int):
+            async with semaphore:
+                response = await client.get(f"/items/{i % 100 + 1}")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[call(i) for i in range(requests)])
+        return requests / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seed(1000)
+    print(f"{requests} requests, concurrency {concurrency}, {database.SQLALCHEMY_DATABASE_URL.split('://')[0]}")
+    print(f"sync  path: {asyncio.run(run(sync_app(), requests, concurrency)):10.1f} req/s")
+    print(f"async path: {asyncio.run(run(async_app(), requests, concurrency)):10.1f} req/s")
@@ -0,0 +1,40 @@
+"""
+Microbenchmark of the per-request cost of auth.verify_access with and without the verified token cache.
+
+Run from the repository root:
+    python benchmarks/bench_auth.py [iterations]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tests.test_auth import JWKSServer, audience, make_request, make_token, signing_keys
+from api.db_info import auth
+
+async def run(iterations: int, cache_size: int) -> float:
+    auth.token_cache = auth.VerifiedTokenCache(maxsize = cache_size)
+    request = make_request(make_token(signing_keys["k1"][1], "k1", os.environ["COGNITO_ISSUER"]))
+    await auth.verify_access(request)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await auth.verify_access(request)
+    return (time.perf_counter() - start) / iterations
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server = JWKSServer()
+    server.keys = [signing_keys["k1"][0]]
+    os.environ["COGNITO_ISSUER"] = server.issuer
+    os.environ["COGNITO_AUDIENCE"] = audience
+    try:
+        uncached = asyncio.run(run(iterations, cache_size = 0))
+        cached = asyncio.run(run(iterations, cache_size = 1024))
+    finally:
+        server.close()
+    print(f"verify_access without token cache: {uncached * 1e6:10.1f} us/request")
+    print(f"verify_access with token cache:    {cached * 1e6:10.1f} us/request")
+    print(f"speedup:                           {uncached / cached:10.1f}x")
+    print(f"JWKS fetches:                      {server.hits:10d}")
@@ -0,0 +1,81 @@
+"""
+Query plans and latencies of the hot item queries before and after the composite index migration.
+
+The database is migrated to the baseline revision, seeded, measured, migrated to head and measured again.
+Point DATABASE_URL at an empty MySQL schema to measure the production engine; by default a temporary SQLite
+file is used.
+
+Run from the repository root:
+    python benchmarks/bench_indexes.py [rows]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from alembic import command
+from sqlalchemy import create_engine, insert, text
+from api.db_info import crud, matching, migrations, models
+
+TAGS = ["Portáteis", "Telemóveis", "Tablets", "Carregadores", "Chaves", "Cartão", "Óculos", "Casacos", "Mochilas", "Livros"]
+STATES = ["stored"] * 3 + ["retrieved"] * 3 + ["archived"] * 10 + ["reported"] * 2
+
+QUERIES = {
+    "stored items by tag": crud.stored_items_statement({"tag": "Chaves"}).limit(20),
+    "stored items (no filter)": crud.stored_items_statement({}).limit(20),
+    "drop-off point items by state": crud.dropoff_point_items_statement(3, {"state": "stored"}).limit(20),
+    "reported items to match": matching.indexed_items_statement(matching.reports_index),
+}
+
+def seed(connection, rows: int, chunk: int = 50000):
+    start = datetime(2023, 1, 1)
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            state = random.choice(STATES)
+            batch.append({"description": f"item {i}",
+                          "tag": random.choice(TAGS),
+                          "state": state,
+                          "dropoff_point_id": None if state == "reported" else random.randint(1, 10),
+                          "insertion_date": start + timedelta(seconds = i),
+                          "report_email": f"user{i % 5000}@ua.pt" if state == "reported" else None})
+        connection.execute(insert(models.Item.__table__), batch)
+
+def measure(connection, label: str, repeat: int = 5):
+    explain = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    print(f"\n== {label}")
+    for name, statement in QUERIES.items():
+        sql = str(statement.compile(connection, compile_kwargs = {"literal_binds": True}))
+        plan = [" | ".join(str(column) for column in row) for row in connection.execute(text(explain + sql))]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(text(sql)).fetchall()
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f"{name:32s} {elapsed * 1000:10.2f} ms")
+        for line in plan:
+            print(f"    {line}")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    url = os.getenv("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        command.upgrade(migrations.get_config(connection), migrations.BASELINE_REVISION)
+        print(f"seeding {rows} rows into {engine.dialect.name}...")
+        seed(connection, rows)
+    with engine.connect() as connection:
+        measure(connection, "baseline (0001)")
+    with engine.begin() as connection:
+        start = time.perf_counter()
+        migrations.upgrade(connection)
+        print(f"\nmigration to head took {time.perf_counter() - start:.1f} s")
+    with engine.connect() as connection:
+        if connection.dialect.name == "sqlite":
+            connection.execute(text("ANALYZE"))
+        measure(connection, "with composite indexes (head)")
+    engine.dispose()
@@ -0,0 +1,70 @@
+"""
+Latency of matching a found item against a growing number of lost-item reports.
+
+Compares the former tag scan, which loads every report of the tag (a tenth of them here), with the similarity
+index of matching.py, whose lookups only walk the postings of the features of the query and skip the ones too
+frequent to matter. Also reports how many of the tag-scan "matches" the ranked lookup keeps.
+
+Run from the repository root:
+    python benchmarks/bench_matching.py [max_reports]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from api.db_info import matching
+
+TAGS = ["Portáteis", "Telemóveis", "Tablets", "Carregadores", "Chaves", "Cartão", "Óculos", "Casacos", "Mochilas", "Livros"]
+OBJECTS = ["telemóvel", "portátil", "carregador", "chaves", "carteira", "casaco", "mochila", "livro", "óculos", "garrafa",
+           "auscultadores", "cachecol", "luvas", "chapéu", "caderno", "estojo", "relógio", "pulseira", "cartão", "guarda-chuva"]
+COLORS = ["preto", "branco", "azul", "vermelho", "verde", "cinzento", "rosa", "amarelo", "castanho", "roxo"]
+BRANDS = ["samsung", "apple", "xiaomi", "lenovo", "asus", "hp", "nike", "adidas", "eastpak", "sony", "jbl", "huawei"]
+DETAILS = ["com autocolante", "com capa", "riscado", "novo", "partido", "com nome", "pequeno", "grande", "com porta-chaves"]
+LOOKUPS = 200
+
+def description(rng: random.Random) -> str:
+    words = [rng.choice(OBJECTS), rng.choice(BRANDS), rng.choice(COLORS), rng.choice(DETAILS)]
+    # A rarer word, like the serial numbers, names or stickers people mention
+    words.append(f"{rng.choice(COLORS)}{rng.randint(0, 20000)}")
+    return " ".join(words)
+
+def measure(reports: list, queries: list):
+    index = matching.SimilarityIndex("reported")
+    start = time.perf_counter()
+    for id, (text, tag) in enumerate(reports, 1):
+        index.add(id, text, tag)
+    build = time.perf_counter() - start
+
+    by_tag = {}
+    for id, (text, tag) in enumerate(reports, 1):
+        by_tag.setdefault(tag, []).append(id)
+
+    start = time.perf_counter()
+    results = [index.query(text, tag, matching.MATCH_TOP_K, matching.MATCH_THRESHOLD) for source, text, tag in queries]
+    lookup = (time.perf_counter() - start) / len(queries)
+
+    ranked = sum(len(matches) for matches in results) / len(queries)
+    found = sum(source in [id for id, _ in matches] for (source, _, _), matches in zip(queries, results)) / len(queries)
+    scanned = sum(len(by_tag[tag]) for _, _, tag in queries) / len(queries)
+    print(f"{len(reports):>9} reports  build {build:6.2f} s  lookup {lookup * 1000:7.3f} ms  tag scan emails {scanned:8.1f}"
+          f"  ranked emails {ranked:5.2f}  source report ranked {found:6.1%}")
+
+if __name__ == "__main__":
+    max_reports = int(sys.argv[1]) if len(sys.argv) > 1 else 256000
+    rng = random.Random(42)
+    reports = [(description(rng), rng.choice(TAGS)) for _ in range(max_reports)]
+    # Found items resembling reports present at every size, with one word changed
+    queries = []
+    for source in rng.sample(range(1, 1001), LOOKUPS):
+        text, tag = reports[source - 1]
+        words = text.split(" ")
+        words[rng.randrange(len(words))] = rng.choice(COLORS)
+        queries.append((source, " ".join(words), tag))
+
+    size = 1000
+    while size <= max_reports:
+        measure(reports[:size], queries)
+        size *= 4
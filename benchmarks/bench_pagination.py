@@ -0,0 +1,85 @@
+"""
+Latency of OFFSET and cursor (keyset) pagination of the item listings at increasing page depth.
+
+OFFSET pages get slower the deeper they are, because the database walks every skipped row; cursor pages seek
+through the (state, insertion_date) index and should cost the same at any depth. The COUNT(*) that OFFSET pages
+run for their total, and that cursor pages skip unless asked, is measured separately.
+
+Point DATABASE_URL at an empty MySQL schema to measure the production engine; by default a temporary SQLite
+file is used.
+
+Run from the repository root:
+    python benchmarks/bench_pagination.py [rows]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.orm import Session
+from api.db_info import crud, migrations, models, pagination
+
+TAGS = ["Portáteis", "Telemóveis", "Tablets", "Carregadores", "Chaves", "Cartão", "Óculos", "Casacos", "Mochilas", "Livros"]
+STATES = ["stored"] * 3 + ["retrieved"] * 3 + ["archived"] * 10 + ["reported"] * 2
+PAGE_SIZE = 20
+PAGES = [1, 10, 100, 1000, 5000]
+
+def seed(connection, rows: int, chunk: int = 50000):
+    start = datetime(2023, 1, 1)
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            state = random.choice(STATES)
+            batch.append({"description": f"item {i}",
+                          "tag": random.choice(TAGS),
+                          "state": state,
+                          "dropoff_point_id": None if state == "reported" else random.randint(1, 10),
+                          "insertion_date": start + timedelta(seconds = i)})
+        connection.execute(insert(models.Item.__table__), batch)
+
+def timed(db, statement, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        db.scalars(statement).all()
+    return (time.perf_counter() - start) / repeat
+
+def measure(db, label: str, statement, repeat: int = 5):
+    total = db.scalar(select(func.count()).select_from(statement.order_by(None).subquery()))
+    print(f"\n== {label} ({total} rows, pages of {PAGE_SIZE})")
+    print(f"{'page':>8s} {'offset':>12s} {'cursor':>12s}")
+    for page in PAGES:
+        skipped = (page - 1) * PAGE_SIZE
+        if skipped >= total:
+            break
+        cursor = None
+        if skipped > 0:
+            # The cursor a client holds after walking to this page: the position of the last item of the previous one
+            cursor = pagination.encode_cursor(db.scalars(statement.offset(skipped - 1).limit(1)).one())
+        offset_time = timed(db, statement.offset(skipped).limit(PAGE_SIZE), repeat)
+        cursor_time = timed(db, pagination.cursor_statement(statement, cursor, PAGE_SIZE), repeat)
+        print(f"{page:8d} {offset_time * 1000:9.2f} ms {cursor_time * 1000:9.2f} ms")
+    start = time.perf_counter()
+    for _ in range(repeat):
+        db.scalar(select(func.count()).select_from(statement.order_by(None).subquery()))
+    print(f"{'COUNT(*)':>8s} {(time.perf_counter() - start) / repeat * 1000:9.2f} ms")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    url = os.getenv("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        migrations.upgrade(connection)
+        print(f"seeding {rows} rows into {engine.dialect.name}...")
+        seed(connection, rows)
+        if connection.dialect.name == "sqlite":
+            connection.execute(text("ANALYZE"))
+    with Session(engine) as db:
+        measure(db, "all items", crud.items_statement())
+        measure(db, "stored items", crud.stored_items_statement({}))
+    engine.dispose()
@@ -0,0 +1,84 @@
+"""
+Per-row cost and peak memory of rendering a 10k-item page, before and after the lean list path.
+
+- orm: ORM entities, validated one by one into schemas.Item, encoded with jsonable_encoder and the stdlib json
+  module (what FastAPI does with a response_model and the default JSONResponse).
+- lean: plain column tuples (pagination.lean_statement), validated in one batch by pagination.validate_rows and
+  rendered with orjson, as custom_paginate does.
+
+Run from the repository root:
+    python benchmarks/bench_serialization.py [rows]
+"""
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import orjson
+
+from fastapi.encoders import jsonable_encoder
+from fastapi_pagination import Page
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from api.db_info import crud, migrations, models, pagination, schemas
+
+def seed(connection, rows: int):
+    start = datetime(2023, 1, 1)
+    connection.execute(insert(models.Item.__table__), [
+        {"description": f"item {i} " + "x" * 80,
+         "tag": "Chaves",
+         "image": f"{i:032x}",
+         "state": "retrieved" if i % 2 else "stored",
+         "dropoff_point_id": i % 10,
+         "insertion_date": start + timedelta(seconds = i),
+         "retrieved_email": "someone@ua.pt" if i % 2 else None,
+         "retrieved_date": start + timedelta(days = 1, seconds = i) if i % 2 else None}
+        for i in range(rows)])
+
+def render_orm(db, statement, rows: int) -> bytes:
+    items = db.scalars(statement.limit(rows)).all()
+    page = Page[schemas.Item](items = [schemas.Item.model_validate(item, from_attributes = True) for item in items],
+                              total = rows, page = 1, size = rows, pages = 1)
+    body = json.dumps(jsonable_encoder(page)).encode()
+    db.expunge_all()
+    return body
+
+def render_lean(db, statement, rows: int) -> bytes:
+    items = pagination.validate_rows(db.execute(pagination.lean_statement(statement).limit(rows)).all())
+    page = Page[schemas.Item](items = items, total = rows, page = 1, size = rows, pages = 1)
+    return orjson.dumps(page.model_dump())
+
+def measure(db, render, rows: int, repeat: int = 5):
+    statement = crud.items_statement()
+    body = render(db, statement, rows)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render(db, statement, rows)
+    elapsed = (time.perf_counter() - start) / repeat
+    gc.collect()
+    tracemalloc.start()
+    render(db, statement, rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{render.__name__:12s} {elapsed * 1000:9.1f} ms/page {elapsed / rows * 1e6:7.2f} us/row "
+          f"{peak / 2**20:7.1f} MiB peak {len(body) / 2**20:6.2f} MiB body")
+    return body
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    with engine.begin() as connection:
+        migrations.upgrade(connection)
+        seed(connection, rows)
+    with Session(engine) as db:
+        orm_body = measure(db, render_orm, rows)
+        lean_body = measure(db, render_lean, rows)
+    assert json.loads(orm_body) == json.loads(lean_body), "both paths must render the same page"
+    engine.dispose()
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+from pytest import fixture, mark
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from api.db_info import archiver, database, models
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/archiver.db")
+    async with engine.begin() as connection:
+        await connection.run_sync(database.Base.metadata.create_all)
+    try:
+        yield async_sessionmaker(bind = engine, expire_on_commit = False)
+    finally:
+        await engine.dispose()
+
+## UNIT TESTS
+
+# FUNCTION acquire_lease / release_lease
+
+@mark.anyio
+async def test_lease_held_by_one_worker(session_factory):
+    async with session_factory() as db:
+        assert await archiver.acquire_lease(db, "job", "worker-1", ttl = 60) == True
+        assert await archiver.acquire_lease(db, "job", "worker-2", ttl = 60) == False
+        # The holder renews its own lease
+        assert await archiver.acquire_lease(db, "job", "worker-1", ttl = 60) == True
+
+        await archiver.release_lease(db, "job", "worker-1")
+        assert await archiver.acquire_lease(db, "job", "worker-2", ttl = 60) == True
+
+@mark.anyio
+async def test_expired_lease_is_taken_over(session_factory):
+    async with session_factory() as db:
+        assert await archiver.acquire_lease(db, "job", "worker-1", ttl = -1) == True
+        assert await archiver.acquire_lease(db, "job", "worker-2", ttl = 60) == True
+        assert (await db.scalar(select(models.Lease.owner).where(models.Lease.name == "job"))) == "worker-2"
+
+# FUNCTION sweep
+
+@mark.anyio
+async def test_sweep_archives_once_across_workers(session_factory):
+    now = datetime.now()
+    async with session_factory() as db:
+        db.add(models.Item(description = "old", tag = "tag", state = "retrieved", dropoff_point_id = 1, retrieved_date = now - timedelta(weeks = 2)))
+        db.add(models.Item(description = "recent", tag = "tag", state = "retrieved", dropoff_point_id = 1, retrieved_date = now))
+        await db.commit()
+
+    assert await archiver.sweep(session_factory, owner = "worker-1") == 1
+    # Another worker skips the sweep while the lease is held
+    assert await archiver.sweep(session_factory, owner = "worker-2") == None
+    assert await archiver.sweep(session_factory, owner = "worker-1") == 0
+
+    async with session_factory() as db:
+        states = {item.description: item.state for item in await db.scalars(select(models.Item))}
+    assert states == {"old": "archived", "recent": "retrieved"}
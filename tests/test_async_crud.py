@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta
+from fastapi import File, UploadFile
+from pytest import fixture, mark
+from unittest.mock import patch
+from sqlalchemy import select
+from api.db_info import schemas, database, async_crud, images, matching, models
+from tests.test_crud import item_bucket, add_items_to_db
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+async def db():
+    async with database.async_engine.connect() as connection:
+        await connection.run_sync(database.Base.metadata.create_all)
+        await connection.commit()
+        matching.reports_index.clear()
+        matching.stored_index.clear()
+        transaction = await connection.begin()
+        session = database.AsyncSessionLocal(bind = connection)
+        try:
+            yield session
+        finally:
+            await session.close()
+            await transaction.rollback()
+
+## UNIT TESTS
+
+# FUNCTION get_items
+
+@mark.anyio
+async def test_get_items(db):
+    assert (await db.scalars(await async_crud.get_items(db = db))).all() == []
+
+    await db.run_sync(add_items_to_db, item_bucket)
+
+    items = (await db.scalars(await async_crud.get_items(db = db))).all()
+    assert len(items) == 4
+
+# FUNCTION get_item_by_id
+
+@mark.anyio
+async def test_get_item_by_id(db):
+    assert await async_crud.get_item_by_id(db = db, id = 1) == None
+
+    await db.run_sync(add_items_to_db, item_bucket)
+    items = (await db.scalars(await async_crud.get_items(db = db))).all()
+
+    item = await async_crud.get_item_by_id(db = db, id = items[0].id)
+    assert item.description == items[0].description
+
+# FUNCTION archive_retrieved_items
+
+@mark.anyio
+async def test_archive_retrieved_items(db):
+    now = datetime.now()
+    await db.run_sync(add_items_to_db, [
+        models.Item(description = "old", tag = "tag", state = "retrieved", dropoff_point_id = 1, retrieved_date = now - timedelta(weeks = 2)),
+        models.Item(description = "recent", tag = "tag", state = "retrieved", dropoff_point_id = 1, retrieved_date = now - timedelta(days = 1)),
+    ])
+
+    assert await async_crud.archive_retrieved_items(db = db) == 1
+    states = {item.description: item.state for item in await db.scalars(await async_crud.get_items(db = db))}
+    assert states == {"old": "archived", "recent": "retrieved"}
+
+# FUNCTION get_stored_items
+
+@mark.anyio
+async def test_get_stored_items(db):
+    await db.run_sync(add_items_to_db, item_bucket)
+
+    for filter_param in [{}, {"tag": "tag1"}, {"dropoff_point_id": 2}]:
+        items = (await db.scalars(await async_crud.get_stored_items(db = db, filter = filter_param))).all()
+        assert len(items) == 1
+        assert all(item.state == "stored" for item in items)
+
+    items = (await db.scalars(await async_crud.get_stored_items(db = db, filter = {"tag": "tag2"}))).all()
+    assert items == []
+
+# FUNCTION get_dropoff_point_items
+
+@mark.anyio
+async def test_get_dropoff_point_items(db):
+    await db.run_sync(add_items_to_db, item_bucket)
+
+    items = (await db.scalars(await async_crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = {}))).all()
+    assert len(items) == 2
+    assert all(item.dropoff_point_id == 2 for item in items)
+
+    items = (await db.scalars(await async_crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = {"tag": "tag2", "state": "stored"}))).all()
+    assert len(items) == 0
+
+# FUNCTION search_items
+
+@mark.anyio
+@patch("api.db_info.contact.send_reported_emails")
+@patch("api.db_info.contact.contact_netrieved_email")
+@patch("api.db_info.crud.delete_file_from_s3")
+async def test_search_items(mock_delete_file_from_s3, mock_contact_netrieved_email, mock_send_reported_emails, db):
+    async def search(query: str, filter: dict) -> list:
+        return [item.id for item in (await db.scalars(await async_crud.search_items(db = db, query = query, filter = filter))).all()]
+
+    new_item = schemas.ItemCreate(description = "blue umbrella", tag = "Guarda-chuvas", image = None, dropoff_point_id = 1)
+    item = await async_crud.create_item(db = db, new_item = new_item)
+    assert await search("umbrella", {"state": "stored"}) == [item.id]
+
+    await async_crud.retrieve_item(db = db, id = item.id, retrieved_email = "retrieved_email")
+    assert await search("umbrella", {"state": "stored"}) == []
+    assert await search("umbrella", {"state": "retrieved"}) == [item.id]
+
+    await async_crud.delete_item(db = db, id = item.id)
+    assert await search("umbrella", {}) == []
+
+# FUNCTION create_item
+
+@mark.anyio
+@patch("api.db_info.uploads.submit")
+@patch("api.db_info.uploads.spool")
+@patch("api.db_info.contact.send_reported_emails")
+async def test_create_item(mock_send_reported_emails, mock_spool, mock_submit, db):
+    await db.run_sync(add_items_to_db, item_bucket)
+    mock_spool.return_value = ("spooled_image", "image_sha256")
+
+    # Similar to the 'reported' item of the bucket
+    new_item = schemas.ItemCreate(
+        description = "item_bucket_1",
+        tag = "tag1",
+        image = UploadFile(File()),
+        dropoff_point_id = 1
+    )
+
+    item = await async_crud.create_item(db = db, new_item = new_item)
+    assert item.id != None
+    assert item.state == "stored"
+    assert item.image == "image_sha256"
+    assert item.image_status == "pending"
+    assert item.insertion_date != None
+    mock_submit.assert_called_once_with(item.id, item.image, "spooled_image")
+
+    reports = mock_send_reported_emails.call_args.args[1]
+    assert [report.report_email for report in reports] == ["report_email"]
+
+    # Sharing the tag is not enough
+    new_item = schemas.ItemCreate(description = "black umbrella", tag = "tag1", image = None, dropoff_point_id = 1)
+    await async_crud.create_item(db = db, new_item = new_item)
+    assert mock_send_reported_emails.call_args.args[1] == []
+
+# FUNCTION report_item
+
+@mark.anyio
+@patch("api.db_info.contact.contact_new_report")
+async def test_report_item(mock_contact_new_report, db):
+    new_item = schemas.ItemReport(
+        description = "new_item_description",
+        tag = "new_item_tag",
+        image = None,
+        report_email = "new_item_report_email"
+    )
+
+    await db.run_sync(add_items_to_db, [models.Item(description = "new item description", tag = "new_item_tag", state = "stored")])
+
+    item = await async_crud.report_item(db = db, new_item = new_item)
+    assert item.state == "reported"
+    assert item.report_email == new_item.report_email
+    mock_contact_new_report.assert_called_once()
+    # The report is matched against the stored items
+    assert [match.description for match in mock_contact_new_report.call_args.args[2]] == ["new item description"]
+
+# FUNCTION retrieve_item
+
+@mark.anyio
+@patch("api.db_info.contact.contact_netrieved_email")
+async def test_retrieve_item(mock_contact_netrieved_email, db):
+    await db.run_sync(add_items_to_db, [item_bucket[0]])
+    item_in_db = (await db.scalars(await async_crud.get_items(db = db))).first()
+
+    item = await async_crud.retrieve_item(db = db, id = item_in_db.id, retrieved_email = "retrieved_email")
+    assert item.state == "retrieved"
+    assert item.retrieved_email == "retrieved_email"
+    assert item.retrieved_date != None
+
+    assert await async_crud.retrieve_item(db = db, id = 999, retrieved_email = "retrieved_email") == None
+    mock_contact_netrieved_email.assert_called_once()
+
+# FUNCTION delete_item
+
+@mark.anyio
+@patch("api.db_info.crud.delete_file_from_s3")
+async def test_delete_item(mock_delete_file_from_s3, db):
+    assert await async_crud.delete_item(db = db, id = 1) == None
+
+    await db.run_sync(add_items_to_db, [item_bucket[0]])
+    item_in_db = (await db.scalars(await async_crud.get_items(db = db))).first()
+
+    assert await async_crud.delete_item(db = db, id = item_in_db.id) == "OK"
+    assert (await db.scalars(await async_crud.get_items(db = db))).all() == []
+    # The image is deleted from S3 in the background
+    mock_delete_file_from_s3.assert_not_called()
+    pending = (await db.scalars(select(models.PendingDelete.key))).all()
+    assert sorted(pending) == sorted(images.variant_keys("image"))
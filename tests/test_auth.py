@@ -0,0 +1,231 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+import rsa
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from jose import jwt
+from pytest import fixture, mark, raises
+from fastapi import HTTPException, Request
+from api.db_info import auth
+
+## HELPER COMPONENTS
+
+issuer_path = "/issuer"
+audience = "inventory"
+
+def b64_int(value: int) -> str:
+    return base64.urlsafe_b64encode(value.to_bytes((value.bit_length() + 7) // 8, "big")).rstrip(b"=").decode()
+
+def new_signing_key(kid: str):
+    public_key, private_key = rsa.newkeys(1024)
+    jwk = {"kty": "RSA", "kid": kid, "alg": "RS256", "use": "sig", "n": b64_int(public_key.n), "e": b64_int(public_key.e)}
+    return jwk, private_key.save_pkcs1().decode()
+
+def make_token(pem: str, kid: str, issuer: str, exp_offset: int = 3600) -> str:
+    claims = {"sub": "staff", "iss": issuer, "aud": audience, "exp": int(time.time()) + exp_offset}
+    return jwt.encode(claims, pem, algorithm = "RS256", headers = {"kid": kid})
+
+def make_request(token: str) -> Request:
+    return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+class JWKSServer:
+    """Local stand-in for the Cognito JWKS endpoint that counts the requests it serves."""
+    def __init__(self):
+        self.keys = []
+        self.hits = 0
+        self.delay = 0
+        self.status = 200
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                time.sleep(server.delay)
+                body = json.dumps({"keys": server.keys}).encode()
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.issuer = f"http://127.0.0.1:{self.httpd.server_port}{issuer_path}"
+        self.jwks_url = f"{self.issuer}/.well-known/jwks.json"
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+signing_keys = {kid: new_signing_key(kid) for kid in ["k1", "k2"]}
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+def jwks_server(monkeypatch):
+    server = JWKSServer()
+    server.keys = [signing_keys["k1"][0]]
+    monkeypatch.setenv("COGNITO_ISSUER", server.issuer)
+    monkeypatch.setenv("COGNITO_AUDIENCE", audience)
+    auth._key_stores.clear()
+    auth.token_cache.clear()
+    try:
+        yield server
+    finally:
+        auth._key_stores.clear()
+        auth.token_cache.clear()
+        server.close()
+
+## UNIT TESTS
+
+# FUNCTION verify_access
+
+@mark.anyio
+async def test_verify_access_caches_jwks(jwks_server):
+    token = make_token(signing_keys["k1"][1], "k1", jwks_server.issuer)
+
+    for _ in range(5):
+        decoded = await auth.verify_access(make_request(token))
+        assert decoded["sub"] == "staff"
+
+    assert jwks_server.hits == 1
+
+@mark.anyio
+async def test_verify_access_unknown_kid_forces_one_refetch(jwks_server):
+    await auth.verify_access(make_request(make_token(signing_keys["k1"][1], "k1", jwks_server.issuer)))
+    assert jwks_server.hits == 1
+
+    # Key rotation: the issuer starts publishing k2
+    jwks_server.keys = [signing_keys["k1"][0], signing_keys["k2"][0]]
+    auth.get_key_store(jwks_server.issuer).min_refetch_interval = 0
+
+    decoded = await auth.verify_access(make_request(make_token(signing_keys["k2"][1], "k2", jwks_server.issuer)))
+    assert decoded["sub"] == "staff"
+    assert jwks_server.hits == 2
+
+    # A kid the issuer never published is rejected after a single refetch
+    with raises(HTTPException) as error:
+        await auth.verify_access(make_request(make_token(signing_keys["k2"][1], "unknown", jwks_server.issuer)))
+    assert error.value.status_code == 401
+    assert jwks_server.hits == 3
+
+@mark.anyio
+async def test_verify_access_uses_token_cache(jwks_server):
+    token = make_token(signing_keys["k1"][1], "k1", jwks_server.issuer)
+
+    await auth.verify_access(make_request(token))
+    await auth.verify_access(make_request(token))
+    await auth.verify_access(make_request(token))
+
+    assert auth.token_cache.stats()["hits"] == 2
+    assert auth.token_cache.stats()["misses"] == 1
+
+    # A tampered token is never answered from the cache
+    with raises(HTTPException) as error:
+        await auth.verify_access(make_request(token[:-4] + "AAAA"))
+    assert error.value.status_code == 401
+
+@mark.anyio
+async def test_verify_access_with_shared_http_client(jwks_server):
+    await auth.open_http_client()
+    try:
+        client = auth.http_client
+        decoded = await auth.verify_access(make_request(make_token(signing_keys["k1"][1], "k1", jwks_server.issuer)))
+        assert decoded["sub"] == "staff"
+        assert auth.http_client is client
+    finally:
+        await auth.close_http_client()
+    assert auth.http_client == None
+
+@mark.anyio
+async def test_verify_access_missing_header():
+    with raises(HTTPException) as error:
+        await auth.verify_access(Request({"type": "http", "headers": []}))
+    assert error.value.status_code == 401
+
+# CLASS JWKSKeyStore
+
+@mark.anyio
+async def test_key_store_unknown_kid_throttled(jwks_server):
+    store = auth.JWKSKeyStore(jwks_server.jwks_url, min_refetch_interval = 60)
+
+    assert await store.get_key("k1") == signing_keys["k1"][0]
+    assert await store.get_key("unknown") == None
+    assert jwks_server.hits == 1
+
+@mark.anyio
+async def test_key_store_concurrent_misses_share_fetch(jwks_server):
+    jwks_server.delay = 0.2
+    store = auth.JWKSKeyStore(jwks_server.jwks_url)
+
+    results = await asyncio.gather(*[store.get_key("k1") for _ in range(10)])
+
+    assert list(results) == [signing_keys["k1"][0]] * 10
+    assert jwks_server.hits == 1
+
+@mark.anyio
+async def test_key_store_concurrent_failures_share_fetch(jwks_server):
+    jwks_server.delay = 0.2
+    jwks_server.status = 503
+    store = auth.JWKSKeyStore(jwks_server.jwks_url)
+
+    results = await asyncio.gather(*[store.get_key("k1") for _ in range(10)], return_exceptions = True)
+
+    assert all(isinstance(result, auth.httpx.HTTPStatusError) for result in results)
+    assert jwks_server.hits == 1
+
+    # The next lookup tries again
+    jwks_server.status = 200
+    assert await store.get_key("k1") == signing_keys["k1"][0]
+    assert jwks_server.hits == 2
+
+@mark.anyio
+async def test_key_store_ttl_and_background_refresh(jwks_server):
+    store = auth.JWKSKeyStore(jwks_server.jwks_url, ttl = 60, refresh_margin = 60)
+
+    assert await store.get_key("k1") != None
+    assert jwks_server.hits == 1
+
+    # Inside the refresh margin the cached key is served while a refresh runs in the background
+    assert await store.get_key("k1") != None
+    await store._refresh_task
+    assert jwks_server.hits == 2
+
+    store = auth.JWKSKeyStore(jwks_server.jwks_url, ttl = 0, refresh_margin = 0)
+    await store.get_key("k1")
+    await store.get_key("k1")
+    assert jwks_server.hits == 4
+
+# CLASS VerifiedTokenCache
+
+def test_token_cache_expiry_and_eviction():
+    cache = auth.VerifiedTokenCache(maxsize = 2)
+    now = int(time.time())
+
+    cache.put("expired", {"exp": now - 1})
+    assert cache.get("expired") == None
+
+    cache.put("no_exp", {"sub": "staff"})
+    assert cache.get("no_exp") == None
+
+    cache.put("a", {"exp": now + 60})
+    cache.put("b", {"exp": now + 60})
+    assert cache.get("a") == {"exp": now + 60}
+    cache.put("c", {"exp": now + 60})
+
+    # "b" was the least recently used entry
+    assert cache.get("b") == None
+    assert cache.get("a") != None
+    assert cache.get("c") != None
+    assert cache.stats()["size"] == 2
+    assert cache.stats()["hits"] == 3
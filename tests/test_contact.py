@@ -1,7 +1,7 @@
 import datetime
 from pytest import fixture
-from unittest.mock import patch
-from api.db_info import schemas, database, crud, contact, models
+from sqlalchemy import select
+from api.db_info import schemas, database, crud, contact, matching, models
 
 @fixture(scope="function")
 def db():
@@ -10,6 +10,9 @@ def db():
     session = database.SessionLocal(bind = connection)
 
     database.Base.metadata.create_all(bind = connection)
+    # Ids are reused once the transaction is rolled back, so the indexes must not outlive a test
+    matching.reports_index.clear()
+    matching.stored_index.clear()
 
     try:
         yield session
@@ -18,10 +21,11 @@ def db():
         connection.close()
 
 
-@patch("api.db_info.contact.send_email")
-def test_contact_reported_email(mock_send_email, db):
-    mock_send_email.return_value = None
-    
+def outbox(db) -> list:
+    db.flush()
+    return db.scalars(select(models.EmailOutbox).order_by(models.EmailOutbox.id)).all()
+
+def test_contact_reported_email(db):
     new_item = schemas.ItemReport(
         description = "new_item_description",
         tag = "new_item_tag",
@@ -30,6 +34,7 @@ def test_contact_reported_email(mock_send_email, db):
     )
     
     crud.report_item(db = db, new_item = new_item)
+    assert [email.subject for email in outbox(db)] == ["O teu report foi adicionado!"]
     
     new_item = schemas.ItemCreate(
         description = "new_item_description",
@@ -40,12 +45,30 @@ def test_contact_reported_email(mock_send_email, db):
     
     crud.create_item(db = db, new_item = new_item)
     
-    mock_send_email.assert_called()
-    
-@patch("api.db_info.contact.send_email")
-def test_contact_new_report(mock_send_email):
-    mock_send_email.return_value = None
-    
+    emails = outbox(db)
+    assert [email.subject for email in emails] == ["O teu report foi adicionado!", "O teu item foi UAchado!"]
+    assert all(email.recipient == "new_item_report_email" and email.status == "pending" for email in emails)
+
+def test_send_reported_emails_once_per_address(db):
+    reports = [models.Item(description = "pink console", tag = "console", report_email = "a@ua.pt"),
+               models.Item(description = "pink console with a sticker", tag = "console", report_email = "b@ua.pt"),
+               models.Item(description = "console and controller", tag = "console", report_email = "a@ua.pt")]
+    new_item = schemas.ItemCreate(description = "pink console", tag = "console", image = None, dropoff_point_id = 1)
+
+    contact.send_reported_emails(db, reports, new_item)
+
+    emails = outbox(db)
+    assert [email.recipient for email in emails] == ["a@ua.pt", "b@ua.pt"]
+    assert all(email.digest_key == contact.ITEMS_FOUND_DIGEST for email in emails)
+    assert "Descrição: pink console" in emails[0].body
+
+def test_items_found_message():
+    message = contact.items_found_message(["Item: console\nDescrição: pink console\n",
+                                           "Item: console\nDescrição: console and controller\n"])
+    assert message.startswith("2 itens parecidos")
+    assert "pink console" in message and "console and controller" in message
+
+def test_contact_new_report(db):
     dummy_item = schemas.ItemReport(
         description = "new_item_description",
         tag = "new_item_tag",
@@ -53,14 +76,19 @@ def test_contact_new_report(mock_send_email):
         report_email = "new_item_report_email"
     )
 
-    contact.contact_new_report(dummy_item)
-    
-    mock_send_email.assert_called()
-    
-@patch("api.db_info.contact.send_email")
-def test_contact_netrieved_email(mock_send_email):
-    mock_send_email.return_value = None
+    contact.contact_new_report(db, dummy_item)
     
+    assert [email.recipient for email in outbox(db)] == ["new_item_report_email"]
+
+def test_contact_new_report_lists_matches(db):
+    report = schemas.ItemReport(description = "pink console", tag = "console", image = None, report_email = "new_item_report_email")
+    matches = [models.Item(description = "pink console with a sticker", tag = "console")]
+
+    contact.contact_new_report(db, report, matches)
+
+    assert "- console: pink console with a sticker" in outbox(db)[0].body
+
+def test_contact_netrieved_email(db):
     item = schemas.Item(id = 1,
         description = "item_bucket_0",
         tag = "tag1",
@@ -70,8 +98,8 @@ def test_contact_netrieved_email(mock_send_email):
         insertion_date = datetime.datetime.now(),
         report_email = None,
         retrieved_email = "dummy_email", 
-        retrieved_date = "dummy_datetime")
+        retrieved_date = datetime.datetime.now())
     
-    contact.contact_netrieved_email(item)
+    contact.contact_netrieved_email(db, item)
     
-    mock_send_email.assert_called()
\ No newline at end of file
+    assert [email.recipient for email in outbox(db)] == ["dummy_email"]
@@ -1,18 +1,23 @@
-from datetime import datetime
+import hashlib
+import io
+import os
+
+from datetime import datetime, timedelta
 from typing import List
 from pytest import fixture
 from fastapi import File, UploadFile
-from unittest.mock import patch
+from unittest.mock import ANY, patch
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from api.db_info import schemas, database, crud, models
+from api.db_info import schemas, database, crud, images, matching, models
 
 ## HELPER COMPONENTS
 
 item_bucket = [
     models.Item(description = "item_bucket_0", tag = "tag1", image = "image", state = "stored", dropoff_point_id = 2, report_email = None, retrieved_email = None, retrieved_date = None),
     models.Item(description = "item_bucket_1", tag = "tag1", image = "image", state = "reported", dropoff_point_id = None, report_email = "report_email", retrieved_email = None, retrieved_date = None),
-    models.Item(description = "item_bucket_2", tag = "tag2", image = "image", state = "retrieved", dropoff_point_id = 2, report_email = None, retrieved_email = "retrieved_email", retrieved_date = "retrieved_date"),
-    models.Item(description = "item_bucket_3", tag = "tag2", image = "image", state = "archived", dropoff_point_id = 1, report_email = None, retrieved_email = "retrieved_email", retrieved_date = "retrieved_date"),
+    models.Item(description = "item_bucket_2", tag = "tag2", image = "image", state = "retrieved", dropoff_point_id = 2, report_email = None, retrieved_email = "retrieved_email", retrieved_date = datetime(2023, 1, 1)),
+    models.Item(description = "item_bucket_3", tag = "tag2", image = "image", state = "archived", dropoff_point_id = 1, report_email = None, retrieved_email = "retrieved_email", retrieved_date = datetime(2023, 1, 1)),
 ]
 
 def add_items_to_db(db: Session, items: List[models.Item]):
@@ -38,6 +43,9 @@ def db():
     session = database.SessionLocal(bind = connection)
 
     database.Base.metadata.create_all(bind = connection)
+    # Ids are reused once the transaction is rolled back, so the indexes must not outlive a test
+    matching.reports_index.clear()
+    matching.stored_index.clear()
 
     try:
         yield session
@@ -49,90 +57,63 @@ def db():
 
 # FUNCTION get_items
 
-@patch("api.db_info.crud.update_retrieved_to_archived_items")
-def test_get_items_no_flag(mock_update_retrieved, db):
+def test_get_items(db):
     
-    items = crud.get_items(db = db, update_items = False)
+    items = db.scalars(crud.get_items(db = db)).all()
     assert len(items) == 0
     assert items == []
 
     add_items_to_db(db, item_bucket)
 
-    items = crud.get_items(db = db, update_items = False)
+    # Listings are newest first with ties broken by id, so compare regardless of order
+    items = db.scalars(crud.get_items(db = db)).all()
     assert len(items) == 4
-    assert items[0].description == item_bucket[0].description
-
-    mock_update_retrieved.assert_not_called()
-
-@patch("api.db_info.crud.update_retrieved_to_archived_items")
-def test_get_items_with_flag(mock_update_retrieved, db):
-
-    # NO ITEMS
-    
-    items = crud.get_items(db = db, update_items = True)
-    assert len(items) == 0
-    assert items == []
-
-    mock_update_retrieved.assert_not_called()
-
-    # NO RETRIEVED ITEMS
+    assert {item.description for item in items} == {item.description for item in item_bucket}
 
-    add_items_to_db(db, [item_bucket[0]])
-
-    items = crud.get_items(db = db, update_items = True)
-    assert len(items) == 1
-    assert items[0].state == item_bucket[0].state
+    # Reads never archive
+    assert {item.state for item in items} == {"stored", "reported", "retrieved", "archived"}
 
-    mock_update_retrieved.assert_not_called()
+# FUNCTION get_item_by_id
 
-    # RETRIEVED ITEMS TRUE
+def test_get_item_by_id(db):
 
-    add_items_to_db(db, [item_bucket[2]])
-    mock_update_retrieved.return_value = True
-
-    items = crud.get_items(db = db, update_items = True)
-    assert len(items) == 2
-    assert items[1].state == item_bucket[2].state
-
-    mock_update_retrieved.assert_called()
-@patch("api.db_info.crud.update_retrieved_to_archived_items")
-def test_get_item_by_id(mock_update_retrieved, db):
-
-    item = crud.get_item_by_id(db = db, id = 1, update_items = False)
+    item = crud.get_item_by_id(db = db, id = 1)
     assert item == None
 
     add_items_to_db(db, item_bucket)
 
     # Retrieve all items to get their IDs
-    all_items = crud.get_items(db = db, update_items = False)
+    all_items = db.scalars(crud.get_items(db = db)).all()
     assert len(all_items) != 0
 
     # Test retrieval of the first item by its actual ID
-    item = crud.get_item_by_id(db = db, id = all_items[0].id, update_items = False)
+    item = crud.get_item_by_id(db = db, id = all_items[0].id)
     assert item != None
     assert item.description == all_items[0].description
 
-    mock_update_retrieved.assert_not_called()
-
-    # FLAG TRUE
-
-    mock_update_retrieved.return_value = True
+# FUNCTION archive_retrieved_items
 
-    crud.get_item_by_id(db = db, id = all_items[0].id, update_items = True)
+def test_archive_retrieved_items(db):
+    now = datetime.now()
+    add_items_to_db(db, [
+        models.Item(description = "old", tag = "tag", state = "retrieved", dropoff_point_id = 1, retrieved_date = now - timedelta(weeks = 2)),
+        models.Item(description = "recent", tag = "tag", state = "retrieved", dropoff_point_id = 1, retrieved_date = now - timedelta(days = 1)),
+        models.Item(description = "stored", tag = "tag", state = "stored", dropoff_point_id = 1, retrieved_date = None),
+    ])
 
-    mock_update_retrieved.assert_not_called()
-    
-    # Searching third item (state is retrieved)
-    crud.get_item_by_id(db = db, id = all_items[2].id, update_items = True)
+    assert crud.archive_retrieved_items(db = db) == 1
+    states = {item.description: item.state for item in db.scalars(crud.get_items(db = db))}
+    assert states == {"old": "archived", "recent": "retrieved", "stored": "stored"}
 
-    mock_update_retrieved.assert_called()
+    assert crud.archive_retrieved_items(db = db) == 0
+    assert crud.archive_retrieved_items(db = db, cutoff = now) == 1
 
 def test_get_stored_items(db):
     
     add_items_to_db(db, item_bucket)
     filter_param = {}
     
-    items = crud.get_stored_items(db = db, filter = filter_param)
+    items = db.scalars(crud.get_stored_items(db = db, filter = filter_param)).all()
     assert len(items) == 1
     assert all(item.state == "stored" for item in items)
     
@@ -140,7 +121,7 @@ def test_get_stored_items(db):
         "tag": "tag1"
     }
     
-    items = crud.get_stored_items(db = db, filter = filter_param)
+    items = db.scalars(crud.get_stored_items(db = db, filter = filter_param)).all()
     assert len(items) == 1
     assert all(item.state == "stored" for item in items)
     
@@ -148,17 +129,16 @@ def test_get_stored_items(db):
         "dropoff_point_id": 2
     }
     
-    items = crud.get_stored_items(db = db, filter = filter_param)
+    items = db.scalars(crud.get_stored_items(db = db, filter = filter_param)).all()
     assert len(items) == 1
     assert all(item.state == "stored" for item in items)
 
-@patch("api.db_info.crud.update_retrieved_to_archived_items")
-def test_get_dropoff_point_items(mock_update_retrieved, db):
+def test_get_dropoff_point_items(db):
     
     add_items_to_db(db, item_bucket)
     filter_param = {}
     
-    items = crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param, update_items = False)
+    items = db.scalars(crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param)).all()
     assert len(items) == 2
     assert all(item.dropoff_point_id == 2 for item in items)
     
@@ -166,7 +146,7 @@ def test_get_dropoff_point_items(mock_update_retrieved, db):
         "tag": "tag2"
     }
     
-    items = crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param, update_items = False)
+    items = db.scalars(crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param)).all()
     assert len(items) == 1
     assert all(item.dropoff_point_id == 2 for item in items)
     
@@ -174,7 +154,7 @@ def test_get_dropoff_point_items(mock_update_retrieved, db):
         "state": "stored"
     }
     
-    items = crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param, update_items = False)
+    items = db.scalars(crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param)).all()
     assert len(items) == 1
     assert all(item.dropoff_point_id == 2 for item in items)
     
@@ -183,29 +163,49 @@ def test_get_dropoff_point_items(mock_update_retrieved, db):
         "state": "stored"
     }
     
-    items = crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param, update_items = False)
+    items = db.scalars(crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param)).all()
     assert len(items) == 0
-    
-    mock_update_retrieved.assert_not_called()
-    
-    # Flag
-    
-    mock_update_retrieved.return_value = True
-    
-    filter_param = {
-        "state": "stored"
-    }
-    crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param, update_items = True)
-    mock_update_retrieved.assert_not_called()
-    
-    filter_param = {}
-    crud.get_dropoff_point_items(db = db, dropoff_point_id = 2, filter = filter_param, update_items = True)
-    mock_update_retrieved.assert_called()
-    
 
-@patch("api.db_info.crud.upload_file_to_s3")
+# FUNCTION search_items
+
+def search_ids(db, query: str, filter: dict = {}) -> list:
+    return [item.id for item in db.scalars(crud.search_items(db = db, query = query, filter = filter)).all()]
+
+def test_search_items(db):
+
+    add_items_to_db(db, [
+        models.Item(description = "pink console with a sticker", tag = "console", state = "stored", dropoff_point_id = 1),
+        models.Item(description = "black phone", tag = "Telemóveis", state = "stored", dropoff_point_id = 2),
+        models.Item(description = "console charger", tag = "Carregadores", state = "reported", dropoff_point_id = None),
+    ])
+    pink_console, phone, charger = sorted(item.id for item in db.scalars(crud.get_items(db = db)).all())
+
+    # Matching the tag as well as the description ranks first
+    assert search_ids(db, "console") == [pink_console, charger]
+    # Every word must match, the last one as a prefix and regardless of case and accents
+    assert search_ids(db, "Console STICK") == [pink_console]
+    assert search_ids(db, "telemoveis") == [phone]
+    assert search_ids(db, "console phone") == []
+    # Full-text operators are searched as words
+    assert search_ids(db, 'console" OR "phone') == []
+    assert search_ids(db, "*") == []
+
+    assert search_ids(db, "console", {"state": "stored"}) == [pink_console]
+    assert search_ids(db, "console", {"dropoff_point_id": 1}) == [pink_console]
+    assert search_ids(db, "console", {"state": "reported", "dropoff_point_id": 1}) == []
+
+    # The index follows updates and deletes
+    db.get(models.Item, phone).description = "black console"
+    db.delete(db.get(models.Item, charger))
+    db.commit()
+    assert search_ids(db, "black") == [phone]
+    assert sorted(search_ids(db, "console")) == [pink_console, phone]
+    assert search_ids(db, "charger") == []
+
+@patch("api.db_info.uploads.submit")
+@patch("api.db_info.uploads.spool")
 @patch("api.db_info.contact.contact_reported_email")
-def test_create_item(mock_contact_reported_email, mock_upload_file_to_s3, db):
+def test_create_item(mock_contact_reported_email, mock_spool, mock_submit, db):
     mock_contact_reported_email.return_value = None
     
     new_item = schemas.ItemCreate(
@@ -220,8 +220,10 @@ def test_create_item(mock_contact_reported_email, mock_upload_file_to_s3, db):
     assert item.description == new_item.description
     assert item.report_email == None
     assert item.image == None
+    assert item.image_status == None
+    mock_submit.assert_not_called()
     
-    mock_upload_file_to_s3.return_value = "image_url_str"
+    mock_spool.return_value = ("spooled_image", "image_sha256")
     
     new_item = schemas.ItemCreate(
         description = "new_item_description",
@@ -234,11 +236,15 @@ def test_create_item(mock_contact_reported_email, mock_upload_file_to_s3, db):
     assert item != None
     assert item.description == new_item.description
     assert item.report_email == None
-    assert item.image == "image_url_str"
+    # Uploaded in the background once committed
+    assert item.image == "image_sha256"
+    assert item.image_status == "pending"
+    mock_submit.assert_called_once_with(item.id, item.image, "spooled_image")
 
-@patch("api.db_info.crud.upload_file_to_s3")
+@patch("api.db_info.uploads.submit")
+@patch("api.db_info.uploads.spool")
 @patch("api.db_info.contact.contact_new_report")
-def test_report_item(mock_contact_new_report, mock_upload_file_to_s3, db):
+def test_report_item(mock_contact_new_report, mock_spool, mock_submit, db):
     mock_contact_new_report.return_value = None
     
     new_item = schemas.ItemReport(
@@ -253,8 +259,10 @@ def test_report_item(mock_contact_new_report, mock_upload_file_to_s3, db):
     assert item.report_email == new_item.report_email
     assert item.dropoff_point_id == None
     assert item.image == None
+    assert item.image_status == None
+    mock_submit.assert_not_called()
     
-    mock_upload_file_to_s3.return_value = "image_url_str"
+    mock_spool.return_value = ("spooled_image", "image_sha256")
     
     new_item = schemas.ItemReport(
         description = "new_item_description",
@@ -267,7 +275,40 @@ def test_report_item(mock_contact_new_report, mock_upload_file_to_s3, db):
     assert item != None
     assert item.report_email == new_item.report_email
     assert item.dropoff_point_id == None
-    assert item.image == "image_url_str"
+    # Uploaded in the background once committed
+    assert item.image == "image_sha256"
+    assert item.image_status == "pending"
+    mock_submit.assert_called_once_with(item.id, item.image, "spooled_image")
+
+@patch("api.db_info.uploads.submit")
+@patch("api.db_info.contact.contact_reported_email")
+def test_create_items_with_the_same_picture(mock_contact_reported_email, mock_submit, db):
+    def create_item() -> models.Item:
+        new_item = schemas.ItemCreate(description = "charger", tag = "tag", image = UploadFile(io.BytesIO(b"image")), dropoff_point_id = 1)
+        return crud.create_item(db = db, new_item = new_item)
+    
+    # Content-addressed
+    first = create_item()
+    assert first.image == hashlib.sha256(b"image").hexdigest()
+    mock_submit.assert_called_once_with(first.id, first.image, ANY)
+    spooled_image = mock_submit.call_args.args[2]
+    
+    # Not uploaded again while the first upload is pending, nor once it is stored
+    second = create_item()
+    assert (second.image, second.image_status) == (first.image, "pending")
+    first.image_status = second.image_status = "ready"
+    db.commit()
+    third = create_item()
+    assert (third.image, third.image_status) == (first.image, "ready")
+    assert mock_submit.call_count == 1
+    os.unlink(spooled_image)
+    
+    # Deleted with the last item referring to it
+    crud.delete_item(db = db, id = first.id)
+    crud.delete_item(db = db, id = second.id)
+    assert db.scalars(select(models.PendingDelete)).all() == []
+    crud.delete_item(db = db, id = third.id)
+    assert sorted(db.scalars(select(models.PendingDelete.key)).all()) == sorted(images.variant_keys(first.image))
 
 @patch("api.db_info.contact.contact_netrieved_email")
 def test_retrieve_item(mock_contact_netrieved_email, db):
@@ -275,7 +316,7 @@ def test_retrieve_item(mock_contact_netrieved_email, db):
     
     add_items_to_db(db, [item_bucket[0]])
     
-    items = crud.get_items(db = db)
+    items = db.scalars(crud.get_items(db = db)).all()
     assert len(items) == 1
     
     item_in_db = items[0]
@@ -296,9 +337,7 @@ def test_retrieve_item(mock_contact_netrieved_email, db):
 @patch("api.db_info.crud.delete_file_from_s3")
 def test_delete_item(mock_delete_file_from_s3, db):
     
-    mock_delete_file_from_s3.return_value = True
-    
-    items = crud.get_items(db = db)
+    items = db.scalars(crud.get_items(db = db)).all()
     assert len(items) == 0
     
     return_value = crud.delete_item(db = db, id = 1)
@@ -306,14 +345,19 @@ def test_delete_item(mock_delete_file_from_s3, db):
     
     add_items_to_db(db, [item_bucket[0]])
     
-    items = crud.get_items(db = db)
+    items = db.scalars(crud.get_items(db = db)).all()
     assert len(items) == 1
     
     item_in_db = items[0]
     return_value = crud.delete_item(db = db, id = item_in_db.id)
     assert return_value == "OK"
     
-    items = crud.get_items(db = db)
+    items = db.scalars(crud.get_items(db = db)).all()
     assert len(items) == 0
+    
+    # The image is deleted from S3 in the background
+    mock_delete_file_from_s3.assert_not_called()
+    pending = db.scalars(select(models.PendingDelete.key)).all()
+    assert sorted(pending) == sorted(images.variant_keys("image"))
 
 
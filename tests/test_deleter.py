@@ -0,0 +1,133 @@
+from moto import mock_s3
+from pytest import fixture, mark
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from api.db_info import database, deleter, models, storage
+
+## HELPER COMPONENTS
+
+def put_objects(bucket: str, *keys):
+    for key in keys:
+        storage.get_client().put_object(Bucket = bucket, Key = key, Body = b"image")
+
+def stored_keys(bucket: str) -> list:
+    return sorted(object["Key"] for object in storage.get_client().list_objects_v2(Bucket = bucket).get("Contents", []))
+
+async def queue(session_factory, *keys):
+    async with session_factory() as db:
+        db.add_all(models.PendingDelete(key = key) for key in keys)
+        await db.commit()
+
+async def pending(session_factory) -> list:
+    async with session_factory() as db:
+        return (await db.scalars(select(models.PendingDelete).order_by(models.PendingDelete.id))).all()
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/deleter.db")
+    async with engine.begin() as connection:
+        await connection.run_sync(database.Base.metadata.create_all)
+    try:
+        yield async_sessionmaker(bind = engine, expire_on_commit = False)
+    finally:
+        await engine.dispose()
+
+@fixture(scope="function")
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_BUCKET_NAME", "uachado-test")
+    with mock_s3():
+        storage.close_client()
+        storage.s3_metrics.reset()
+        try:
+            storage.get_client().create_bucket(Bucket = "uachado-test")
+            yield "uachado-test"
+        finally:
+            storage.close_client()
+            storage.s3_metrics.reset()
+
+## UNIT TESTS
+
+# FUNCTION flush
+
+@mark.anyio
+async def test_flush_deletes_in_one_call(session_factory, bucket):
+    keys = [f"image-{index}" for index in range(5)]
+    put_objects(bucket, *keys)
+    # Queued twice, deleted once
+    await queue(session_factory, *keys, "image-0")
+
+    assert await deleter.flush(session_factory) == 6
+    assert stored_keys(bucket) == []
+    assert await pending(session_factory) == []
+    assert storage.s3_metrics.as_dict()["DeleteObjects"]["calls"] == 1
+    assert await deleter.flush(session_factory) == 0
+
+@mark.anyio
+async def test_flush_in_batches(session_factory, bucket, monkeypatch):
+    monkeypatch.setattr(deleter, "DELETER_BATCH_SIZE", 2)
+    put_objects(bucket, "a", "b", "c")
+    await queue(session_factory, "a", "b", "c")
+
+    assert [await deleter.flush(session_factory) for _ in range(3)] == [2, 1, 0]
+    assert stored_keys(bucket) == []
+
+@mark.anyio
+async def test_failed_deletions_are_retried(session_factory, bucket, monkeypatch):
+    put_objects(bucket, "a", "b")
+    await queue(session_factory, "a", "b")
+    monkeypatch.setattr(deleter, "delete_objects", lambda keys: {"b": "InternalError: We encountered an internal error"})
+
+    assert await deleter.flush(session_factory) == 2
+    [delete] = await pending(session_factory)
+    assert (delete.key, delete.attempts) == ("b", 1)
+    assert delete.last_error.startswith("InternalError")
+    # Not due until the backoff is over
+    assert await deleter.flush(session_factory) == 0
+
+@mark.anyio
+async def test_flush_needs_the_lease(session_factory, bucket):
+    await queue(session_factory, "a")
+    assert await deleter.flush(session_factory, owner = "worker-1") == 1
+    assert await deleter.flush(session_factory, owner = "worker-2") == None
+
+@mark.anyio
+async def test_flush_keeps_images_referenced_again(session_factory, bucket):
+    put_objects(bucket, "image-sha256", "image-sha256_160", "orphan")
+    await queue(session_factory, "image-sha256", "image-sha256_160", "orphan")
+    # Uploaded again for a new item before the deletion ran
+    async with session_factory() as db:
+        db.add(models.Item(description = "item", tag = "tag", state = "stored", image = "image-sha256"))
+        await db.commit()
+
+    assert await deleter.flush(session_factory) == 3
+    assert stored_keys(bucket) == ["image-sha256", "image-sha256_160"]
+    assert await pending(session_factory) == []
+
+# FUNCTION reconcile
+
+@mark.anyio
+async def test_reconcile_queues_orphans(session_factory, bucket):
+    put_objects(bucket, "kept", "kept_160", "queued", "orphan")
+    async with session_factory() as db:
+        db.add(models.Item(description = "item", tag = "tag", state = "stored", image = "kept"))
+        await db.commit()
+    await queue(session_factory, "queued")
+
+    # Too recent
+    assert await deleter.reconcile(session_factory, grace = 3600) == 0
+    assert await deleter.reconcile(session_factory, grace = -1) == 1
+    assert [delete.key for delete in await pending(session_factory)] == ["queued", "orphan"]
+    # Already queued
+    assert await deleter.reconcile(session_factory, grace = -1) == 0
+
+    await deleter.flush(session_factory)
+    assert stored_keys(bucket) == ["kept", "kept_160"]
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.responses import FileResponse
+from fastapi.testclient import TestClient
+from moto import mock_s3
+from pytest import fixture, mark, raises
+from api import main
+from api.db_info import crud, image_cache
+
+client = TestClient(main.app)
+
+## HELPER COMPONENTS
+
+class Bucket:
+    """Stand-in for S3 counting the downloads of each image."""
+
+    def __init__(self, images: dict):
+        self.images = images
+        self.downloads = []
+
+    def fetch(self, key: str):
+        def fetch(file) -> str:
+            self.downloads.append(key)
+            file.write(self.images[key])
+            return "image/png", hashlib.md5(self.images[key]).hexdigest(), None
+        return fetch
+
+def file_name(key: str, bucket: Bucket) -> str:
+    return f"{key}.{hashlib.md5(bucket.images[key]).hexdigest()}.png"
+
+# BEFORE and AFTER
+
+@fixture(scope="function")
+def cache(tmp_path):
+    return image_cache.DiskImageCache(str(tmp_path / "images"), max_bytes = 250)
+
+## UNIT TESTS
+
+# CLASS DiskImageCache
+
+def test_hits_are_served_from_disk(cache):
+    bucket = Bucket({"a": b"a" * 100})
+
+    image = cache.get("a", bucket.fetch("a"))
+    etag = hashlib.md5(b"a" * 100).hexdigest()
+    assert (os.path.basename(image.path), image.content_type, image.etag) == (f"a.{etag}.png", "image/png", etag)
+    assert cache.get("a", bucket.fetch("a")) == image
+
+    assert bucket.downloads == ["a"]
+    metrics = cache.as_dict()
+    assert (metrics["hits"], metrics["misses"], metrics["bytes_saved"], metrics["hit_ratio"]) == (1, 1, 100, 0.5)
+
+def test_least_recently_served_images_are_evicted(cache):
+    bucket = Bucket({key: key.encode() * 100 for key in "abc"})
+    cache.get("a", bucket.fetch("a"))
+    cache.get("b", bucket.fetch("b"))
+    cache.get("a", bucket.fetch("a"))
+
+    # 300 bytes are over the budget, "b" was served the longest ago
+    cache.get("c", bucket.fetch("c"))
+    assert (cache.size, cache.evictions) == (200, 1)
+    cache.get("a", bucket.fetch("a"))
+    cache.get("b", bucket.fetch("b"))
+    assert bucket.downloads == ["a", "b", "c", "b"]
+    assert sorted(os.listdir(cache.directory)) == [file_name("a", bucket), file_name("b", bucket)]
+
+def test_concurrent_misses_share_one_download(cache):
+    started, release = threading.Event(), threading.Event()
+    downloads = []
+
+    def fetch(file) -> str:
+        downloads.append(1)
+        started.set()
+        release.wait(5)
+        file.write(b"image")
+        return "image/jpeg", None, None
+
+    with ThreadPoolExecutor(8) as executor:
+        results = [executor.submit(cache.get, "a", fetch) for _ in range(8)]
+        started.wait(5)
+        # Let the other requests queue up behind the download
+        time.sleep(0.1)
+        release.set()
+        results = [result.result() for result in results]
+
+    assert len(downloads) == 1
+    assert all(result == results[0] for result in results)
+    assert (cache.misses, cache.coalesced) == (1, 7)
+
+def test_failed_downloads_are_not_cached(cache):
+    def fetch(file) -> str:
+        file.write(b"partial")
+        raise OSError("connection reset")
+
+    with raises(OSError):
+        cache.get("a", fetch)
+    assert cache.size == 0
+    assert os.listdir(cache.directory) == []
+
+def test_discarded_images_are_downloaded_again(cache):
+    bucket = Bucket({"a": b"a" * 100})
+    cache.get("a", bucket.fetch("a"))
+
+    cache.discard("a")
+    assert (cache.size, os.listdir(cache.directory)) == (0, [])
+    cache.get("a", bucket.fetch("a"))
+    assert bucket.downloads == ["a", "a"]
+
+def test_cache_is_reloaded_from_disk(cache):
+    bucket = Bucket({"a": b"a" * 100})
+    image = cache.get("a", bucket.fetch("a"))
+    open(os.path.join(cache.directory, "tmp1234.part"), "wb").close()
+
+    cache = image_cache.DiskImageCache(cache.directory, max_bytes = 250)
+    assert cache.get("a", bucket.fetch("a")) == image
+    assert bucket.downloads == ["a"]
+    assert os.listdir(cache.directory) == [file_name("a", bucket)]
+
+def test_accepts_plain_keys_only():
+    assert image_cache.DiskImageCache.accepts("0b7f3c2e-4d0e-4bb5-9d49-5c2a8a9e1f77")
+    assert not image_cache.DiskImageCache.accepts("../etc/passwd")
+
+# FUNCTION crud.get_image_from_s3
+
+@fixture(scope="function")
+def s3_image(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_BUCKET_NAME", "uachado-test")
+    monkeypatch.setattr(main.storage, "IMAGE_DELIVERY", "proxy")
+    monkeypatch.setattr(main.image_cache, "image_cache", main.image_cache.DiskImageCache(str(tmp_path / "images")))
+    with mock_s3():
+        main.storage.close_client()
+        try:
+            s3 = main.storage.get_client()
+            s3.create_bucket(Bucket = "uachado-test")
+            s3.put_object(Bucket = "uachado-test", Key = "image-uuid", Body = b"0123456789", ContentType = "image/png")
+            yield s3.head_object(Bucket = "uachado-test", Key = "image-uuid")["ETag"]
+        finally:
+            main.storage.close_client()
+
+def test_get_image_from_s3_through_the_cache(s3_image):
+    response = main.crud.get_image_from_s3("image-uuid")
+    assert isinstance(response, FileResponse)
+    assert response.media_type == "image/png"
+    assert open(response.path, "rb").read() == b"0123456789"
+
+    main.crud.delete_file_from_s3("image-uuid")
+    assert main.image_cache.image_cache.size == 0
+
+def test_image_validators_and_caching(s3_image):
+    for cached in [False, True]:
+        response = client.get("/inventory/v1/image/image-uuid")
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        assert response.headers["etag"] == s3_image
+        assert response.headers["content-length"] == "10"
+        assert response.headers["accept-ranges"] == "bytes"
+        assert "immutable" in response.headers["cache-control"]
+        assert "last-modified" in response.headers
+        assert (main.image_cache.image_cache.hits, main.image_cache.image_cache.misses) == (int(cached), 1)
+
+@mark.parametrize("cached", [False, True])
+def test_image_conditional_and_range_requests(s3_image, cached):
+    if cached:
+        client.get("/inventory/v1/image/image-uuid")
+
+    response = client.get("/inventory/v1/image/image-uuid", headers = {"If-None-Match": s3_image})
+    assert (response.status_code, response.content, response.headers["etag"]) == (304, b"", s3_image)
+    response = client.get("/inventory/v1/image/image-uuid", headers = {"If-None-Match": '"other"'})
+    assert (response.status_code, response.content) == (200, b"0123456789")
+
+    response = client.get("/inventory/v1/image/image-uuid", headers = {"Range": "bytes=2-5"})
+    assert (response.status_code, response.content) == (206, b"2345")
+    assert response.headers["content-range"] == "bytes 2-5/10"
+    response = client.get("/inventory/v1/image/image-uuid", headers = {"Range": "bytes=-3"})
+    assert (response.status_code, response.content) == (206, b"789")
+    response = client.get("/inventory/v1/image/image-uuid", headers = {"Range": "bytes=20-"})
+    assert response.status_code == 416
+
+    # Conditional and range requests do not download the whole image into the cache
+    assert main.image_cache.image_cache.misses == int(cached)
+
+def test_byte_range():
+    assert crud.byte_range(None, 10) == None
+    assert crud.byte_range("bytes=0-0", 10) == (0, 0)
+    assert crud.byte_range("bytes=4-", 10) == (4, 9)
+    assert crud.byte_range("bytes=4-100", 10) == (4, 9)
+    assert crud.byte_range("bytes=-4", 10) == (6, 9)
+    assert crud.byte_range("bytes=0-1,4-5", 10) == None
+    with raises(ValueError):
+        crud.byte_range("bytes=10-", 10)
+
+def test_etag_matches():
+    assert crud.etag_matches('"a"', "a")
+    assert crud.etag_matches('W/"b", "a"', "a")
+    assert crud.etag_matches("*", "a")
+    assert not crud.etag_matches('"b"', "a")
+    assert not crud.etag_matches(None, "a")
@@ -0,0 +1,83 @@
+import io
+
+from moto import mock_s3
+from PIL import Image, UnidentifiedImageError
+from pytest import fixture, raises
+from api.db_info import crud, images, storage, uploads
+
+## HELPER COMPONENTS
+
+def photo(width: int, height: int, format: str = "JPEG", orientation: int = None) -> bytes:
+    output = io.BytesIO()
+    exif = Image.Exif()
+    if orientation != None:
+        exif[0x0112] = orientation
+    Image.new("RGB", (width, height), "red").save(output, format, exif = exif)
+    return output.getvalue()
+
+# BEFORE and AFTER
+
+@fixture(scope="function")
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_BUCKET_NAME", "uachado-test")
+    with mock_s3():
+        storage.close_client()
+        try:
+            storage.get_client().create_bucket(Bucket = "uachado-test")
+            yield "uachado-test"
+        finally:
+            storage.close_client()
+            images.shutdown_pool()
+
+## UNIT TESTS
+
+# FUNCTION process_image
+
+def test_images_are_downscaled_and_reencoded():
+    variants = images.process_image(photo(4000, 3000))
+
+    assert list(variants) == [None] + images.IMAGE_THUMBNAIL_SIZES
+    with Image.open(io.BytesIO(variants[None])) as image:
+        assert image.format == images.IMAGE_FORMAT
+        assert image.size == (images.IMAGE_MAX_DIMENSION, images.IMAGE_MAX_DIMENSION * 3 // 4)
+    for size in images.IMAGE_THUMBNAIL_SIZES:
+        with Image.open(io.BytesIO(variants[size])) as thumbnail:
+            assert thumbnail.size == (size, size)
+
+def test_images_are_turned_upright():
+    # Taken with the phone rotated: stored landscape, displayed portrait
+    variants = images.process_image(photo(400, 300, orientation = 6))
+    with Image.open(io.BytesIO(variants[None])) as image:
+        assert image.size == (300, 400)
+
+def test_small_images_are_not_upscaled():
+    variants = images.process_image(photo(200, 100, format = "PNG"))
+    with Image.open(io.BytesIO(variants[None])) as image:
+        assert image.size == (200, 100)
+
+# FUNCTION uploads.store_image / crud.delete_file_from_s3
+
+def test_upload_and_delete_every_variant(bucket, tmp_path):
+    path = tmp_path / "image.upload"
+    path.write_bytes(photo(2000, 1000))
+
+    # Processed in the process pool
+    uploads.store_image(str(path), "image-uuid")
+
+    s3 = storage.get_client()
+    keys = sorted(object["Key"] for object in s3.list_objects_v2(Bucket = bucket)["Contents"])
+    assert keys == sorted(images.variant_keys("image-uuid"))
+    assert s3.head_object(Bucket = bucket, Key = "image-uuid_160")["ContentType"] == images.IMAGE_CONTENT_TYPE
+
+    assert crud.delete_file_from_s3("image-uuid") == True
+    assert "Contents" not in s3.list_objects_v2(Bucket = bucket)
+
+def test_upload_rejects_files_that_are_not_images(bucket, tmp_path):
+    path = tmp_path / "image.upload"
+    path.write_bytes(b"not an image")
+    with raises(UnidentifiedImageError):
+        uploads.store_image(str(path), "image-uuid")
+    assert "Contents" not in storage.get_client().list_objects_v2(Bucket = bucket)
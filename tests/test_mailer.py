@@ -0,0 +1,196 @@
+import socket
+
+from email import message_from_bytes
+
+from datetime import timedelta
+from aiosmtpd.controller import Controller
+from pytest import fixture, mark
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from api.db_info import archiver, contact, database, mailer, models
+
+## HELPER COMPONENTS
+
+class Inbox:
+    """aiosmtpd handler keeping the delivered emails, answering the given replies to some recipients."""
+
+    def __init__(self):
+        self.messages = []
+        self.bodies = []
+        self.peers = set()
+        self.replies = {}
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.replies:
+            return self.replies[address]
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.extend(envelope.rcpt_tos)
+        body = message_from_bytes(envelope.content).get_payload()[0]
+        self.bodies.append(body.get_payload(decode = True).decode())
+        self.peers.add(session.peer)
+        return "250 Message accepted for delivery"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def queue(session_factory, *recipients):
+    async with session_factory() as db:
+        for recipient in recipients:
+            db.add(models.EmailOutbox(recipient = recipient, subject = "subject", body = "body"))
+        await db.commit()
+
+async def queue_found_items(session_factory, recipient, *descriptions):
+    async with session_factory() as db:
+        for description in descriptions:
+            contact.send_email(db, recipient, contact.ITEMS_FOUND_SUBJECT, f"Descrição: {description}\n",
+                               digest_key = contact.ITEMS_FOUND_DIGEST)
+        await db.commit()
+
+async def outbox(session_factory) -> dict:
+    async with session_factory() as db:
+        return {email.recipient: email for email in await db.scalars(select(models.EmailOutbox))}
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/mailer.db")
+    async with engine.begin() as connection:
+        await connection.run_sync(database.Base.metadata.create_all)
+    try:
+        yield async_sessionmaker(bind = engine, expire_on_commit = False)
+    finally:
+        await engine.dispose()
+
+@fixture(scope="function")
+def inbox():
+    inbox = Inbox()
+    controller = Controller(inbox, hostname = "127.0.0.1", port = free_port())
+    controller.start()
+    try:
+        yield inbox, mailer.SMTPConnection(host = controller.hostname, port = controller.port, username = "",
+                                           starttls = False, sender = "uachado@ua.pt")
+    finally:
+        controller.stop()
+
+## UNIT TESTS
+
+# FUNCTION deliver
+
+@mark.anyio
+async def test_deliver_reuses_one_connection(session_factory, inbox):
+    inbox, connection = inbox
+    await queue(session_factory, "a@ua.pt", "b@ua.pt", "c@ua.pt")
+
+    assert await mailer.deliver(session_factory, connection) == 3
+    assert await mailer.deliver(session_factory, connection) == 0
+    await queue(session_factory, "d@ua.pt")
+    assert await mailer.deliver(session_factory, connection) == 1
+
+    assert sorted(inbox.messages) == ["a@ua.pt", "b@ua.pt", "c@ua.pt", "d@ua.pt"]
+    assert len(inbox.peers) == 1
+    assert connection.connections == 1
+    assert all(email.status == "sent" and email.sent_at != None for email in (await outbox(session_factory)).values())
+    connection.close()
+
+@mark.anyio
+async def test_deliver_reconnects(session_factory, inbox):
+    inbox, connection = inbox
+    await queue(session_factory, "a@ua.pt")
+    await mailer.deliver(session_factory, connection)
+
+    # The server dropped the idle connection
+    connection.server.close()
+    await queue(session_factory, "b@ua.pt")
+    assert await mailer.deliver(session_factory, connection) == 1
+
+    assert sorted(inbox.messages) == ["a@ua.pt", "b@ua.pt"]
+    assert connection.connections == 2
+    connection.close()
+
+@mark.anyio
+async def test_deliver_retries_with_backoff(session_factory, inbox, monkeypatch):
+    inbox, connection = inbox
+    monkeypatch.setattr(mailer, "MAILER_MAX_ATTEMPTS", 2)
+    inbox.replies["later@ua.pt"] = "451 Try again later"
+    await queue(session_factory, "later@ua.pt", "a@ua.pt")
+
+    assert await mailer.deliver(session_factory, connection) == 2
+    emails = await outbox(session_factory)
+    assert emails["a@ua.pt"].status == "sent"
+    later = emails["later@ua.pt"]
+    assert (later.status, later.attempts) == ("pending", 1)
+    assert "451" in later.last_error
+    assert later.next_attempt_at - archiver.utcnow() > timedelta(seconds = mailer.MAILER_BACKOFF - 5)
+
+    # Not due yet
+    assert await mailer.deliver(session_factory, connection) == 0
+
+    async with session_factory() as db:
+        email = await db.get(models.EmailOutbox, later.id)
+        email.next_attempt_at = archiver.utcnow()
+        await db.commit()
+    assert await mailer.deliver(session_factory, connection) == 1
+    later = (await outbox(session_factory))["later@ua.pt"]
+    assert (later.status, later.attempts) == ("dead", 2)
+    assert inbox.messages == ["a@ua.pt"]
+    connection.close()
+
+@mark.anyio
+async def test_deliver_gives_up_on_permanent_failures(session_factory, inbox):
+    inbox, connection = inbox
+    inbox.replies["unknown@ua.pt"] = "550 No such user"
+    await queue(session_factory, "unknown@ua.pt")
+
+    await mailer.deliver(session_factory, connection)
+
+    unknown = (await outbox(session_factory))["unknown@ua.pt"]
+    assert (unknown.status, unknown.attempts) == ("dead", 1)
+    connection.close()
+
+@mark.anyio
+async def test_deliver_needs_the_lease(session_factory, inbox):
+    inbox, connection = inbox
+    await queue(session_factory, "a@ua.pt")
+    async with session_factory() as db:
+        assert await archiver.acquire_lease(db, mailer.MAILER_LEASE_NAME, "worker-1", ttl = 60)
+
+    assert await mailer.deliver(session_factory, connection, owner = "worker-2") == None
+    assert inbox.messages == []
+    assert (await outbox(session_factory))["a@ua.pt"].status == "pending"
+
+@mark.anyio
+async def test_deliver_merges_digests_per_recipient(session_factory, inbox, monkeypatch):
+    inbox, connection = inbox
+    await queue_found_items(session_factory, "a@ua.pt", *[f"item {number}" for number in range(10)])
+    await queue_found_items(session_factory, "b@ua.pt", "item 3")
+    await queue(session_factory, "c@ua.pt")
+
+    # The digests wait for the window to end
+    assert await mailer.deliver(session_factory, connection) == 1
+    assert inbox.messages == ["c@ua.pt"]
+
+    monkeypatch.setattr(mailer, "MAILER_DIGEST_WINDOW", 0)
+    assert await mailer.deliver(session_factory, connection) == 2
+    assert inbox.messages == ["c@ua.pt", "a@ua.pt", "b@ua.pt"]
+    assert all(f"item {number}" in inbox.bodies[1] for number in range(10))
+    assert "item 3" in inbox.bodies[2] and "item 4" not in inbox.bodies[2]
+
+    async with session_factory() as db:
+        assert all(email.status == "sent" for email in await db.scalars(select(models.EmailOutbox)))
+    assert await mailer.deliver(session_factory, connection) == 0
+    connection.close()
+
+def test_backoff_doubles_up_to_the_maximum():
+    assert mailer.backoff(1) == timedelta(seconds = mailer.MAILER_BACKOFF)
+    assert mailer.backoff(3) == timedelta(seconds = 4 * mailer.MAILER_BACKOFF)
+    assert mailer.backoff(100) == timedelta(seconds = mailer.MAILER_BACKOFF_MAX)
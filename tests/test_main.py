@@ -1,5 +1,10 @@
+from datetime import datetime
 from io import BytesIO
 from fastapi.testclient import TestClient
+from pytest import fixture
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
 from unittest.mock import patch
 from api import main
 
@@ -7,25 +12,78 @@ from api import main
 
 client = TestClient(main.app)
 
+def override_verify_access():
+    return {"user": "dummy_user"}
+
+main.app.dependency_overrides[main.auth.verify_access] = override_verify_access
+
 date_mock_element = "2023-01-01T00:00:00"
+retrieved_date_mock_element = "2023-01-02 10:00:00"
 first_page = "?page=1&size=1"
 invalid_id_message = {'detail' : 'INVALID ID FORMAT'}
 
 urls = {
     "base": "/inventory/v1",
     "get_all_items": "/inventory/v1/items",
+    "get_all_items_by_cursor": "/inventory/v1/items/cursor",
     "get_item_by_id": "/inventory/v1/items/id",
     "get_all_tags": "/inventory/v1/items/tags",
     "get_stored_items": "/inventory/v1/items/stored",
+    "get_stored_items_by_cursor": "/inventory/v1/items/stored/cursor",
+    "search_items": "/inventory/v1/items/search",
     "get_dropoff_point_items": "/inventory/v1/items/point",
     "get_dropoff_point_items_1": "/inventory/v1/items/point/1",
     "retrieve_item": "/inventory/v1/items/retrieve",
     "create_item": "/inventory/v1/items/create",
     "report_item": "/inventory/v1/items/report",
     "delete_item": "/inventory/v1/items/id",
-    "get_image": "/inventory/v1/image/uuid"
+    "get_image": "/inventory/v1/image/uuid",
+    "get_pool_metrics": "/inventory/v1/metrics/pool",
+    "get_s3_metrics": "/inventory/v1/metrics/s3"
 }
 
+# BEFORE and AFTER
+
+def database_with_items(url: str, items: list) -> async_sessionmaker:
+    """Create a SQLite database holding the given items and return an async session factory bound to it."""
+    engine = create_engine(url)
+    main.database.Base.metadata.create_all(bind = engine)
+    with Session(engine) as db:
+        for item in items:
+            item = dict(item)
+            for date_column in ["insertion_date", "retrieved_date"]:
+                if isinstance(item.get(date_column), str):
+                    item[date_column] = datetime.fromisoformat(item[date_column])
+            db.add(main.crud.models.Item(**item))
+        db.commit()
+    engine.dispose()
+    return async_sessionmaker(bind = create_async_engine(main.database.to_async_url(url)), expire_on_commit = False)
+
+def select_items(*ids):
+    """The query a mocked listing returns: the seeded items with the given ids, in that order."""
+    Item = main.crud.models.Item
+    return select(Item).where(Item.id.in_(ids)).order_by(Item.id)
+
+@fixture(scope="function")
+def items_database(tmp_path, monkeypatch):
+    """Seed a SQLite file with the given items and serve both the primary and the read sessions from it."""
+    def seed(items: list):
+        session_factory = database_with_items(f"sqlite:///{tmp_path}/items.db", items)
+        monkeypatch.setattr(main.database, "AsyncSessionLocal", session_factory)
+        monkeypatch.setattr(main.database, "AsyncReadSessionLocal", session_factory)
+    return seed
+
+@fixture(scope="function")
+def primary_and_replica(tmp_path, monkeypatch):
+    """Two SQLite files standing in for the primary database and its read replica, holding different rows."""
+    session_factories = {}
+    for name in ["primary", "replica"]:
+        item = {"description": name, "tag": "tag", "state": "stored", "dropoff_point_id": 1}
+        session_factories[name] = database_with_items(f"sqlite:///{tmp_path}/{name}.db", [item])
+    monkeypatch.setattr(main.database, "AsyncSessionLocal", session_factories["primary"])
+    monkeypatch.setattr(main.database, "AsyncReadSessionLocal", session_factories["replica"])
+    return session_factories
+
 ## INTEGRATION TESTS
 
 # BASE
@@ -36,20 +94,31 @@ def test_base():
     assert response.status_code == 200
     assert response.json() == {"response": "Hello World!"}
 
+# AUTHENTICATION
+
+def test_authentication_required():
+    main.app.dependency_overrides.pop(main.auth.verify_access)
+    try:
+        response = client.get(urls["get_all_items"])
+        assert response.status_code == 401
+        response = client.delete(urls["delete_item"] + "/1")
+        assert response.status_code == 401
+    finally:
+        main.app.dependency_overrides[main.auth.verify_access] = override_verify_access
+
 # GET ALL ITEMS
 
-@patch("api.main.auth.verify_access")
-@patch("api.main.crud.get_items")
-def test_get_all_items(mock_get_items, mock_verify_access):
-    mock_verify_access.return_value = {"user": "dummy_user"}
+@patch("api.main.async_crud.get_items")
+def test_get_all_items(mock_get_items, items_database):
     mock_items = [
-        {"id" : 1, "description": "description", "tag": "tag", "image": "image", "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
-        {"id" : 2, "description": "description", "tag": "tag", "image": "image", "state": "reported", "dropoff_point_id": None, "insertion_date": date_mock_element, "report_email": "report_email", "retrieved_email": None, "retrieved_date": None},
-        {"id" : 3, "description": "description", "tag": "tag", "image": "image", "state": "retrieved", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": "retrieved_date"},
-        {"id" : 4, "description": "description", "tag": "tag", "image": "image", "state": "archived", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": "retrieved_date"},
+        {"id" : 1, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 2, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "reported", "dropoff_point_id": None, "insertion_date": date_mock_element, "report_email": "report_email", "retrieved_email": None, "retrieved_date": None},
+        {"id" : 3, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "retrieved", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": retrieved_date_mock_element},
+        {"id" : 4, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "archived", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": retrieved_date_mock_element},
     ]
 
-    mock_get_items.return_value = mock_items
+    items_database(mock_items)
+    mock_get_items.return_value = select_items(*[item["id"] for item in mock_items])
     
     response = client.get(urls["get_all_items"])
     assert response.status_code == 200
@@ -59,11 +128,35 @@ def test_get_all_items(mock_get_items, mock_verify_access):
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[0]]
 
+@patch("api.main.async_crud.get_items")
+def test_get_all_items_by_cursor(mock_get_items, items_database):
+    mock_items = [
+        {"id" : 1, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": "2023-01-03T00:00:00", "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 2, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": "2023-01-02T00:00:00", "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 3, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "archived", "dropoff_point_id": 1, "insertion_date": "2023-01-01T00:00:00", "report_email": None, "retrieved_email": None, "retrieved_date": None},
+    ]
+
+    items_database(mock_items)
+    mock_get_items.return_value = main.crud.items_statement()
+
+    response = client.get(urls["get_all_items_by_cursor"] + "?size=2&include_total=true")
+    assert response.status_code == 200
+    assert response.json()["items"] == mock_items[0:2]
+    assert response.json()["total"] == 3
+
+    response = client.get(urls["get_all_items_by_cursor"] + "?size=2&cursor=" + response.json()["next_cursor"])
+    assert response.status_code == 200
+    assert response.json() == {"items": mock_items[2:], "size": 2, "next_cursor": None, "total": None}
+
+    response = client.get(urls["get_all_items_by_cursor"] + "?cursor=abc")
+    assert response.status_code == 400
+    assert response.json() == {"detail": "INVALID CURSOR"}
+
 # GET ITEM BY ID
 
-@patch("api.main.crud.get_item_by_id")
+@patch("api.main.async_crud.get_item_by_id")
 def test_get_item_by_id(mock_get_item_by_id):
-    mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": "image", "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None}
+    mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None}
     mock_get_item_by_id.return_value = mock_item
     
     response = client.get(urls["get_item_by_id"] + "/1")
@@ -87,15 +180,16 @@ def test_get_all_tags():
 
 # GET STORED ITEMS
 
-@patch("api.main.crud.get_stored_items")
-def test_get_stored_items(mock_get_stored_items):
+@patch("api.main.async_crud.get_stored_items")
+def test_get_stored_items(mock_get_stored_items, items_database):
     mock_items = [
-        {"id" : 1, "description": "description", "tag": "tag1", "image": "image", "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
-        {"id" : 2, "description": "description", "tag": "tag1", "image": "image", "state": "stored", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
-        {"id" : 3, "description": "description", "tag": "tag2", "image": "image", "state": "stored", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 1, "description": "description", "tag": "tag1", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 2, "description": "description", "tag": "tag1", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 3, "description": "description", "tag": "tag2", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
     ]
 
-    mock_get_stored_items.return_value = mock_items
+    items_database(mock_items)
+    mock_get_stored_items.return_value = select_items(*[item["id"] for item in mock_items])
     response = client.post(urls["get_stored_items"], json = {"filter": {}})
     assert response.status_code == 200
     assert response.json()["items"] == mock_items
@@ -104,37 +198,91 @@ def test_get_stored_items(mock_get_stored_items):
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[0]]
 
-    mock_get_stored_items.return_value = [mock_items[0], mock_items[1]]
+    mock_get_stored_items.return_value = select_items(1, 2)
     response = client.post(urls["get_stored_items"], json = {"filter": {"tag":"tag1"}})
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[0], mock_items[1]]
 
-    mock_get_stored_items.return_value = [mock_items[1], mock_items[2]]
+    mock_get_stored_items.return_value = select_items(2, 3)
     response = client.post(urls["get_stored_items"], json = {"filter": {"dropoff_point_id":2}})
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[1], mock_items[2]]
 
-    mock_get_stored_items.return_value = [mock_items[2]]
+    mock_get_stored_items.return_value = select_items(3)
     response = client.post(urls["get_stored_items"], json = {"filter": {"tag":"tag2", "dropoff_point_id": 2}})
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[2]]
     
     
 
+def test_get_stored_items_by_cursor(items_database):
+    items_database([{"description": f"item_{index}", "tag": "tag", "state": "stored", "dropoff_point_id": 1} for index in range(3)] +
+                   [{"description": "archived", "tag": "tag", "state": "archived", "dropoff_point_id": 1}])
+
+    descriptions = []
+    url = urls["get_stored_items_by_cursor"] + "?size=1"
+    for _ in range(4):
+        response = client.post(url, json = {"filter": {}})
+        assert response.status_code == 200
+        descriptions.extend(item["description"] for item in response.json()["items"])
+        if response.json()["next_cursor"] == None:
+            break
+        url = urls["get_stored_items_by_cursor"] + "?size=1&cursor=" + response.json()["next_cursor"]
+    assert response.json()["next_cursor"] == None
+    assert sorted(descriptions) == ["item_0", "item_1", "item_2"]
+
+# SEARCH ITEMS
+
+def test_search_items(items_database, monkeypatch):
+    items_database([
+        {"description": "pink console with a sticker", "tag": "console", "state": "stored", "dropoff_point_id": 1},
+        {"description": "black phone", "tag": "phone", "state": "stored", "dropoff_point_id": 2},
+        {"description": "console charger", "tag": "charger", "state": "stored", "dropoff_point_id": 2},
+        {"description": "grey console", "tag": "console", "state": "reported", "dropoff_point_id": None},
+    ])
+
+    response = client.get(urls["search_items"], params = {"q": "console"})
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == [1, 3]
+    assert response.json()["total"] == 2
+
+    response = client.get(urls["search_items"], params = {"q": "console", "page": 2, "size": 1})
+    assert [item["id"] for item in response.json()["items"]] == [3]
+
+    response = client.get(urls["search_items"], params = {"q": "cons", "dropoff_point_id": 2})
+    assert [item["id"] for item in response.json()["items"]] == [3]
+
+    response = client.get(urls["search_items"], params = {"q": "?!"})
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+    response = client.get(urls["search_items"])
+    assert response.status_code == 422
+
+    # Only the 'stored' items are public
+    response = client.get(urls["search_items"], params = {"q": "console", "state": "reported"})
+    assert response.status_code == 401
+
+    async def verify_access(request):
+        return {"user": "dummy_user"}
+    monkeypatch.setattr(main.auth, "verify_access", verify_access)
+    response = client.get(urls["search_items"], params = {"q": "console", "state": "reported"})
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == [4]
+
 # GET DROP-OFF POINT ITEMS
 
-@patch("api.main.auth.verify_access")
-@patch("api.main.crud.get_dropoff_point_items")
-def test_get_dropoff_point_items(mock_get_dropoff_point_items, mock_verify_access):
-    mock_verify_access.return_value = {"user": "dummy_user"}
+@patch("api.main.async_crud.get_dropoff_point_items")
+def test_get_dropoff_point_items(mock_get_dropoff_point_items, items_database):
     mock_items = [
-        {"id" : 1, "description": "description", "tag": "tag1", "image": "image", "state": "stored", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
-        {"id" : 2, "description": "description", "tag": "tag1", "image": "image", "state": "reported", "dropoff_point_id": None, "insertion_date": date_mock_element, "report_email": "report_email", "retrieved_email": None, "retrieved_date": None},
-        {"id" : 3, "description": "description", "tag": "tag2", "image": "image", "state": "retrieved", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": "retrieved_date"},
-        {"id" : 4, "description": "description", "tag": "tag2", "image": "image", "state": "archived", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": "retrieved_date"},
+        {"id" : 1, "description": "description", "tag": "tag1", "image": "image", "image_status": None, "state": "stored", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None},
+        {"id" : 2, "description": "description", "tag": "tag1", "image": "image", "image_status": None, "state": "reported", "dropoff_point_id": None, "insertion_date": date_mock_element, "report_email": "report_email", "retrieved_email": None, "retrieved_date": None},
+        {"id" : 3, "description": "description", "tag": "tag2", "image": "image", "image_status": None, "state": "retrieved", "dropoff_point_id": 2, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": retrieved_date_mock_element},
+        {"id" : 4, "description": "description", "tag": "tag2", "image": "image", "image_status": None, "state": "archived", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": retrieved_date_mock_element},
     ]
 
-    mock_get_dropoff_point_items.return_value = mock_items
+    items_database(mock_items)
+    mock_get_dropoff_point_items.return_value = select_items(*[item["id"] for item in mock_items])
     response = client.put(urls["get_dropoff_point_items_1"], json = {"filter": {}})
     assert response.status_code == 200
     assert response.json()["items"] == mock_items
@@ -143,23 +291,23 @@ def test_get_dropoff_point_items(mock_get_dropoff_point_items, mock_verify_acces
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[0]]
 
-    mock_get_dropoff_point_items.return_value = [mock_items[0], mock_items[1]]
+    mock_get_dropoff_point_items.return_value = select_items(1, 2)
     response = client.put(urls["get_dropoff_point_items_1"], json = {"filter": {"tag":"tag1"}})
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[0], mock_items[1]]
 
-    mock_get_dropoff_point_items.return_value = [mock_items[0], mock_items[2]]
+    mock_get_dropoff_point_items.return_value = select_items(1, 3)
     response = client.put(urls["get_dropoff_point_items_1"], json = {"filter": {"dropoff_point_id":2}})
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[0], mock_items[2]]
 
     for index, state in enumerate(["stored", "reported", "retrieved", "archived"]):
-        mock_get_dropoff_point_items.return_value = [mock_items[index]]
+        mock_get_dropoff_point_items.return_value = select_items(index + 1)
         response = client.put(urls["get_dropoff_point_items_1"], json = {"filter": {"state":state}})
         assert response.status_code == 200
         assert response.json()["items"] == [mock_items[index]]
 
-    mock_get_dropoff_point_items.return_value = [mock_items[2]]
+    mock_get_dropoff_point_items.return_value = select_items(3)
     response = client.put(urls["get_dropoff_point_items_1"], json = {"filter": {"tag": "tag2", "state": "retrieved", "dropoff_point_id": 2}})
     assert response.status_code == 200
     assert response.json()["items"] == [mock_items[2]]
@@ -170,12 +318,10 @@ def test_get_dropoff_point_items(mock_get_dropoff_point_items, mock_verify_acces
 
 # RETRIEVE ITEM
 
-@patch("api.main.auth.verify_access")
-@patch("api.main.crud.retrieve_item")
-def test_retrieve_item(mock_retrieve_item, mock_verify_access):
-    mock_verify_access.return_value = {"user": "dummy_user"}
+@patch("api.main.async_crud.retrieve_item")
+def test_retrieve_item(mock_retrieve_item):
     
-    retrieved_mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": "image", "state": "retrieved", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": "retrieved_date"}
+    retrieved_mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": "image", "image_status": None, "state": "retrieved", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": "retrieved_email", "retrieved_date": retrieved_date_mock_element}
     mock_retrieve_item.return_value = retrieved_mock_item
     
     response = client.put(urls["retrieve_item"] + "/1", json = {"email": "retrieved_email"})
@@ -192,11 +338,9 @@ def test_retrieve_item(mock_retrieve_item, mock_verify_access):
 
 # CREATE NEW ITEM
 
-@patch("api.main.auth.verify_access")
-@patch("api.main.crud.create_item")
-def test_create_item(mock_create_item, mock_verify_access):
-    mock_verify_access.return_value = {"user": "dummy_user"}
-    mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None}
+@patch("api.main.async_crud.create_item")
+def test_create_item(mock_create_item):
+    mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": None, "image_status": None, "state": "stored", "dropoff_point_id": 1, "insertion_date": date_mock_element, "report_email": None, "retrieved_email": None, "retrieved_date": None}
     mock_create_item.return_value = mock_item
     
     fake_file = BytesIO(b"fake image content")
@@ -229,9 +373,9 @@ def test_create_item(mock_create_item, mock_verify_access):
 
 # REPORT NEW ITEM
 
-@patch("api.main.crud.report_item")
+@patch("api.main.async_crud.report_item")
 def test_report_item(mock_report_item):
-    mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": None, "state": "reported", "dropoff_point_id": None, "insertion_date": date_mock_element, "report_email": "report_email", "retrieved_email": None, "retrieved_date": None}
+    mock_item = {"id" : 1, "description": "description", "tag": "tag", "image": None, "image_status": None, "state": "reported", "dropoff_point_id": None, "insertion_date": date_mock_element, "report_email": "report_email", "retrieved_email": None, "retrieved_date": None}
     mock_report_item.return_value = mock_item
     
     fake_file = BytesIO(b"fake image content")
@@ -263,10 +407,8 @@ def test_report_item(mock_report_item):
 
 # DELETE EXISTING ITEM
 
-@patch("api.main.auth.verify_access")
-@patch("api.main.crud.delete_item")
-def test_delete_item(mock_delete_item, mock_verify_access):
-    mock_verify_access.return_value = {"user": "dummy_user"}
+@patch("api.main.async_crud.delete_item")
+def test_delete_item(mock_delete_item):
     mock_delete_item.return_value = "OK"
     
     response = client.delete(urls["delete_item"] + "/1")
@@ -283,10 +425,70 @@ def test_delete_item(mock_delete_item, mock_verify_access):
     
 # GET IMAGE FROM S3 BUCKET
 
+@patch("api.main.storage.IMAGE_DELIVERY", "proxy")
 @patch("api.main.crud.get_image_from_s3")
 def test_get_image_from_s3(mock_get_image_from_s3):
     mock_get_image_from_s3.return_value = {"body": "StreamingResponse_template"}
     
     response = client.get(urls["get_image"])
     assert response.status_code == 200
-    assert response.json() == {"body": "StreamingResponse_template"}
\ No newline at end of file
+    assert response.json() == {"body": "StreamingResponse_template"}
+
+@patch("api.main.storage.IMAGE_DELIVERY", "redirect")
+@patch("api.main.crud.get_image_url")
+def test_get_image_from_s3_redirects(mock_get_image_url):
+    mock_get_image_url.return_value = ("https://bucket.s3.amazonaws.com/uuid?X-Amz-Signature=signature", 120.5)
+
+    response = client.get(urls["get_image"], follow_redirects = False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://bucket.s3.amazonaws.com/uuid?X-Amz-Signature=signature"
+    assert response.headers["cache-control"] == "private, max-age=120"
+    mock_get_image_url.assert_called_once_with("uuid")
+
+@patch("api.main.storage.IMAGE_DELIVERY", "redirect")
+@patch("api.main.crud.get_image_url")
+def test_get_image_thumbnail(mock_get_image_url):
+    mock_get_image_url.return_value = ("https://bucket.s3.amazonaws.com/uuid_160", 120)
+
+    response = client.get(urls["get_image"] + "?size=160", follow_redirects = False)
+    assert response.status_code == 307
+    mock_get_image_url.assert_called_once_with("uuid_160")
+
+    response = client.get(urls["get_image"] + "?size=161", follow_redirects = False)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "INVALID IMAGE SIZE"}
+
+# GET DATABASE POOL METRICS
+
+def test_get_pool_metrics():
+    response = client.get(urls["get_pool_metrics"])
+    assert response.status_code == 200
+    assert "sync" not in response.json()
+    assert "pool_class" in response.json()["async"]
+
+def test_get_s3_metrics():
+    main.storage.s3_metrics.reset()
+    main.storage.s3_metrics.record("GetObject", 0.02)
+    response = client.get(urls["get_s3_metrics"])
+    main.storage.s3_metrics.reset()
+    assert response.status_code == 200
+    assert response.json()["GetObject"]["calls"] == 1
+
+# READ REPLICA ROUTING
+
+def test_read_replica_routing(primary_and_replica):
+    response = client.post(urls["get_stored_items"], json = {"filter": {}})
+    assert [item["description"] for item in response.json()["items"]] == ["replica"]
+
+    response = client.get(urls["get_item_by_id"] + "/1")
+    assert response.json()["description"] == "replica"
+
+    response = client.post(urls["get_stored_items"], json = {"filter": {}}, headers = {"X-Read-From-Primary": "true"})
+    assert [item["description"] for item in response.json()["items"]] == ["primary"]
+
+    response = client.get(urls["get_item_by_id"] + "/1", headers = {"X-Read-From-Primary": "true"})
+    assert response.json()["description"] == "primary"
+
+    # Staff views and writes stay on the primary
+    response = client.get(urls["get_all_items"])
+    assert [item["description"] for item in response.json()["items"]] == ["primary"]
@@ -0,0 +1,116 @@
+from pytest import fixture
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from api.db_info import database, matching, models
+
+## HELPER COMPONENTS
+
+reports = [
+    ("I lost an amazing pink console with a sticker", "console"),
+    ("Perdi o meu telemóvel samsung preto", "Telemóveis"),
+    ("iPhone 12 azul com capa", "Telemóveis"),
+    ("Carregador USB-C branco", "Carregadores"),
+    ("chaves do carro com porta-chaves vermelho", "Chaves"),
+]
+
+def add_reports(db: Session, items: list):
+    for description, tag in items:
+        db.add(models.Item(description = description, tag = tag, state = "reported", report_email = f"{tag}@ua.pt"))
+    db.commit()
+
+# BEFORE and AFTER
+
+@fixture(scope="function")
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/matching.db")
+    database.Base.metadata.create_all(bind = engine)
+    matching.reports_index.clear()
+    matching.stored_index.clear()
+    try:
+        with Session(engine) as session:
+            yield session
+    finally:
+        engine.dispose()
+
+## UNIT TESTS
+
+# CLASS SimilarityIndex
+
+def test_features_fold_accents_and_case():
+    assert matching.features("Telemóvel", None) == matching.features("telemovel", None)
+    assert "t:telemoveis" in matching.features("phone", "Telemóveis")
+
+def test_index_ranks_by_similarity():
+    index = matching.SimilarityIndex("reported")
+    for id, (description, tag) in enumerate(reports, 1):
+        index.add(id, description, tag)
+
+    results = index.query("Someone found an amazing pink console with a sticker", "console", 5, 0)
+    assert results[0][0] == 1
+    assert 0.9 < results[0][1] <= 1.0001
+    assert [score for _, score in results] == sorted([score for _, score in results], reverse = True)
+
+    # Words match across accents and inflections through their trigrams
+    assert index.query("telemovel samsung", "Telemóveis", 1, 0.4)[0][0] == 2
+    # Sharing the tag alone is not a match
+    assert index.query("carteira castanha", "Telemóveis", 5, 0.4) == []
+
+    index.discard(2)
+    assert [id for id, _ in index.query("telemovel samsung", "Telemóveis", 5, 0)].count(2) == 0
+
+def test_index_walks_rare_features_first(monkeypatch):
+    monkeypatch.setattr(matching, "MATCH_MAX_POSTINGS", 10)
+    index = matching.SimilarityIndex("reported")
+    for id in range(1, 101):
+        index.add(id, f"black wallet {id}", "Carteiras")
+    index.add(101, "black umbrella", "Guarda-chuvas")
+
+    # "black" is in every item and the budget only covers the postings of the rarer features
+    assert [id for id, _ in index.query("black umbrella", "Guarda-chuvas", 5, 0)] == [101]
+    assert [id for id, _ in index.query("black wallet 42", "Carteiras", 1, 0)] == [42]
+
+# FUNCTION similar_reports / similar_stored_items
+
+def test_similar_reports(db):
+    add_reports(db, reports)
+    matches = matching.similar_reports(db, "pink console with a sticker", "console")
+    assert [item.description for item in matches] == [reports[0][0]]
+
+    # Reports added later, possibly by another worker, are picked up on the next lookup
+    add_reports(db, [("pink console controller", "console")])
+    matches = matching.similar_reports(db, "pink console with a sticker", "console")
+    assert [item.description for item in matches] == [reports[0][0], "pink console controller"]
+
+    # Reports retrieved or deleted by another worker are dropped from the results and from the index
+    db.get(models.Item, matches[0].id).state = "retrieved"
+    db.delete(db.get(models.Item, matches[1].id))
+    db.commit()
+    assert matching.similar_reports(db, "pink console with a sticker", "console") == []
+    assert matching.reports_index.removed == {matches[0].id, matches[1].id}
+
+def test_discard(db):
+    add_reports(db, reports)
+    assert len(matching.similar_reports(db, "iPhone azul", "Telemóveis")) == 1
+
+    # This worker deleted the report
+    matching.discard(3)
+    assert matching.reports_index.removed == {3}
+    assert matching.similar_reports(db, "iPhone azul", "Telemóveis") == []
+
+def test_similar_stored_items(db):
+    db.add(models.Item(description = "Samsung galaxy preto", tag = "Telemóveis", state = "stored"))
+    db.add(models.Item(description = "Samsung galaxy preto", tag = "Telemóveis", state = "archived"))
+    add_reports(db, reports)
+
+    matches = matching.similar_stored_items(db, "Perdi o meu telemóvel samsung preto", "Telemóveis")
+    assert [(item.description, item.state) for item in matches] == [("Samsung galaxy preto", "stored")]
+
+def test_index_is_rebuilt(db, monkeypatch):
+    add_reports(db, reports)
+    matching.similar_reports(db, "pink console", "console")
+    matching.reports_index.discard(1)
+
+    monkeypatch.setattr(matching, "MATCH_REBUILD_INTERVAL", 0)
+    matching.similar_reports(db, "pink console", "console")
+    assert matching.reports_index.removed == set()
+    assert matching.reports_index.size == len(reports)
@@ -0,0 +1,108 @@
+from datetime import datetime
+from alembic import command
+from pytest import fixture
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import Session
+from api.db_info import crud, migrations, models, pagination
+
+# BEFORE and AFTER
+
+@fixture(scope="function")
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+
+def index_names(connection) -> set:
+    return {index["name"] for index in inspect(connection).get_indexes("items")}
+
+## UNIT TESTS
+
+# FUNCTION upgrade
+
+def test_upgrade_empty_database(engine):
+    with engine.begin() as connection:
+        migrations.upgrade(connection)
+
+    with engine.connect() as connection:
+        assert migrations.current_revision(connection) == "0011"
+        assert {"leases", "email_outbox", "pending_deletes"} <= set(inspect(connection).get_table_names())
+        assert {"ix_items_insertion_date",
+                "ix_items_state_tag_insertion_date",
+                "ix_items_dropoff_point_state_insertion_date",
+                "ix_items_tag_state"} <= index_names(connection)
+
+def test_upgrade_database_created_without_migrations(engine):
+    # Simulate a database created by Base.metadata.create_all before migrations existed
+    with engine.begin() as connection:
+        command.upgrade(migrations.get_config(connection), migrations.BASELINE_REVISION)
+        connection.execute(text("DROP TABLE alembic_version"))
+        connection.execute(text("INSERT INTO items (description, tag, state) VALUES ('description', 'tag', 'stored')"))
+
+    with engine.begin() as connection:
+        assert "ix_items_tag_state" not in index_names(connection)
+        migrations.upgrade(connection)
+
+    with engine.connect() as connection:
+        assert migrations.current_revision(connection) == "0011"
+        assert "ix_items_tag_state" in index_names(connection)
+        assert connection.execute(text("SELECT COUNT(*) FROM items")).scalar() == 1
+
+def test_downgrade_removes_indexes(engine):
+    with engine.begin() as connection:
+        migrations.upgrade(connection)
+        command.downgrade(migrations.get_config(connection), migrations.BASELINE_REVISION)
+
+    with engine.connect() as connection:
+        assert index_names(connection) == {"ix_items_id"}
+
+def test_upgrade_normalizes_insertion_dates(engine):
+    # Rows written by the former func.now() default, plus one without a date
+    with engine.begin() as connection:
+        migrations.upgrade(connection, "0002")
+        for index in range(3):
+            connection.execute(text(f"INSERT INTO items (description, tag, state, insertion_date) VALUES ('item_{index}', 'tag', 'stored', CURRENT_TIMESTAMP)"))
+        connection.execute(text("INSERT INTO items (description, tag, state) VALUES ('undated', 'tag', 'stored')"))
+        migrations.upgrade(connection)
+
+    with Session(engine) as db:
+        seen = []
+        cursor = None
+        for _ in range(5):
+            items = db.scalars(pagination.cursor_statement(crud.items_statement(), cursor, 1)).all()
+            seen.append(items[0].id)
+            if len(items) == 1:
+                break
+            cursor = pagination.encode_cursor(items[0])
+        assert sorted(seen) == [1, 2, 3, 4]
+
+def test_upgrade_converts_retrieved_date(engine):
+    with engine.begin() as connection:
+        migrations.upgrade(connection, "0004")
+        for value in ["'2023-11-20 10:30:00.123456'", "'2023-11-21 08:00:00'", "'not a date'", "NULL"]:
+            connection.execute(text(f"INSERT INTO items (description, tag, state, insertion_date, retrieved_date) VALUES ('item', 'tag', 'retrieved', CURRENT_TIMESTAMP, {value})"))
+        migrations.upgrade(connection)
+
+    with Session(engine) as db:
+        dates = [item.retrieved_date for item in db.scalars(select(models.Item).order_by(models.Item.id))]
+    assert dates == [datetime(2023, 11, 20, 10, 30, 0, 123456), datetime(2023, 11, 21, 8, 0), None, None]
+
+    with engine.connect() as connection:
+        assert "ix_items_state_retrieved_date" in index_names(connection)
+
+def test_upgrade_indexes_existing_items_for_search(engine):
+    with engine.begin() as connection:
+        migrations.upgrade(connection, "0005")
+        connection.execute(text("INSERT INTO items (description, tag, state, insertion_date) VALUES ('pink console', 'console', 'stored', CURRENT_TIMESTAMP)"))
+        migrations.upgrade(connection)
+        connection.execute(text("INSERT INTO items (description, tag, state, insertion_date) VALUES ('console charger', 'charger', 'stored', CURRENT_TIMESTAMP)"))
+
+    with Session(engine) as db:
+        assert sorted(item.id for item in db.scalars(crud.search_items(db, "console", {}))) == [1, 2]
+
+    with engine.begin() as connection:
+        command.downgrade(migrations.get_config(connection), "0005")
+        assert "items_fts" not in inspect(connection).get_table_names()
+        connection.execute(text("DELETE FROM items"))
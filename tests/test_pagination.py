@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from pytest import fixture, mark, raises
+from api.db_info import crud, database, models, pagination, schemas
+
+## HELPER COMPONENTS
+
+def add_dated_items(db, count: int):
+    # Pairs of items share an insertion date, so pages have to break ties on the id
+    start = datetime(2023, 1, 1)
+    for index in range(count):
+        db.add(models.Item(description = f"item_{index}", tag = "tag", state = "stored", dropoff_point_id = 1,
+                           insertion_date = start + timedelta(minutes = index // 2)))
+    db.commit()
+
+async def walk_pages(db, statement, size: int, max_pages: int) -> list:
+    # Bounded, so a cursor that does not advance fails the test instead of hanging it
+    seen = []
+    cursor = None
+    for _ in range(max_pages):
+        page = await pagination.cursor_paginate(db, statement, pagination.ItemCursorParams(cursor = cursor, size = size))
+        seen.extend(item.id for item in page.items)
+        assert page.total == None
+        cursor = page.next_cursor
+        if cursor == None:
+            return seen
+    raise AssertionError(f"cursor did not reach the last page after {max_pages} pages: {seen}")
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+async def db():
+    async with database.async_engine.connect() as connection:
+        await connection.run_sync(database.Base.metadata.create_all)
+        await connection.commit()
+        transaction = await connection.begin()
+        session = database.AsyncSessionLocal(bind = connection)
+        try:
+            yield session
+        finally:
+            await session.close()
+            await transaction.rollback()
+
+## UNIT TESTS
+
+# FUNCTION encode_cursor / decode_cursor
+
+def test_cursor_round_trip():
+    item = models.Item(id = 7, insertion_date = datetime(2023, 1, 1, 12, 30, 15, 250))
+    assert pagination.decode_cursor(pagination.encode_cursor(item)) == (item.insertion_date, 7)
+
+def test_decode_invalid_cursor():
+    for cursor in ["abc", "", pagination.base64.urlsafe_b64encode(b'{"id": 1}').decode()]:
+        with raises(pagination.InvalidCursorError):
+            pagination.decode_cursor(cursor)
+
+# FUNCTION cursor_paginate
+
+@mark.anyio
+async def test_cursor_paginate_walks_every_item_once(db):
+    await db.run_sync(add_dated_items, 7)
+    expected = (await db.scalars(crud.items_statement())).all()
+
+    seen = await walk_pages(db, crud.items_statement(), size = 3, max_pages = 4)
+    assert seen == [item.id for item in expected]
+
+@mark.anyio
+async def test_cursor_paginate_default_insertion_dates(db):
+    # Items inserted in the same instant through the model default, as the API does
+    for index in range(3):
+        db.add(models.Item(description = f"item_{index}", tag = "tag", state = "stored", dropoff_point_id = 1))
+    await db.commit()
+
+    seen = await walk_pages(db, crud.items_statement(), size = 1, max_pages = 4)
+    assert sorted(seen) == sorted(set(seen))
+    assert len(seen) == 3
+
+# FUNCTION lean_statement / validate_rows
+
+@mark.anyio
+async def test_lean_path_matches_orm_items(db):
+    await db.run_sync(add_dated_items, 5)
+    statement = crud.stored_items_statement({"tag": "tag"})
+
+    orm_items = [schemas.Item.model_validate(item, from_attributes = True) for item in await db.scalars(statement)]
+    lean_items = pagination.validate_rows((await db.execute(pagination.lean_statement(statement))).all())
+
+    assert lean_items == orm_items
+
+@mark.anyio
+async def test_cursor_paginate_total_and_last_page(db):
+    await db.run_sync(add_dated_items, 4)
+
+    page = await pagination.cursor_paginate(db, crud.items_statement(), pagination.ItemCursorParams(size = 4, include_total = True))
+    assert len(page.items) == 4
+    assert page.total == 4
+    assert page.next_cursor == None
+
+    page = await pagination.cursor_paginate(db, crud.stored_items_statement({"tag": "other"}), pagination.ItemCursorParams(size = 4))
+    assert page.items == []
+    assert page.next_cursor == None
@@ -0,0 +1,88 @@
+import io
+
+from concurrent.futures import ThreadPoolExecutor
+from moto import mock_s3
+from pytest import fixture
+from api.db_info import crud, storage
+
+# BEFORE and AFTER
+
+@fixture(scope="function")
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_BUCKET_NAME", "uachado-test")
+    with mock_s3():
+        storage.close_client()
+        storage.s3_metrics.reset()
+        storage.presigned_urls.clear()
+        storage.open_client()
+        storage.get_client().create_bucket(Bucket = "uachado-test")
+        try:
+            yield "uachado-test"
+        finally:
+            storage.close_client()
+            storage.s3_metrics.reset()
+
+## UNIT TESTS
+
+# FUNCTION get_client
+
+def test_client_is_shared(bucket):
+    with ThreadPoolExecutor(8) as executor:
+        clients = list(executor.map(lambda _: crud.get_s3(), range(32)))
+    assert all(client is clients[0] for client in clients)
+
+def test_client_config(bucket, monkeypatch):
+    monkeypatch.setattr(storage, "S3_MAX_POOL_CONNECTIONS", 64)
+    monkeypatch.setattr(storage, "S3_READ_TIMEOUT", 10)
+    config = storage.create_client().meta.config
+    assert config.max_pool_connections == 64
+    assert config.read_timeout == 10
+    assert config.retries == {"total_max_attempts": storage.S3_MAX_ATTEMPTS, "mode": storage.S3_RETRY_MODE}
+
+# CLASS InstrumentedS3Client
+
+def test_operations_are_timed(bucket):
+    storage.s3_metrics.reset()
+
+    crud.get_s3().upload_fileobj(io.BytesIO(b"image"), bucket, "image-uuid")
+    assert crud.get_s3().get_object(Bucket = bucket, Key = "image-uuid")["Body"].read() == b"image"
+    crud.get_s3().delete_object(Bucket = bucket, Key = "image-uuid")
+
+    metrics = storage.s3_metrics.as_dict()
+    assert {"PutObject", "GetObject", "DeleteObject"} <= set(metrics)
+    assert all(stats["calls"] == 1 and stats["errors"] == 0 for operation, stats in metrics.items()
+               if operation in ["PutObject", "GetObject", "DeleteObject"])
+    assert metrics["GetObject"]["max_latency_ms"] >= metrics["GetObject"]["mean_latency_ms"] > 0
+
+def test_failed_operations_are_counted(bucket):
+    storage.s3_metrics.reset()
+    try:
+        crud.get_s3().get_object(Bucket = bucket, Key = "missing")
+    except crud.get_s3().exceptions.NoSuchKey:
+        pass
+
+    assert storage.s3_metrics.as_dict()["GetObject"]["errors"] == 1
+
+# FUNCTION presigned_url
+
+def test_presigned_urls_are_cached(bucket, monkeypatch):
+    url, max_age = crud.get_image_url("image-uuid")
+    assert "image-uuid" in url and "Signature" in url
+    assert storage.PRESIGNED_URL_EXPIRES - storage.PRESIGNED_URL_MARGIN - 5 < max_age
+    assert crud.get_image_url("image-uuid")[0] == url
+    assert (storage.presigned_urls.hits, storage.presigned_urls.misses) == (1, 1)
+
+    # Signed again once the URL is about to expire
+    monkeypatch.setattr(storage, "PRESIGNED_URL_MARGIN", storage.PRESIGNED_URL_EXPIRES)
+    storage.presigned_urls.clear()
+    crud.get_image_url("image-uuid")
+    crud.get_image_url("image-uuid")
+    assert storage.presigned_urls.misses == 2
+
+def test_deleted_images_drop_their_presigned_url(bucket):
+    crud.get_image_url("image-uuid")
+    crud.delete_file_from_s3("image-uuid")
+    assert storage.presigned_urls.get("image-uuid") == None
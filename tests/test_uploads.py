@@ -0,0 +1,163 @@
+import hashlib
+import io
+import os
+
+from datetime import datetime, timedelta
+from fastapi import UploadFile
+from moto import mock_s3
+from PIL import Image
+from pytest import fixture, mark
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from api.db_info import database, images, models, storage, uploads
+
+## HELPER COMPONENTS
+
+def photo() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (400, 300), "red").save(output, "JPEG")
+    return output.getvalue()
+
+def add_item(session_factory: sessionmaker, **columns) -> int:
+    with session_factory() as db:
+        item = models.Item(description = "item", tag = "tag", state = "stored", **columns)
+        db.add(item)
+        db.commit()
+        return item.id
+
+def image_status(session_factory: sessionmaker, item_id: int):
+    with session_factory() as db:
+        return db.get(models.Item, item_id).image_status
+
+def spooled(data: bytes) -> str:
+    return uploads.spool(UploadFile(io.BytesIO(data)))[0]
+
+# BEFORE and AFTER
+
+@fixture
+def anyio_backend():
+    return "asyncio"
+
+@fixture(scope="function")
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/uploads.db")
+    database.Base.metadata.create_all(bind = engine)
+    try:
+        yield sessionmaker(bind = engine, expire_on_commit = False)
+    finally:
+        engine.dispose()
+
+@fixture(scope="function")
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_BUCKET_NAME", "uachado-test")
+    monkeypatch.setattr(uploads, "UPLOAD_BACKOFF", 0)
+    with mock_s3():
+        storage.close_client()
+        try:
+            storage.get_client().create_bucket(Bucket = "uachado-test")
+            yield "uachado-test"
+        finally:
+            uploads.shutdown_executor()
+            storage.close_client()
+            images.shutdown_pool()
+
+def stored_keys(bucket: str) -> list:
+    return sorted(object["Key"] for object in storage.get_client().list_objects_v2(Bucket = bucket).get("Contents", []))
+
+## UNIT TESTS
+
+# FUNCTION spool
+
+def test_spool_copies_and_hashes_the_upload():
+    path, key = uploads.spool(UploadFile(io.BytesIO(b"image")))
+    assert key == hashlib.sha256(b"image").hexdigest()
+    try:
+        with open(path, "rb") as file:
+            assert file.read() == b"image"
+    finally:
+        os.unlink(path)
+
+# FUNCTION submit / upload_image
+
+def test_uploaded_image_is_ready(bucket, session_factory):
+    item_id = add_item(session_factory, image = "image-uuid", image_status = "pending")
+    path = spooled(photo())
+
+    assert uploads.submit(item_id, "image-uuid", path, session_factory).result() == "ready"
+    assert image_status(session_factory, item_id) == "ready"
+    assert stored_keys(bucket) == sorted(images.variant_keys("image-uuid"))
+    # The spool file is removed
+    assert not os.path.exists(path)
+
+def test_file_that_is_not_an_image_fails_at_once(bucket, session_factory):
+    item_id = add_item(session_factory, image = "image-uuid", image_status = "pending")
+    path = spooled(b"not an image")
+
+    assert uploads.upload_image(item_id, "image-uuid", path, session_factory) == "failed"
+    assert image_status(session_factory, item_id) == "failed"
+    assert stored_keys(bucket) == []
+    assert not os.path.exists(path)
+
+def test_failed_uploads_are_retried(bucket, session_factory, monkeypatch):
+    item_id = add_item(session_factory, image = "image-uuid", image_status = "pending")
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_ATTEMPTS", 3)
+    attempts = []
+    def store_image(path, key):
+        attempts.append(key)
+        if len(attempts) < 3:
+            raise ConnectionError("S3 is unreachable")
+    monkeypatch.setattr(uploads, "store_image", store_image)
+
+    assert uploads.upload_image(item_id, "image-uuid", spooled(b"image"), session_factory) == "ready"
+    assert len(attempts) == 3
+
+    # Until there are no attempts left
+    attempts.clear()
+    item_id = add_item(session_factory, image = "other-uuid", image_status = "pending")
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_ATTEMPTS", 2)
+    assert uploads.upload_image(item_id, "other-uuid", spooled(b"image"), session_factory) == "failed"
+    assert image_status(session_factory, item_id) == "failed"
+
+def test_items_sharing_the_image_are_ready(bucket, session_factory):
+    waiting = add_item(session_factory, image = "image-sha256", image_status = "pending")
+    failed = add_item(session_factory, image = "image-sha256", image_status = "failed")
+    other = add_item(session_factory, image = "other-sha256", image_status = "pending")
+
+    assert uploads.upload_image(waiting, "image-sha256", spooled(photo()), session_factory) == "ready"
+    assert [image_status(session_factory, item_id) for item_id in [waiting, failed, other]] == ["ready", "ready", "pending"]
+
+def test_image_of_a_deleted_item_is_removed(bucket, session_factory):
+    item_id = add_item(session_factory, image = "image-uuid", image_status = "pending")
+    with session_factory() as db:
+        db.delete(db.get(models.Item, item_id))
+        db.commit()
+
+    assert uploads.upload_image(item_id, "image-uuid", spooled(photo()), session_factory) == "ready"
+    assert stored_keys(bucket) == []
+
+# FUNCTION fail_stale_uploads
+
+@mark.anyio
+async def test_stale_uploads_are_failed(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/uploads.db")
+    async with engine.begin() as connection:
+        await connection.run_sync(database.Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind = engine, expire_on_commit = False)
+    try:
+        async with session_factory() as db:
+            stale = models.Item(description = "stale", tag = "tag", state = "stored", image = "stale-uuid", image_status = "pending",
+                                insertion_date = datetime.now() - timedelta(hours = 2))
+            recent = models.Item(description = "recent", tag = "tag", state = "stored", image = "recent-uuid", image_status = "pending")
+            db.add_all([stale, recent])
+            await db.commit()
+
+            assert await uploads.fail_stale_uploads(db, stale_after = 3600) == 1
+            await db.refresh(stale)
+            await db.refresh(recent)
+            assert (stale.image_status, recent.image_status) == ("failed", "pending")
+    finally:
+        await engine.dispose()